@@ -0,0 +1,243 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#!/usr/bin/python
+
+import argparse
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Measures the cold start of the Python handlers: every run imports the handler in a fresh
+# interpreter, then invokes it once with the AWS calls answered by botocore stubs, so the
+# clients are created and the requests serialized for real but nothing leaves the machine.
+# Execute as - python coldStartBenchmark.py [--runs N] [--handler NAME] [--save FILE] [--baseline FILE] [--max-regression PERCENT]
+# For Example:
+# Record a baseline -> python benchmarks/coldStartBenchmark.py --runs 20 --save coldstart-baseline.json
+# Check a change against it -> python benchmarks/coldStartBenchmark.py --runs 20 --baseline coldstart-baseline.json --max-regression 20
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_PATHS = [
+    os.path.join(ROOT, 'functions', 'DetectAnomaliesFunction'),
+    os.path.join(ROOT, 'functions', 'InstrumentationLayer', 'python')
+]
+
+# The benchmark never calls AWS - the credentials only keep botocore from looking any up
+ENVIRONMENT = {
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'AWS_DEFAULT_REGION': 'eu-west-1',
+    'REGION': 'eu-west-1',
+    'LFV_PROJECT_NAME': 'benchmark',
+    'LFV_MODEL_VERSION': '1',
+    'DYNAMODB_TABLE_NAME': 'benchmark',
+    'TARGET_ARN': 'arn:aws:sns:eu-west-1:123456789012:benchmark',
+    'CONFIDENCE_THRESHOLD': '0.2',
+    'STATE_MACHINE_ARN': 'arn:aws:states:eu-west-1:123456789012:stateMachine:benchmark'
+}
+
+BUCKET = 'benchmark-images'
+KEY = 'CAM123456-1.jpeg'
+IMAGE = b'\xff\xd8\xff\xe0' + b'\x00' * 4096
+
+
+def s3_event():
+    return {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': KEY}}}]}
+
+
+def image_details_event():
+    image_details = {
+        'CameraId': 'CAM123456',
+        'AssemblyLineId': 'ASM123456',
+        'ImageId': KEY,
+        'ImageUrl': 's3://' + BUCKET + '/' + KEY,
+        'CaptureTime': '2021-01-01T00:00:00.000000',
+        'DateTime': '2021-01-01T00:00:00.000000#' + KEY,
+        'IsAnomalous': True,
+        'Confidence': 0.9
+    }
+    return {'Input': {'Payload': {'ImageDetails': image_details}}}
+
+
+def stub_responses(handler):
+    """
+    One response per (kind, service, operation) - enough for a single image.
+    """
+    from botocore.response import StreamingBody
+
+    responses = {}
+    if handler == 'detectAnomaliesPipeline':
+        # Queued before the write - the fused pipeline looks up the stored result first
+        responses[('resource', 'dynamodb', 'get_item')] = {}
+    responses.update({
+        ('client', 's3', 'get_object'): {
+            'Body': StreamingBody(io.BytesIO(IMAGE), len(IMAGE)),
+            'ContentType': 'image/jpeg',
+            'ContentLength': len(IMAGE),
+            'LastModified': datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+            'Metadata': {'cameraid': 'CAM123456', 'assemblylineid': 'ASM123456', 'imageid': KEY}
+        },
+        ('client', 'lookoutvision', 'detect_anomalies'): {
+            'DetectAnomalyResult': {'Source': {'Type': 'direct'}, 'IsAnomalous': True, 'Confidence': 0.9}
+        },
+        ('resource', 'dynamodb', 'put_item'): {},
+        ('client', 'sns', 'publish'): {'MessageId': 'benchmark'},
+        ('client', 'stepfunctions', 'start_execution'): {
+            'executionArn': 'arn:aws:states:eu-west-1:123456789012:execution:benchmark:1',
+            'startDate': datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        }
+    })
+    return responses
+
+# Handler module and the event it is invoked with
+HANDLERS = {
+    'startStateMachineExecution': s3_event,
+    'startDetectAnomalies': lambda: {'Input': {'Bucket': BUCKET, 'Key': KEY}},
+    'putItemInDynamoDb': image_details_event,
+    'publishMessage': image_details_event,
+    'detectAnomaliesPipeline': s3_event
+}
+
+
+def stubbed_factory(awsClients, handler):
+    """
+    Creates the real client or resource, then queues the canned responses of its service.
+    """
+    from botocore.stub import Stubber
+
+    responses = stub_responses(handler)
+
+    def factory(kind, service_name):
+        created = awsClients.create(kind, service_name)
+        stubber = Stubber(created if kind == 'client' else created.meta.client)
+        for (response_kind, response_service, operation), response in responses.items():
+            if (response_kind, response_service) == (kind, service_name):
+                stubber.add_response(operation, response)
+        stubber.activate()
+        return created
+
+    return factory
+
+
+def measure(handler):
+    """
+    Runs in the child interpreter - imports and invokes one handler.
+    """
+    sys.path[:0] = CODE_PATHS
+    # The handlers log to stdout, which carries the result back to the parent
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        module = importlib.import_module(handler)
+        import_ms = (time.perf_counter() - start) * 1000
+
+        import awsClients
+        clients_at_import = len(awsClients.clients)
+        awsClients.set_factory(stubbed_factory(awsClients, handler))
+
+        event = HANDLERS[handler]()
+        start = time.perf_counter()
+        module.lambda_handler(event, None)
+        first_call_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'ImportMs': round(import_ms, 2),
+        'FirstCallMs': round(first_call_ms, 2),
+        'ClientsAtImport': clients_at_import,
+        'ClientsAfterCall': len(awsClients.clients)
+    }
+
+
+def run_child(handler):
+    environment = dict(os.environ)
+    environment.update(ENVIRONMENT)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', handler],
+        env=environment, stdout=subprocess.PIPE, check=True, universal_newlines=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    summary = {}
+    for name in ['ImportMs', 'FirstCallMs']:
+        values = [run[name] for run in runs]
+        summary[name] = round(statistics.median(values), 2)
+        summary[name.replace('Ms', 'MaxMs')] = round(max(values), 2)
+    summary['ColdStartMs'] = round(statistics.median([run['ImportMs'] + run['FirstCallMs'] for run in runs]), 2)
+    summary['ClientsAtImport'] = max(run['ClientsAtImport'] for run in runs)
+    summary['ClientsAfterCall'] = max(run['ClientsAfterCall'] for run in runs)
+    return summary
+
+
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    for handler, summary in results.items():
+        if handler not in baseline:
+            continue
+        for name in ['ImportMs', 'FirstCallMs', 'ColdStartMs']:
+            limit = baseline[handler][name] * (1 + max_regression / 100.0)
+            if summary[name] > limit:
+                regressions.append('{} {} {} ms - baseline {} ms'.format(handler, name, summary[name], baseline[handler][name]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lookout For Vision - Serverless App - Cold Start Benchmark')
+    parser.add_argument('--runs', type=int, default=10, help='Fresh interpreters per handler (default: 10)')
+    parser.add_argument('--handler', action='append', choices=sorted(HANDLERS), help='Handler to measure, may be repeated (default: all)')
+    parser.add_argument('--save', help='File to write the results to as JSON')
+    parser.add_argument('--baseline', help='Results saved by an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=20, help='Percentage above the baseline medians reported as a regression (default: 20)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    results = {}
+    print('{:<28} {:>10} {:>10} {:>12} {:>10} {:>8}'.format('Handler', 'Import ms', 'Call ms', 'Cold start', 'Max ms', 'Clients'))
+    for handler in args.handler or list(HANDLERS):
+        runs = [run_child(handler) for _ in range(args.runs)]
+        summary = summarize(runs)
+        results[handler] = summary
+        print('{:<28} {:>10} {:>10} {:>12} {:>10} {:>8}'.format(
+            handler, summary['ImportMs'], summary['FirstCallMs'], summary['ColdStartMs'],
+            round(summary['ImportMaxMs'] + summary['FirstCallMaxMs'], 2),
+            '{}/{}'.format(summary['ClientsAtImport'], summary['ClientsAfterCall'])))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
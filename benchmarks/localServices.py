@@ -0,0 +1,807 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import datetime
+import io
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# In-process stand-ins for the AWS services used by the Lambda functions, so that the
+# handlers can be driven end to end without network access. Only the operations and
+# response fields the handlers use are implemented.
+
+REGION = 'eu-west-1'
+
+# Attribute names that DynamoDB only accepts in expressions through ExpressionAttributeNames
+RESERVED_WORDS = frozenset('''
+    ABORT ABSOLUTE ACTION ADD AFTER AGENT AGGREGATE ALL ALLOCATE ALTER ANALYZE AND ANY ARCHIVE ARE ARRAY AS ASC ASCII
+    ASENSITIVE ASSERTION ASYMMETRIC AT ATOMIC ATTACH ATTRIBUTE AUTH AUTHORIZATION AUTHORIZE AUTO AVG BACK BACKUP BASE
+    BATCH BEFORE BEGIN BETWEEN BIGINT BINARY BIT BLOB BLOCK BOOLEAN BOTH BREADTH BUCKET BULK BY BYTE CALL CALLED CALLING
+    CAPACITY CASCADE CASCADED CASE CAST CATALOG CHAR CHARACTER CHECK CLASS CLOB CLOSE CLUSTER CLUSTERED CLUSTERING
+    CLUSTERS COALESCE COLLATE COLLATION COLLECTION COLUMN COLUMNS COMBINE COMMENT COMMIT COMPACT COMPILE COMPRESS
+    CONDITION CONFLICT CONNECT CONNECTION CONSISTENCY CONSISTENT CONSTRAINT CONSTRAINTS CONSTRUCTOR CONSUMED CONTINUE
+    CONVERT COPY CORRESPONDING COUNT COUNTER CREATE CROSS CUBE CURRENT CURSOR CYCLE DATA DATABASE DATE DATETIME DAY
+    DEALLOCATE DEC DECIMAL DECLARE DEFAULT DEFERRABLE DEFERRED DEFINE DEFINED DEFINITION DELETE DELIMITED DEPTH DEREF
+    DESC DESCRIBE DESCRIPTOR DETACH DETERMINISTIC DIAGNOSTICS DIRECTORIES DISABLE DISCONNECT DISTINCT DISTRIBUTE DO
+    DOMAIN DOUBLE DROP DUMP DURATION DYNAMIC EACH ELEMENT ELSE ELSEIF EMPTY ENABLE END EQUAL EQUALS ERROR ESCAPE
+    ESCAPED EVAL EVALUATE EXCEEDED EXCEPT EXCEPTION EXCEPTIONS EXCLUSIVE EXEC EXECUTE EXISTS EXIT EXPLAIN EXPLODE
+    EXPORT EXPRESSION EXTENDED EXTERNAL EXTRACT FAIL FALSE FAMILY FETCH FIELDS FILE FILTER FILTERING FINAL FINISH FIRST
+    FIXED FLATTERN FLOAT FOR FORCE FOREIGN FORMAT FORWARD FOUND FREE FROM FULL FUNCTION FUNCTIONS GENERAL GENERATE GET
+    GLOB GLOBAL GO GOTO GRANT GREATER GROUP GROUPING HANDLER HASH HAVE HAVING HEAP HIDDEN HOLD HOUR IDENTIFIED IDENTITY
+    IF IGNORE IMMEDIATE IMPORT IN INCLUDING INCLUSIVE INCREMENT INCREMENTAL INDEX INDEXED INDEXES INDICATOR INFINITE
+    INITIALLY INLINE INNER INNTER INOUT INPUT INSENSITIVE INSERT INSTEAD INT INTEGER INTERSECT INTERVAL INTO INVALIDATE
+    IS ISOLATION ITEM ITEMS ITERATE JOIN KEY KEYS LAG LANGUAGE LARGE LAST LATERAL LEAD LEADING LEAVE LEFT LENGTH LESS
+    LEVEL LIKE LIMIT LIMITED LINES LIST LOAD LOCAL LOCALTIME LOCALTIMESTAMP LOCATION LOCATOR LOCK LOCKS LOG LOGED LONG
+    LOOP LOWER MAP MATCH MATERIALIZED MAX MAXLEN MEMBER MERGE METHOD METRICS MIN MINUS MINUTE MISSING MOD MODE MODIFIES
+    MODIFY MODULE MONTH MULTI MULTISET NAME NAMES NATIONAL NATURAL NCHAR NCLOB NEW NEXT NO NONE NOT NULL NULLIF NUMBER
+    NUMERIC OBJECT OF OFFLINE OFFSET OLD ON ONLINE ONLY OPAQUE OPEN OPERATOR OPTION OR ORDER ORDINALITY OTHER OTHERS OUT
+    OUTER OUTPUT OVER OVERLAPS OVERRIDE OWNER PAD PARALLEL PARAMETER PARAMETERS PARTIAL PARTITION PARTITIONED PARTITIONS
+    PATH PERCENT PERCENTILE PERMISSION PERMISSIONS PIPE PIPELINED PLAN POOL POSITION PRECISION PREPARE PRESERVE PRIMARY
+    PRIOR PRIVATE PRIVILEGES PROCEDURE PROCESSED PROJECT PROJECTION PROPERTY PROVISIONING PUBLIC PUT QUERY QUIT QUORUM
+    RAISE RANDOM RANGE RANK RAW READ READS REAL REBUILD RECORD RECURSIVE REDUCE REF REFERENCE REFERENCES REFERENCING
+    REGEXP REGION REINDEX RELATIVE RELEASE REMAINDER RENAME REPEAT REPLACE REQUEST RESET RESIGNAL RESOURCE RESPONSE
+    RESTORE RESTRICT RESULT RETURN RETURNING RETURNS REVERSE REVOKE RIGHT ROLE ROLES ROLLBACK ROLLUP ROUTINE ROW ROWS
+    RULE RULES SAMPLE SATISFIES SAVE SAVEPOINT SCAN SCHEMA SCOPE SCROLL SEARCH SECOND SECTION SEGMENT SEGMENTS SELECT
+    SELF SEMI SENSITIVE SEPARATE SEQUENCE SERIALIZABLE SESSION SET SETS SHARD SHARE SHARED SHORT SHOW SIGNAL SIMILAR
+    SIZE SKEWED SMALLINT SNAPSHOT SOME SOURCE SPACE SPACES SPARSE SPECIFIC SPECIFICTYPE SPLIT SQL SQLCODE SQLERROR
+    SQLEXCEPTION SQLSTATE SQLWARNING START STATE STATIC STATUS STORAGE STORE STORED STREAM STRING STRUCT STYLE SUB
+    SUBMULTISET SUBPARTITION SUBSTRING SUBTYPE SUM SUPER SYMMETRIC SYNONYM SYSTEM TABLE TABLESAMPLE TEMP TEMPORARY
+    TERMINATED TEXT THAN THEN THROUGHPUT TIME TIMESTAMP TIMEZONE TINYINT TO TOKEN TOTAL TOUCH TRAILING TRANSACTION
+    TRANSFORM TRANSLATE TRANSLATION TREAT TRIGGER TRIM TRUE TRUNCATE TTL TUPLE TYPE UNDER UNDO UNION UNIQUE UNIT UNKNOWN
+    UNLOGGED UNNEST UNPROCESSED UNSIGNED UNTIL UPDATE UPPER URL USAGE USE USER USERS USING UUID VACUUM VALUE VALUED
+    VALUES VARCHAR VARIABLE VARIANCE VARINT VARYING VIEW VIEWS VIRTUAL VOID WAIT WHEN WHENEVER WHERE WHILE WINDOW WITH
+    WITHIN WITHOUT WORK WRAPPED WRITE YEAR ZONE
+'''.split())
+# Keywords of the expression syntax, written in upper case by the handlers
+EXPRESSION_KEYWORDS = frozenset(['AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'ADD', 'REMOVE', 'DELETE'])
+UPDATE_CLAUSES = frozenset(['SET', 'ADD', 'REMOVE', 'DELETE'])
+EXPRESSION_TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),+\-]|[#:]?[A-Za-z_][\w.]*)')
+COMPARATORS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+# Value of an attribute the item does not have
+MISSING = object()
+
+
+def parse_distribution(spec):
+    """
+    Parses a latency distribution in milliseconds and returns a function sampling it in seconds:
+    none, fixed:<ms>, uniform:<min ms>,<max ms> or lognormal:<median ms>,<sigma>
+    """
+    name, _, values = spec.partition(':')
+    values = [float(value) for value in values.split(',')] if values else []
+    if name == 'none':
+        return lambda: 0
+    if name == 'fixed' and len(values) == 1:
+        return lambda: values[0] / 1000
+    if name == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if name == 'lognormal' and len(values) == 2:
+        # The median of a lognormal distribution is exp(mu)
+        return lambda: values[0] * random.lognormvariate(0, values[1]) / 1000
+    raise ValueError('Unknown latency distribution: ' + spec)
+
+
+def client_error(code, operation_name, error_class=ClientError, message=None):
+    return error_class({'Error': {'Code': code, 'Message': message or code}}, operation_name)
+
+
+def check_expression(expression, operation_name):
+    """
+    Rejects an expression naming a reserved word directly, like DynamoDB does.
+    Placeholders (#name, :value) and function names are skipped.
+    """
+    for match in re.finditer(r'(?<![#:\w])([A-Za-z_]\w*)(\s*\()?', expression or ''):
+        name, is_function = match.groups()
+        if is_function or name in EXPRESSION_KEYWORDS:
+            continue
+        if name.upper() in RESERVED_WORDS:
+            raise client_error('ValidationException', operation_name, message='Invalid ConditionExpression: '
+                               'Attribute name is a reserved keyword; reserved keyword: ' + name)
+
+
+def compare(comparator, first, second):
+    """
+    Comparisons with a missing attribute or of different types are false, as in
+    DynamoDB, except for <> which is then true.
+    """
+    if first is MISSING or second is MISSING:
+        return comparator == '<>'
+    try:
+        return COMPARATORS[comparator](first, second)
+    except TypeError:
+        return False
+
+
+class Expression(object):
+    """
+    Parses the subset of the DynamoDB expression syntax the handlers use into
+    functions of an item: comparisons, BETWEEN, IN, AND, OR, NOT and parentheses,
+    the functions attribute_exists, attribute_not_exists, begins_with, contains,
+    size, if_not_exists and list_append, + and - in SET actions, and the SET, ADD,
+    REMOVE and DELETE clauses of update expressions. Attribute paths are top level names.
+    """
+
+    def __init__(self, text, names, values, operation_name):
+        self.text = text
+        self.names = names or {}
+        self.values = values or {}
+        self.operation_name = operation_name
+        self.tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = EXPRESSION_TOKEN.match(text, position)
+            if not match:
+                self.fail()
+            self.tokens.append(match.group(1))
+            position = match.end()
+        self.position = 0
+
+    def fail(self):
+        raise client_error('ValidationException', self.operation_name, message='Invalid expression: ' + self.text)
+
+    def peek(self, offset=0):
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected and token.upper() != expected):
+            self.fail()
+        self.position += 1
+        return token
+
+    def finish(self, parsed):
+        if self.peek() is not None:
+            self.fail()
+        return parsed
+
+    def parse_condition(self):
+        return self.finish(self.parse_or())
+
+    def parse_or(self):
+        conditions = [self.parse_and()]
+        while (self.peek() or '').upper() == 'OR':
+            self.take()
+            conditions.append(self.parse_and())
+        return conditions[0] if len(conditions) == 1 else lambda item: any(condition(item) for condition in conditions)
+
+    def parse_and(self):
+        conditions = [self.parse_not()]
+        while (self.peek() or '').upper() == 'AND':
+            self.take()
+            conditions.append(self.parse_not())
+        return conditions[0] if len(conditions) == 1 else lambda item: all(condition(item) for condition in conditions)
+
+    def parse_not(self):
+        if (self.peek() or '').upper() == 'NOT':
+            self.take()
+            condition = self.parse_not()
+            return lambda item: not condition(item)
+        if self.peek() == '(':
+            self.take()
+            condition = self.parse_or()
+            self.take(')')
+            return condition
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        function = (self.peek() or '').lower()
+        if self.peek(1) == '(' and function in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains'):
+            self.take()
+            self.take('(')
+            arguments = [self.parse_operand()]
+            while self.peek() == ',':
+                self.take()
+                arguments.append(self.parse_operand())
+            self.take(')')
+            if function == 'attribute_exists':
+                return lambda item: arguments[0](item) is not MISSING
+            if function == 'attribute_not_exists':
+                return lambda item: arguments[0](item) is MISSING
+            if function == 'begins_with':
+                return lambda item: isinstance(arguments[0](item), str) and arguments[0](item).startswith(arguments[1](item))
+            return lambda item: arguments[0](item) is not MISSING and arguments[1](item) in arguments[0](item)
+
+        first = self.parse_operand()
+        comparator = self.take()
+        if comparator in COMPARATORS:
+            second = self.parse_operand()
+            return lambda item: compare(comparator, first(item), second(item))
+        if comparator.upper() == 'BETWEEN':
+            low = self.parse_operand()
+            self.take('AND')
+            high = self.parse_operand()
+            return lambda item: compare('>=', first(item), low(item)) and compare('<=', first(item), high(item))
+        if comparator.upper() == 'IN':
+            self.take('(')
+            candidates = [self.parse_operand()]
+            while self.peek() == ',':
+                self.take()
+                candidates.append(self.parse_operand())
+            self.take(')')
+            return lambda item: any(compare('=', first(item), candidate(item)) for candidate in candidates)
+        self.fail()
+
+    def parse_name(self):
+        token = self.take()
+        if token.startswith('#'):
+            if token not in self.names:
+                self.fail()
+            return self.names[token]
+        if token.startswith(':') or not re.match(r'[A-Za-z_]', token):
+            self.fail()
+        return token
+
+    def parse_operand(self):
+        token = self.peek()
+        if token is None:
+            self.fail()
+        if token.startswith(':'):
+            self.take()
+            if token not in self.values:
+                self.fail()
+            value = self.values[token]
+            return lambda item: value
+        function = token.lower()
+        if self.peek(1) == '(' and function in ('if_not_exists', 'list_append', 'size'):
+            self.take()
+            self.take('(')
+            arguments = [self.parse_value()]
+            while self.peek() == ',':
+                self.take()
+                arguments.append(self.parse_value())
+            self.take(')')
+            if function == 'if_not_exists':
+                return lambda item: arguments[1](item) if arguments[0](item) is MISSING else arguments[0](item)
+            if function == 'list_append':
+                return lambda item: list(arguments[0](item)) + list(arguments[1](item))
+            return lambda item: MISSING if arguments[0](item) is MISSING else len(arguments[0](item))
+        name = self.parse_name()
+        return lambda item: item.get(name, MISSING)
+
+    def parse_value(self):
+        value = self.parse_operand()
+        if self.peek() in ('+', '-'):
+            sign = 1 if self.take() == '+' else -1
+            second = self.parse_operand()
+            return lambda item: value(item) + sign * second(item)
+        return value
+
+    def parse_update(self):
+        """
+        :return: list of (clause, attribute name, value function or None) actions
+        """
+        actions = []
+        while self.peek() is not None:
+            clause = self.take().upper()
+            if clause not in UPDATE_CLAUSES:
+                self.fail()
+            while True:
+                name = self.parse_name()
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append((clause, name, self.parse_value()))
+                elif clause == 'REMOVE':
+                    actions.append((clause, name, None))
+                else:
+                    actions.append((clause, name, self.parse_operand()))
+                if self.peek() != ',':
+                    break
+                self.take()
+        return actions
+
+    def parse_projection(self):
+        names = [self.parse_name()]
+        while self.peek() == ',':
+            self.take()
+            names.append(self.parse_name())
+        return self.finish(names)
+
+
+def build_expression(expression, builder, names, values, is_key_condition=False):
+    """
+    Turns a condition of boto3.dynamodb.conditions into an expression string, adding
+    its placeholders to names and values, like the boto3 resource does before a call.
+    """
+    if not isinstance(expression, ConditionBase):
+        return expression
+    built = builder.build_expression(expression, is_key_condition=is_key_condition)
+    names.update(built.attribute_name_placeholders)
+    values.update(built.attribute_value_placeholders)
+    return built.condition_expression
+
+
+def apply_update(item, actions):
+    """
+    Applies update actions to a copy of an item. Every value is computed from the item before the update.
+    :return: the updated item and the names of the attributes updated
+    """
+    computed = [(clause, name, value(item) if value else None) for clause, name, value in actions]
+    updated_item = dict(item)
+    for clause, name, value in computed:
+        if clause == 'SET':
+            updated_item[name] = value
+        elif clause == 'REMOVE':
+            updated_item.pop(name, None)
+        elif clause == 'ADD':
+            current = updated_item.get(name)
+            if current is None:
+                updated_item[name] = value
+            elif isinstance(current, set):
+                updated_item[name] = current | value
+            else:
+                updated_item[name] = current + value
+        elif name in updated_item:
+            updated_item[name] = updated_item[name] - value
+    return updated_item, [name for _, name, _ in computed]
+
+
+class Exceptions(object):
+    """
+    Mirrors client.exceptions, so that the handlers' except clauses match.
+    """
+
+    def __init__(self, *codes):
+        for code in codes:
+            setattr(self, code, type(code, (ClientError,), {}))
+
+
+class Meta(object):
+
+    def __init__(self, client):
+        self.client = client
+
+
+class LocalS3(object):
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType='image/jpeg', Metadata=None):
+        self.objects[(Bucket, Key)] = (Body, ContentType, dict(Metadata or {}), datetime.datetime.now(datetime.timezone.utc))
+
+    def get_object(self, Bucket, Key, **kwargs):
+        body, content_type, metadata, last_modified = self.objects[(Bucket, Key)]
+        return {
+            'Body': io.BytesIO(body),
+            'ContentType': content_type,
+            'ContentLength': len(body),
+            'Metadata': dict(metadata),
+            'LastModified': last_modified
+        }
+
+
+class LookoutVisionStub(object):
+    """
+    Scores images after a sampled latency. Requests are throttled at random with
+    throttle_rate, and above max_tps when it is set, like a model with limited
+    inference units.
+    """
+
+    def __init__(self, latency='none', throttle_rate=0, max_tps=0, anomaly_rate=0.1):
+        self.latency = parse_distribution(latency)
+        self.throttle_rate = throttle_rate
+        self.max_tps = max_tps
+        self.anomaly_rate = anomaly_rate
+        self.exceptions = Exceptions('ThrottlingException')
+        self.lock = threading.Lock()
+        self.tokens = max_tps
+        self.refilled = time.time()
+        self.calls = 0
+        self.throttles = 0
+
+    def take_token(self):
+        with self.lock:
+            self.calls += 1
+            if self.max_tps:
+                now = time.time()
+                self.tokens = min(self.max_tps, self.tokens + (now - self.refilled) * self.max_tps)
+                self.refilled = now
+                if self.tokens < 1:
+                    self.throttles += 1
+                    return False
+                self.tokens -= 1
+            if random.random() < self.throttle_rate:
+                self.throttles += 1
+                return False
+            return True
+
+    def detect_anomalies(self, ProjectName, ModelVersion, Body, ContentType):
+        if not self.take_token():
+            raise client_error('ThrottlingException', 'DetectAnomalies', self.exceptions.ThrottlingException)
+        time.sleep(self.latency())
+        is_anomalous = random.random() < self.anomaly_rate
+        return {
+            'DetectAnomalyResult': {
+                'Source': {'Type': 'direct'},
+                'IsAnomalous': is_anomalous,
+                'Confidence': round(random.uniform(0.5, 1), 4)
+            }
+        }
+
+
+class LocalTable(object):
+    """
+    Stands in for a DynamoDB resource Table. Expressions are evaluated, and
+    conditions of boto3.dynamodb.conditions are accepted where boto3 accepts them.
+    Query and Scan page with Limit, ExclusiveStartKey and LastEvaluatedKey, but
+    ignore the 1 MB page size limit.
+    """
+
+    def __init__(self, dynamodb, name, key_names, indexes=None, streamed=True):
+        self.dynamodb = dynamodb
+        self.name = name
+        self.key_names = key_names
+        self.indexes = indexes or {}
+        self.streamed = streamed
+        self.items = {}
+
+    def get_key(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def conditional_check_failed(self, operation_name):
+        return client_error('ConditionalCheckFailedException', operation_name,
+                            self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException)
+
+    def parse(self, expression, operation_name, names=None, values=None):
+        check_expression(expression, operation_name)
+        return Expression(expression, names, values, operation_name)
+
+    def check_condition(self, item, operation_name, ConditionExpression=None, ExpressionAttributeNames=None,
+                        ExpressionAttributeValues=None):
+        """
+        :return: False if the item does not satisfy the condition
+        """
+        if ConditionExpression is None:
+            return True
+        names = dict(ExpressionAttributeNames or {})
+        values = dict(ExpressionAttributeValues or {})
+        expression = build_expression(ConditionExpression, ConditionExpressionBuilder(), names, values)
+        return self.parse(expression, operation_name, names, values).parse_condition()(item or {})
+
+    def write(self, key, item):
+        """
+        Stores or, when item is None, deletes an item. Called with the lock held.
+        """
+        if item is None:
+            self.items.pop(key, None)
+            return
+        if self.streamed:
+            self.dynamodb.record_change(self, key, item)
+        self.items[key] = dict(item)
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        key = self.get_key(Item)
+        with self.dynamodb.lock:
+            if not self.check_condition(self.items.get(key), 'PutItem', ConditionExpression,
+                                        ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self.conditional_check_failed('PutItem')
+            self.write(key, Item)
+        return {}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self.dynamodb.lock:
+            item = self.items.get(self.get_key(Key))
+        if not item:
+            return {}
+        return {'Item': self.project(item, ProjectionExpression, ExpressionAttributeNames, 'GetItem')}
+
+    def prepare_update(self, item, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                       ExpressionAttributeValues=None, operation_name='UpdateItem'):
+        """
+        :return: the updated item and the names of the attributes updated, or None if the condition fails
+        """
+        if not self.check_condition(item, operation_name, ConditionExpression,
+                                    ExpressionAttributeNames, ExpressionAttributeValues):
+            return None
+        actions = self.parse(UpdateExpression, operation_name, ExpressionAttributeNames,
+                             ExpressionAttributeValues).parse_update()
+        return apply_update(item or dict(Key), actions)
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        key = self.get_key(Key)
+        with self.dynamodb.lock:
+            item = self.items.get(key)
+            update = self.prepare_update(item, Key, UpdateExpression, ConditionExpression,
+                                         ExpressionAttributeNames, ExpressionAttributeValues)
+            if update is None:
+                raise self.conditional_check_failed('UpdateItem')
+            updated_item, updated_names = update
+            self.write(key, updated_item)
+
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': dict(updated_item)}
+        if ReturnValues == 'ALL_OLD':
+            return {'Attributes': dict(item)} if item else {}
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': {name: updated_item[name] for name in updated_names if name in updated_item}}
+        if ReturnValues == 'UPDATED_OLD':
+            return {'Attributes': {name: item[name] for name in updated_names if item and name in item}}
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        key = self.get_key(Key)
+        with self.dynamodb.lock:
+            if not self.check_condition(self.items.get(key), 'DeleteItem', ConditionExpression,
+                                        ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self.conditional_check_failed('DeleteItem')
+            self.write(key, None)
+        return {}
+
+    def project(self, item, ProjectionExpression, ExpressionAttributeNames, operation_name):
+        if not ProjectionExpression:
+            return dict(item)
+        names = self.parse(ProjectionExpression, operation_name, ExpressionAttributeNames).parse_projection()
+        return {name: item[name] for name in names if name in item}
+
+    def read_page(self, items, key_names, order, descending, operation_name, Limit=None, ExclusiveStartKey=None,
+                  FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+                  ExpressionAttributeValues=None, builder=None, **kwargs):
+        """
+        Returns one page of items, as Query and Scan do.
+        :param items: the items read, sorted by order
+        :param key_names: key attribute names of the table or index read
+        :param order: function returning the sort key of an item, or of a LastEvaluatedKey
+        """
+        items.sort(key=order, reverse=descending)
+        start = 0
+        if ExclusiveStartKey:
+            # The page continues after the key, even if its item was deleted meanwhile
+            start_order = order(ExclusiveStartKey)
+            start = next((position for position, item in enumerate(items)
+                          if (order(item) < start_order if descending else order(item) > start_order)), len(items))
+        page = items[start:start + Limit] if Limit else items[start:]
+
+        names = dict(ExpressionAttributeNames or {})
+        values = dict(ExpressionAttributeValues or {})
+        if FilterExpression is not None:
+            expression = build_expression(FilterExpression, builder or ConditionExpressionBuilder(), names, values)
+            condition = self.parse(expression, operation_name, names, values).parse_condition()
+            matches = [item for item in page if condition(item)]
+        else:
+            matches = page
+        response = {
+            'Items': [self.project(item, ProjectionExpression, names, operation_name) for item in matches],
+            'Count': len(matches),
+            'ScannedCount': len(page)
+        }
+        if Limit and len(page) == Limit:
+            last_item = page[-1]
+            response['LastEvaluatedKey'] = {name: last_item[name] for name in set(self.key_names) | set(key_names)}
+        return response
+
+    def query(self, KeyConditionExpression, IndexName=None, ScanIndexForward=True, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, **kwargs):
+        if IndexName and IndexName not in self.indexes:
+            raise client_error('ValidationException', 'Query', message='The table does not have the specified index: ' + IndexName)
+        key_names = self.indexes[IndexName] if IndexName else self.key_names
+        builder = ConditionExpressionBuilder()
+        names = dict(ExpressionAttributeNames or {})
+        values = dict(ExpressionAttributeValues or {})
+        expression = build_expression(KeyConditionExpression, builder, names, values, is_key_condition=True)
+        condition = self.parse(expression, 'Query', names, values).parse_condition()
+
+        with self.dynamodb.lock:
+            # Items without the index keys are not in a (sparse) index
+            items = [dict(item) for item in self.items.values()
+                     if all(name in item for name in key_names) and condition(item)]
+        # Items sharing a sort key value are ordered by the table key, which DynamoDB leaves unspecified
+        return self.read_page(items, key_names, lambda item: (item[key_names[-1]], self.get_key(item)),
+                              not ScanIndexForward, 'Query', ExpressionAttributeNames=names,
+                              ExpressionAttributeValues=values, builder=builder, **kwargs)
+
+    def scan(self, **kwargs):
+        with self.dynamodb.lock:
+            items = [dict(item) for item in self.items.values()]
+        return self.read_page(items, self.key_names, self.get_key, False, 'Scan', **kwargs)
+
+
+class LocalDynamoDb(object):
+    """
+    Stands in for the DynamoDB resource, and for its meta.client where the handlers
+    use it. Every write to a streamed table is also appended to a stream of INSERT
+    and MODIFY records in the format Lambda receives from DynamoDB Streams.
+    """
+
+    def __init__(self, key_names=('CameraId', 'DateTime'), schemas=None, streamed_tables=None):
+        """
+        :param key_names: key attribute names of the tables missing from schemas
+        :param schemas: dict of table name to (key attribute names, dict of index name to key attribute names)
+        :param streamed_tables: names of the tables whose writes are streamed - all tables when None
+        """
+        self.key_names = key_names
+        self.schemas = schemas or {}
+        self.streamed_tables = streamed_tables
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.stream = []
+        self.sequence_numbers = itertools.count(1)
+        self.serializer = TypeSerializer()
+        self.deserializer = TypeDeserializer()
+        self.meta = Meta(self)
+        self.exceptions = Exceptions('ConditionalCheckFailedException', 'TransactionCanceledException')
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                key_names, indexes = self.schemas.get(name, (self.key_names, None))
+                streamed = self.streamed_tables is None or name in self.streamed_tables
+                self.tables[name] = LocalTable(self, name, key_names, indexes, streamed)
+            return self.tables[name]
+
+    def batch_write_item(self, RequestItems):
+        for table_name, requests in RequestItems.items():
+            table = self.Table(table_name)
+            for request in requests:
+                table.put_item(Item=request['PutRequest']['Item'])
+        return {'UnprocessedItems': {}}
+
+    def deserialize(self, values):
+        return {name: self.deserializer.deserialize(value) for name, value in (values or {}).items()}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        """
+        Client API - attribute values are in the DynamoDB JSON format. Either every
+        write is made or, when a condition fails, none is.
+        """
+        tables = [self.Table(next(iter(action.values()))['TableName']) for action in TransactItems]
+        with self.lock:
+            writes = []
+            reasons = []
+            for table, action in zip(tables, TransactItems):
+                (operation, request), = action.items()
+                target = self.deserialize(request['Item'] if operation == 'Put' else request['Key'])
+                item = table.items.get(table.get_key(target))
+                condition = {
+                    'ConditionExpression': request.get('ConditionExpression'),
+                    'ExpressionAttributeNames': request.get('ExpressionAttributeNames'),
+                    'ExpressionAttributeValues': self.deserialize(request.get('ExpressionAttributeValues'))
+                }
+                if operation == 'Update':
+                    update = table.prepare_update(item, target, request['UpdateExpression'],
+                                                  operation_name='TransactWriteItems', **condition)
+                    passed = update is not None
+                    written = update[0] if passed else None
+                else:
+                    passed = table.check_condition(item, 'TransactWriteItems', **condition)
+                    written = target if operation == 'Put' else None
+                reasons.append({'Code': 'None' if passed else 'ConditionalCheckFailed'})
+                if operation != 'ConditionCheck':
+                    writes.append((table, table.get_key(target), written))
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise self.exceptions.TransactionCanceledException({
+                    'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                    'CancellationReasons': reasons
+                }, 'TransactWriteItems')
+            for table, key, item in writes:
+                table.write(key, item)
+        return {}
+
+    def record_change(self, table, key, item):
+        self.stream.append({
+            'eventName': 'MODIFY' if key in table.items else 'INSERT',
+            'awsRegion': REGION,
+            'dynamodb': {
+                'Keys': {name: self.serializer.serialize(item[name]) for name in table.key_names},
+                'NewImage': {name: self.serializer.serialize(value) for name, value in item.items()},
+                'SequenceNumber': str(next(self.sequence_numbers)),
+                'StreamViewType': 'NEW_IMAGE'
+            }
+        })
+
+    def read_stream(self, limit):
+        """
+        Removes and returns up to limit of the oldest stream records.
+        """
+        with self.lock:
+            records = self.stream[:limit]
+            del self.stream[:limit]
+        return records
+
+
+class LocalSns(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, **kwargs):
+        self.messages.append(kwargs)
+        return {'MessageId': str(uuid.uuid4())}
+
+
+class LocalStepFunctions(object):
+    """
+    Hands every started execution to on_execution - the caller decides how to run the workflow.
+    Execution names are unique per state machine, as in Step Functions.
+    """
+
+    def __init__(self, on_execution=None):
+        self.on_execution = on_execution
+        self.executions = itertools.count(1)
+        self.names = set()
+        self.lock = threading.Lock()
+        self.exceptions = Exceptions('ExecutionAlreadyExists')
+
+    def start_execution(self, stateMachineArn, input, name=None, **kwargs):
+        name = name or str(next(self.executions))
+        with self.lock:
+            if (stateMachineArn, name) in self.names:
+                raise client_error('ExecutionAlreadyExists', 'StartExecution', self.exceptions.ExecutionAlreadyExists)
+            self.names.add((stateMachineArn, name))
+        execution_arn = stateMachineArn.replace(':stateMachine:', ':execution:') + ':' + name
+        if self.on_execution:
+            self.on_execution(execution_arn, input)
+        return {'executionArn': execution_arn, 'startDate': datetime.datetime.now(datetime.timezone.utc)}
+
+
+class LocalFirehose(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        with self.lock:
+            self.records += len(Records)
+            self.bytes += sum(len(record['Data']) for record in Records)
+        return {
+            'FailedPutCount': 0,
+            'RequestResponses': [{'RecordId': str(uuid.uuid4())} for _ in Records]
+        }
+
+
+class LocalServices(object):
+
+    def __init__(self, lookoutvision=None, dynamodb=None):
+        self.s3 = LocalS3()
+        self.lookoutvision = lookoutvision or LookoutVisionStub()
+        self.dynamodb = dynamodb or LocalDynamoDb()
+        self.sns = LocalSns()
+        self.stepfunctions = LocalStepFunctions()
+        self.firehose = LocalFirehose()
+
+    def factory(self, kind, service_name):
+        """
+        Client factory for awsClients.set_factory.
+        """
+        services = {
+            ('client', 's3'): self.s3,
+            ('client', 'lookoutvision'): self.lookoutvision,
+            ('resource', 'dynamodb'): self.dynamodb,
+            ('client', 'sns'): self.sns,
+            ('client', 'stepfunctions'): self.stepfunctions,
+            ('client', 'firehose'): self.firehose
+        }
+        if (kind, service_name) not in services:
+            raise ValueError('No local stand-in for {} {}'.format(kind, service_name))
+        return services[(kind, service_name)]
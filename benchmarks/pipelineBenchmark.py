@@ -0,0 +1,457 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#!/usr/bin/python
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from coldStartBenchmark import ROOT, CODE_PATHS, ENVIRONMENT, BUCKET, IMAGE
+from localServices import LocalDynamoDb, LocalServices, LookoutVisionStub
+
+# Drives the Python handlers end to end against the in-process stand-ins of localServices:
+# startStateMachineExecution -> state machine (startDetectAnomalies -> putItemInDynamoDb + publishMessage)
+# -> DynamoDB stream -> DynamoDbToFirehose. Reports images/s, p50/p95/p99 latency per handler and
+# per instrumented stage, and the peak memory allocated by one invocation of each handler.
+# Execute as - python pipelineBenchmark.py [--images N] [--cameras N] [--concurrency N] [--lfv-latency DISTRIBUTION] [--save FILE] [--baseline FILE]
+# For Example:
+# Record a baseline -> python benchmarks/pipelineBenchmark.py --images 2000 --save pipeline-baseline.json
+# Check a change against it -> python benchmarks/pipelineBenchmark.py --images 2000 --baseline pipeline-baseline.json
+# Throttled model -> python benchmarks/pipelineBenchmark.py --lfv-max-tps 50 --retry-scale 0.1
+# Optional features -> python benchmarks/pipelineBenchmark.py --features rate-limiter,alert-digests,aggregates,defects-api
+
+HANDLERS = ['startStateMachineExecution', 'startDetectAnomalies', 'putItemInDynamoDb', 'publishMessage', 'DynamoDbToFirehose']
+PERCENTILES = [50, 95, 99]
+
+# Environment of the optional features, each backed by a table of its own
+FEATURES = {
+    'result-cache': {'RESULT_CACHE_TABLE_NAME': 'benchmark-result-cache'},
+    'frame-deduplication': {'FRAME_DEDUP_TABLE_NAME': 'benchmark-frame-deduplication'},
+    'rate-limiter': {'RATE_LIMITER_TABLE_NAME': 'benchmark-rate-limiter'},
+    # Short windows, so that the digests are flushed at the end of the run
+    'alert-digests': {'ALERT_WINDOW_TABLE_NAME': 'benchmark-alert-windows', 'ALERT_WINDOW_SECONDS': '1'},
+    'aggregates': {'AGGREGATES_TABLE_NAME': 'benchmark-aggregates'},
+    'defects-api': {'ANOMALY_INDEX_NAME': 'AnomalyIndex'}
+}
+# Key attribute names of the tables and their indexes, as in template.yml
+TABLE_SCHEMAS = {
+    ENVIRONMENT['DYNAMODB_TABLE_NAME']: (('CameraId', 'DateTime'), {
+        'AssemblyLineIndex': ('AssemblyLineId', 'DateTime'),
+        'AnomalyIndex': ('AnomalousAssemblyLineId', 'DateTime')
+    }),
+    'benchmark-result-cache': (('CacheKey',), None),
+    'benchmark-frame-deduplication': (('CameraId',), None),
+    'benchmark-rate-limiter': (('LimiterId',), None),
+    'benchmark-alert-windows': (('WindowKey',), None),
+    'benchmark-aggregates': (('Dimension', 'Window'), None)
+}
+# Consecutive frames of a camera look alike in runs of this length when frame deduplication is enabled
+SIMILAR_FRAMES = 10
+# Results per page read from the /defects API
+DEFECTS_PAGE_SIZE = 50
+
+
+def parse_features(features):
+    features = [feature for feature in (features or '').split(',') if feature]
+    unknown_features = [feature for feature in features if feature not in FEATURES]
+    if unknown_features:
+        raise argparse.ArgumentTypeError('Unknown features: ' + ', '.join(unknown_features))
+    return features
+
+
+def s3_event(key):
+    # Every upload has its own sequencer, which the execution is named after
+    s3_object = {'key': key, 'sequencer': uuid.uuid4().hex[:18].upper()}
+    return {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': s3_object}}]}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+
+class Recorder(object):
+    """
+    Collects latencies by stage name. It also stands in for stdout while the handlers
+    run, picking the stage latencies out of their Embedded Metric Format log lines.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.lines = threading.local()
+
+    def add(self, stage, milliseconds):
+        with self.lock:
+            self.latencies.setdefault(stage, []).append(milliseconds)
+
+    def write(self, text):
+        # print() writes the text and the line ending separately, so lines are assembled per thread
+        pending = getattr(self.lines, 'pending', '') + text
+        lines = pending.split('\n')
+        self.lines.pending = lines.pop()
+        for line in lines:
+            if line.startswith('{"_aws"'):
+                metric = json.loads(line)
+                for definition in metric['_aws']['CloudWatchMetrics'][0]['Metrics']:
+                    if definition['Unit'] == 'Milliseconds':
+                        self.add(definition['Name'], metric[definition['Name']])
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def summary(self):
+        summary = {}
+        for stage, values in sorted(self.latencies.items()):
+            summary[stage] = {'Count': len(values)}
+            for p in PERCENTILES:
+                summary[stage]['P{}Ms'.format(p)] = round(percentile(values, p), 2)
+        return summary
+
+
+def load_handlers(services, features):
+    """
+    Imports the handlers with their AWS clients pointed at the local stand-ins.
+    """
+    os.environ.update(ENVIRONMENT)
+    os.environ['DeliveryStreamName'] = 'benchmark'
+    for feature in features:
+        os.environ.update(FEATURES[feature])
+    sys.path[:0] = CODE_PATHS
+
+    import awsClients
+    awsClients.set_factory(services.factory)
+
+    handlers = {name: importlib.import_module(name) for name in HANDLERS[:-1]}
+    for name in ['flushAlertDigests', 'queryDefects']:
+        handlers[name] = importlib.import_module(name)
+    # DynamoDbToFirehose is packaged on its own, as lambda_function.py
+    function_path = os.path.join(ROOT, 'functions', 'DynamoDbToFirehose')
+    sys.path.insert(0, function_path)
+    spec = importlib.util.spec_from_file_location('DynamoDbToFirehose', os.path.join(function_path, 'lambda_function.py'))
+    handlers['DynamoDbToFirehose'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handlers['DynamoDbToFirehose'])
+    handlers['DynamoDbToFirehose'].firehose = services.firehose
+    # The aggregates are written with a client of their own, as the function does not use awsClients
+    if handlers['DynamoDbToFirehose'].aggregates.is_enabled():
+        handlers['DynamoDbToFirehose'].aggregates.dynamodb = services.dynamodb
+    return handlers
+
+
+class Pipeline(object):
+    """
+    Runs the workflow of DetectAnomaliesStateMachine for every started execution.
+    """
+
+    def __init__(self, handlers, services, recorder, concurrency, stream_batch_size, retry_scale):
+        self.handlers = handlers
+        self.services = services
+        self.recorder = recorder
+        self.stream_batch_size = stream_batch_size
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.branch_executor = ThreadPoolExecutor(max_workers=2 * concurrency)
+        self.futures = []
+        self.futures_lock = threading.Lock()
+        self.started = {}
+        self.failures = 0
+
+        import detectAnomaliesPipeline
+        self.call_with_retry = detectAnomaliesPipeline.call_with_retry
+        self.retries = {}
+        for name, retry in [('startDetectAnomalies', detectAnomaliesPipeline.DETECT_ANOMALIES_RETRY),
+                            ('putItemInDynamoDb', detectAnomaliesPipeline.PUT_RESULT_RETRY),
+                            ('publishMessage', detectAnomaliesPipeline.PUBLISH_MESSAGE_RETRY)]:
+            self.retries[name] = dict(retry, IntervalSeconds=retry['IntervalSeconds'] * retry_scale)
+        services.stepfunctions.on_execution = self.on_execution
+
+    def invoke(self, name, event):
+        start = time.perf_counter()
+        try:
+            return self.handlers[name].lambda_handler(event, None)
+        finally:
+            self.recorder.add(name, (time.perf_counter() - start) * 1000)
+
+    def invoke_with_retry(self, name, event):
+        return self.call_with_retry(name, self.retries[name], self.invoke, name, event)
+
+    def on_execution(self, execution_arn, input):
+        with self.futures_lock:
+            self.futures.append(self.executor.submit(self.run_execution, json.loads(input)))
+
+    def run_execution(self, input):
+        try:
+            detect_response = self.invoke_with_retry('startDetectAnomalies', {'Input': input})
+            # Both branches of PersistResultAndAlert receive the lambda:invoke output
+            branch_input = {'Input': {'Payload': detect_response}}
+            branches = [self.branch_executor.submit(self.invoke_with_retry, name, branch_input)
+                        for name in ['putItemInDynamoDb', 'publishMessage']]
+            for branch in branches:
+                branch.result()
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.recorder.add('EndToEnd', (time.perf_counter() - self.started[input['Key']]) * 1000)
+
+    def upload(self, key):
+        self.started[key] = time.perf_counter()
+        self.invoke('startStateMachineExecution', s3_event(key))
+
+    def deliver_stream(self):
+        """
+        Feeds the DynamoDB stream to DynamoDbToFirehose in batches, like an event source mapping.
+        """
+        delivered = 0
+        while True:
+            records = self.services.dynamodb.read_stream(self.stream_batch_size)
+            if not records:
+                return delivered
+            self.invoke('DynamoDbToFirehose', {'Records': records})
+            delivered += len(records)
+
+    def query_defects(self, cameras):
+        """
+        Reads every result of each camera, and then of each assembly line, from the /defects API, page by page.
+        :return: number of results read
+        """
+        queries = [{'cameraid': 'CAM{}'.format(camera)} for camera in range(cameras)]
+        queries += [{'assemblylineid': 'ASM{}'.format(line)} for line in range((cameras + 3) // 4)]
+        read = 0
+        for query in queries:
+            params = dict(query, limit=str(DEFECTS_PAGE_SIZE))
+            while True:
+                response = json.loads(self.invoke('queryDefects', {'queryStringParameters': params})['body'])
+                read += response['Count']
+                if 'NextToken' not in response:
+                    break
+                params['nexttoken'] = response['NextToken']
+        return read
+
+    def run(self, keys):
+        stop = threading.Event()
+
+        def poll_stream():
+            while not stop.wait(0.05):
+                self.deliver_stream()
+
+        poller = threading.Thread(target=poll_stream)
+        poller.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.executor._max_workers) as uploader:
+                list(uploader.map(self.upload, keys))
+            while True:
+                with self.futures_lock:
+                    pending = [future for future in self.futures if not future.done()]
+                if not pending:
+                    break
+                wait(pending)
+        finally:
+            stop.set()
+            poller.join()
+        self.deliver_stream()
+
+
+def encode_frame(shade):
+    """
+    Returns a small JPEG frame - frame deduplication needs images it can decode.
+    """
+    from PIL import Image
+    frame = Image.linear_gradient('L').resize((64, 64)).point(lambda value: (value + shade) % 256)
+    body = io.BytesIO()
+    frame.save(body, format='JPEG')
+    return body.getvalue()
+
+
+def upload_images(services, images, cameras, similar_frames=False):
+    keys = []
+    for i in range(images):
+        key = 'CAM{}-{}.jpeg'.format(i % cameras, i)
+        if similar_frames:
+            # Runs of frames of a camera differ by a few shades, so that their hashes match
+            frame = i // cameras
+            body = encode_frame(frame // SIMILAR_FRAMES * 64 + frame % SIMILAR_FRAMES)
+        else:
+            # Every image differs, so that a result cache would not skip any inference
+            body = IMAGE + str(i).encode()
+        services.s3.put_object(Bucket=BUCKET, Key=key, Body=body, Metadata={
+            'cameraid': 'CAM{}'.format(i % cameras),
+            'assemblylineid': 'ASM{}'.format(i % cameras // 4),
+            'imageid': key
+        })
+        keys.append(key)
+    return keys
+
+
+def measure_memory(pipeline, keys):
+    """
+    Runs images through the workflow one handler at a time with tracemalloc, returning
+    the largest peak of allocated memory seen during an invocation of each handler.
+    tracemalloc traces the whole process, so nothing else may run meanwhile.
+    """
+    peaks = {}
+    executions = []
+
+    def traced_invoke(name, event):
+        tracemalloc.start()
+        try:
+            return pipeline.handlers[name].lambda_handler(event, None)
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            peaks[name] = max(peaks.get(name, 0), round(peak / 1024.0, 1))
+
+    on_execution = pipeline.services.stepfunctions.on_execution
+    pipeline.services.stepfunctions.on_execution = lambda execution_arn, input: executions.append(json.loads(input))
+    try:
+        for key in keys:
+            traced_invoke('startStateMachineExecution', s3_event(key))
+            for input in executions:
+                detect_response = traced_invoke('startDetectAnomalies', {'Input': input})
+                traced_invoke('putItemInDynamoDb', {'Input': {'Payload': detect_response}})
+                traced_invoke('publishMessage', {'Input': {'Payload': detect_response}})
+            del executions[:]
+            records = pipeline.services.dynamodb.read_stream(pipeline.stream_batch_size)
+            if records:
+                traced_invoke('DynamoDbToFirehose', {'Records': records})
+    finally:
+        pipeline.services.stepfunctions.on_execution = on_execution
+    return peaks
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, universal_newlines=True).strip()
+    except Exception:
+        return ''
+
+
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    minimum = baseline['ImagesPerSecond'] * (1 - max_regression / 100.0)
+    if results['ImagesPerSecond'] < minimum:
+        regressions.append('ImagesPerSecond {} - baseline {}'.format(results['ImagesPerSecond'], baseline['ImagesPerSecond']))
+    for stage, summary in results['Latency'].items():
+        if stage in baseline['Latency']:
+            limit = baseline['Latency'][stage]['P99Ms'] * (1 + max_regression / 100.0)
+            if summary['P99Ms'] > limit:
+                regressions.append('{} P99Ms {} - baseline {}'.format(stage, summary['P99Ms'], baseline['Latency'][stage]['P99Ms']))
+    for handler, peak in results['PeakMemoryKiB'].items():
+        if handler in baseline['PeakMemoryKiB'] and peak > baseline['PeakMemoryKiB'][handler] * (1 + max_regression / 100.0):
+            regressions.append('{} PeakMemoryKiB {} - baseline {}'.format(handler, peak, baseline['PeakMemoryKiB'][handler]))
+    return regressions
+
+
+def print_report(results):
+    print('{} images in {} s - {} images/s'.format(results['Images'], results['Seconds'], results['ImagesPerSecond']))
+    print('{:<28} {:>8} {:>10} {:>10} {:>10} {:>12}'.format('Stage', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'Peak KiB'))
+    for stage, summary in results['Latency'].items():
+        print('{:<28} {:>8} {:>10} {:>10} {:>10} {:>12}'.format(
+            stage, summary['Count'], summary['P50Ms'], summary['P95Ms'], summary['P99Ms'],
+            results['PeakMemoryKiB'].get(stage, '')))
+    print(', '.join('{}: {}'.format(name, value) for name, value in sorted(results['Services'].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lookout For Vision - Serverless App - Pipeline Benchmark')
+    parser.add_argument('--images', type=int, default=1000, help='Images to run through the pipeline (default: 1000)')
+    parser.add_argument('--cameras', type=int, default=8, help='Cameras the images are spread over (default: 8)')
+    parser.add_argument('--concurrency', type=int, default=20, help='Concurrent executions, as concurrent Lambda instances (default: 20)')
+    parser.add_argument('--stream-batch-size', type=int, default=100, help='DynamoDB stream records per DynamoDbToFirehose invocation (default: 100)')
+    parser.add_argument('--lfv-latency', default='lognormal:60,0.3',
+                        help='Lookout for Vision latency in ms - none, fixed:MS, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (default: lognormal:60,0.3)')
+    parser.add_argument('--lfv-throttle-rate', type=float, default=0, help='Share of inference requests throttled at random (default: 0)')
+    parser.add_argument('--lfv-max-tps', type=float, default=0, help='Inference requests per second above which requests are throttled, 0 for no limit (default: 0)')
+    parser.add_argument('--anomaly-rate', type=float, default=0.1, help='Share of images scored as anomalous (default: 0.1)')
+    parser.add_argument('--retry-scale', type=float, default=1, help='Multiplier for the retry intervals of the state machine (default: 1)')
+    parser.add_argument('--memory-samples', type=int, default=5, help='Images run one at a time to measure peak memory (default: 5)')
+    parser.add_argument('--features', type=parse_features, default=[],
+                        help='Optional features to enable, comma separated: ' + ', '.join(sorted(FEATURES)) + ' (default: none)')
+    parser.add_argument('--save', help='File to write the results to as JSON')
+    parser.add_argument('--baseline', help='Results saved by an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=20, help='Percentage change from the baseline reported as a regression (default: 20)')
+    args = parser.parse_args()
+
+    lookoutvision = LookoutVisionStub(args.lfv_latency, args.lfv_throttle_rate, args.lfv_max_tps, args.anomaly_rate)
+    # Only the results table has a stream, which DynamoDbToFirehose reads
+    dynamodb = LocalDynamoDb(schemas=TABLE_SCHEMAS, streamed_tables=[ENVIRONMENT['DYNAMODB_TABLE_NAME']])
+    services = LocalServices(lookoutvision, dynamodb)
+    recorder = Recorder()
+
+    with contextlib.redirect_stdout(recorder):
+        handlers = load_handlers(services, args.features)
+        pipeline = Pipeline(handlers, services, recorder, args.concurrency, args.stream_batch_size, args.retry_scale)
+        keys = upload_images(services, args.images + args.memory_samples, args.cameras,
+                             'frame-deduplication' in args.features)
+        start = time.perf_counter()
+        pipeline.run(keys[:args.images])
+        seconds = time.perf_counter() - start
+        feature_counts = {}
+        if 'alert-digests' in args.features:
+            time.sleep(int(FEATURES['alert-digests']['ALERT_WINDOW_SECONDS']) + 1)
+            feature_counts['DigestsPublished'] = pipeline.invoke('flushAlertDigests', {})
+        if 'defects-api' in args.features:
+            feature_counts['DefectsRead'] = pipeline.query_defects(args.cameras)
+        latency = recorder.summary()
+        peak_memory = measure_memory(pipeline, keys[args.images:])
+
+    stored = len(services.dynamodb.Table(ENVIRONMENT['DYNAMODB_TABLE_NAME']).items)
+    results = {
+        'Commit': get_commit(),
+        'Arguments': vars(args),
+        'Images': args.images,
+        'Seconds': round(seconds, 2),
+        'ImagesPerSecond': round(args.images / seconds, 2),
+        'Latency': latency,
+        'PeakMemoryKiB': peak_memory,
+        'Services': {
+            'Failures': pipeline.failures,
+            'InferenceCalls': lookoutvision.calls,
+            'Throttles': lookoutvision.throttles,
+            'ResultsStored': stored,
+            'AlertsPublished': len(services.sns.messages),
+            'FirehoseRecords': services.firehose.records
+        }
+    }
+    results['Services'].update(feature_counts)
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
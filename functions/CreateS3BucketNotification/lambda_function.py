@@ -27,10 +27,13 @@ def create_s3_notification(event, context):
     lambda_arn=event['ResourceProperties']['LambdaArn']
     bucket=event['ResourceProperties']['Bucket']
     suffix=event['ResourceProperties']['Suffix']
+    queue_arn=event['ResourceProperties'].get('QueueArn')
+    archive_lambda_arn=event['ResourceProperties'].get('ArchiveLambdaArn')
+    archive_suffix=event['ResourceProperties'].get('ArchiveSuffix')
     
     try:
         print("Request Type:",event['RequestType'])
-        response = add_notification(lambda_arn, bucket, suffix)
+        response = add_notification(lambda_arn, bucket, suffix, queue_arn, archive_lambda_arn, archive_suffix)
         print(response)
     except Exception as e:
         print(e)
@@ -51,30 +54,55 @@ def delete_s3_notification(event, context):
 def handler(event, context):
     helper(event, context)
     
-def add_notification(lambda_arn, bucket, suffix):
-    response = client.put_bucket_notification_configuration(
-        Bucket = bucket,
-        NotificationConfiguration={
-        'LambdaFunctionConfigurations': [
-            {
-                'Id':'Image-Uploded-Event',
-                'LambdaFunctionArn': lambda_arn,
-                'Events': [
-                    's3:ObjectCreated:*'
-                ],
-                'Filter': {
-                    'Key': {
-                        'FilterRules': [
-                            {
-                                'Name': 'suffix',
-                                'Value': suffix
-                            }
-                        ]
+def add_notification(lambda_arn, bucket, suffix, queue_arn=None, archive_lambda_arn=None, archive_suffix=None):
+    event_configuration = {
+        'Id':'Image-Uploded-Event',
+        'Events': [
+            's3:ObjectCreated:*'
+        ],
+        'Filter': {
+            'Key': {
+                'FilterRules': [
+                    {
+                        'Name': 'suffix',
+                        'Value': suffix
                     }
-                }
+                ]
             }
-        ]
         }
+    }
+
+    # Queue the notifications for batch processing when a queue is provided
+    if queue_arn:
+        event_configuration['QueueArn'] = queue_arn
+        notification_configuration = {'QueueConfigurations': [event_configuration]}
+    else:
+        event_configuration['LambdaFunctionArn'] = lambda_arn
+        notification_configuration = {'LambdaFunctionConfigurations': [event_configuration]}
+
+    # Multi-frame archives are always sent to the archive function
+    if archive_lambda_arn:
+        notification_configuration.setdefault('LambdaFunctionConfigurations', []).append({
+            'Id':'Archive-Uploaded-Event',
+            'LambdaFunctionArn': archive_lambda_arn,
+            'Events': [
+                's3:ObjectCreated:*'
+            ],
+            'Filter': {
+                'Key': {
+                    'FilterRules': [
+                        {
+                            'Name': 'suffix',
+                            'Value': archive_suffix
+                        }
+                    ]
+                }
+            }
+        })
+
+    response = client.put_bucket_notification_configuration(
+        Bucket = bucket,
+        NotificationConfiguration=notification_configuration
     )
     
     print("Put request completed....")
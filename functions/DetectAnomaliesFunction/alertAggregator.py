@@ -0,0 +1,268 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import awsClients
+import datetime
+import json
+import os
+import time
+from boto3.dynamodb.types import TypeSerializer
+from decimal import Decimal
+
+from metrics import stage_timer
+
+TARGET_ARN = os.environ.get('TARGET_ARN', '')
+# DynamoDB table holding the open alert window of every line and camera - empty disables digests
+ALERT_WINDOW_TABLE_NAME = os.environ.get('ALERT_WINDOW_TABLE_NAME', '')
+ALERT_WINDOW_SECONDS = int(os.environ.get('ALERT_WINDOW_SECONDS', '300'))
+ALERT_DIGEST_SAMPLE_SIZE = int(os.environ.get('ALERT_DIGEST_SAMPLE_SIZE', '5'))
+# Expired windows are kept for a day so that their digests can still be flushed
+WINDOW_RETENTION_SECONDS = 86400
+
+dynamodb = awsClients.resource('dynamodb') if ALERT_WINDOW_TABLE_NAME else None
+sns = awsClients.client('sns')
+serializer = TypeSerializer()
+
+
+def is_enabled():
+    return bool(ALERT_WINDOW_TABLE_NAME) and ALERT_WINDOW_SECONDS > 0
+
+
+def get_window_key(image_details):
+    return image_details['AssemblyLineId'] + '#' + image_details['CameraId']
+
+
+def record_alert(image_details, low_confidence):
+    """
+    Records an alert in the window of its assembly line and camera.
+    :return: True if the alert opened a new window and must be sent
+    immediately, False if it was rolled into the digest of the open window
+    """
+    table = dynamodb.Table(ALERT_WINDOW_TABLE_NAME)
+    window_key = get_window_key(image_details)
+    while True:
+        now = int(time.time())
+        try:
+            join_window(table, window_key, image_details, low_confidence, now)
+            return False
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        # No open window, or the alert opened it and is retried
+        window = table.get_item(Key={'WindowKey': window_key}, ConsistentRead=True).get('Item')
+        if window and window['WindowEnd'] >= now:
+            if window['FirstImageUrl'] == image_details['ImageUrl']:
+                # The alert is sent again, as its first attempt may have failed to publish
+                return True
+            continue
+        try:
+            open_window(table, window_key, image_details, window, now)
+            return True
+        except (dynamodb.meta.client.exceptions.ConditionalCheckFailedException,
+                dynamodb.meta.client.exceptions.TransactionCanceledException):
+            # Another alert opened the window in between - join it
+            continue
+
+
+def open_window(table, window_key, image_details, expired_window, now):
+    """
+    Opens a new window for an alert. An expired window that still holds
+    alerts is closed in the same transaction, so that its digest is sent
+    by the flush even if the alert fails afterwards.
+    """
+    new_window = {
+        'WindowKey': window_key,
+        'AssemblyLineId': image_details['AssemblyLineId'],
+        'CameraId': image_details['CameraId'],
+        'WindowStart': now,
+        'WindowEnd': now + ALERT_WINDOW_SECONDS,
+        'FirstImageUrl': image_details['ImageUrl'],
+        'Count': 0,
+        'ExpiresAt': now + ALERT_WINDOW_SECONDS + WINDOW_RETENTION_SECONDS
+    }
+    if expired_window is None:
+        table.put_item(Item=new_window, ConditionExpression='attribute_not_exists(WindowKey)')
+    elif expired_window.get('Count', 0) == 0:
+        table.put_item(
+            Item=new_window,
+            ConditionExpression='WindowEnd = :end',
+            ExpressionAttributeValues={':end': expired_window['WindowEnd']}
+        )
+    else:
+        close_window(expired_window, {
+            'Put': {
+                'TableName': ALERT_WINDOW_TABLE_NAME,
+                'Item': serialize(new_window),
+                'ConditionExpression': 'WindowEnd = :end',
+                'ExpressionAttributeValues': serialize({':end': expired_window['WindowEnd']})
+            }
+        })
+
+
+def close_window(window, replacement):
+    """
+    Moves an expired window to a closed window of its own key, which is only
+    deleted once its digest has been published. The replacement write, which
+    opens the next window or deletes the expired one, is made atomically.
+    :return: the closed window
+    """
+    closed_window = dict(window, WindowKey=window['WindowKey'] + '#' + str(window['WindowStart']), Closed=True)
+    dynamodb.meta.client.transact_write_items(TransactItems=[
+        replacement,
+        {
+            'Put': {
+                'TableName': ALERT_WINDOW_TABLE_NAME,
+                'Item': serialize(closed_window),
+                'ConditionExpression': 'attribute_not_exists(WindowKey)'
+            }
+        }
+    ])
+    return closed_window
+
+
+def serialize(item):
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def join_window(table, window_key, image_details, low_confidence, now):
+    """
+    Adds an alert to the open window with one atomic update. Follow-up
+    updates are only needed while the window collects its sample image URLs
+    and when the confidence range widens.
+    """
+    # Confidences of state machine payloads arrive as JSON floats
+    confidence = Decimal(str(image_details['Confidence']))
+    response = table.update_item(
+        Key={'WindowKey': window_key},
+        UpdateExpression='ADD #count :one, Anomalies :anomalies, LowConfidence :low '
+                         'SET ConfidenceMin = if_not_exists(ConfidenceMin, :confidence), '
+                         'ConfidenceMax = if_not_exists(ConfidenceMax, :confidence)',
+        # The alert that opened the window is not counted in its digest, even when retried
+        ConditionExpression='WindowEnd >= :now AND FirstImageUrl <> :url',
+        ExpressionAttributeNames={'#count': 'Count'},
+        ExpressionAttributeValues={
+            ':url': image_details['ImageUrl'],
+            ':one': 1,
+            ':anomalies': 1 if image_details['IsAnomalous'] else 0,
+            ':low': 1 if low_confidence else 0,
+            ':confidence': confidence,
+            ':now': now
+        },
+        ReturnValues='ALL_NEW'
+    )
+    window = response['Attributes']
+    key = {'WindowKey': window_key}
+
+    if window['Count'] <= ALERT_DIGEST_SAMPLE_SIZE:
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET SampleImageUrls = list_append(if_not_exists(SampleImageUrls, :empty), :url)',
+            ExpressionAttributeValues={':empty': [], ':url': [image_details['ImageUrl']]}
+        )
+    if window['ConfidenceMin'] > confidence:
+        set_if(table, key, 'ConfidenceMin', '>', confidence)
+    if window['ConfidenceMax'] < confidence:
+        set_if(table, key, 'ConfidenceMax', '<', confidence)
+
+
+def set_if(table, key, attribute, operator, value):
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET #a = :v',
+            ConditionExpression='#a ' + operator + ' :v',
+            ExpressionAttributeNames={'#a': attribute},
+            ExpressionAttributeValues={':v': value}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def format_time(epoch_seconds):
+    return datetime.datetime.utcfromtimestamp(int(epoch_seconds)).isoformat() + 'Z'
+
+
+def publish_digest(window):
+    """
+    Publishes one message summarising the alerts that were rolled into a window.
+    :return: The ID of the message.
+    """
+    subject = 'Defect Detection Digest - ' + 'AssemblyLine: ' + window['AssemblyLineId'] + ' Camera: ' + window['CameraId']
+    email = ('{} further alerts between {} and {}\n'
+             'Anomalous images: {}\n'
+             'Low confidence results: {}\n'
+             'Confidence range: {} - {}\n'
+             'First alerted image: {}\n'
+             'Sample images:\n{}').format(
+        window['Count'], format_time(window['WindowStart']), format_time(window['WindowEnd']),
+        window.get('Anomalies', 0), window.get('LowConfidence', 0),
+        window.get('ConfidenceMin'), window.get('ConfidenceMax'),
+        window['FirstImageUrl'], '\n'.join(window.get('SampleImageUrls', [])))
+    message = {"Body": "{} further alerts for assembly line {} camera {}".format(
+        window['Count'], window['AssemblyLineId'], window['CameraId'])}
+
+    with stage_timer('SnsPublish', {'CameraId': window['CameraId'], 'AssemblyLineId': window['AssemblyLineId']}):
+        response = sns.publish(
+            TargetArn=TARGET_ARN,
+            Message=json.dumps({'default': json.dumps(message),
+                                'email': email
+                                }),
+            Subject=subject[:100],
+            MessageStructure='json'
+        )
+    print('Published digest of {} alerts for {}'.format(window['Count'], window['WindowKey']))
+    return response['MessageId']
+
+
+def flush_expired_windows():
+    """
+    Publishes the digests of the closed windows, and of the expired windows
+    that no new alert has replaced yet. Expired windows are closed first, so
+    a digest is sent once even if an alert replaces the window concurrently,
+    and closed windows are deleted only once their digest is published, so
+    that a failed publish is retried by the next flush.
+    :return: number of digests published
+    """
+    table = dynamodb.Table(ALERT_WINDOW_TABLE_NAME)
+    now = int(time.time())
+    scan = {
+        'FilterExpression': 'WindowEnd < :now AND #count > :zero',
+        'ExpressionAttributeNames': {'#count': 'Count'},
+        'ExpressionAttributeValues': {':now': now, ':zero': 0}
+    }
+    published = 0
+    while True:
+        response = table.scan(**scan)
+        for window in response['Items']:
+            if not window.get('Closed'):
+                try:
+                    window = close_window(window, {
+                        'Delete': {
+                            'TableName': ALERT_WINDOW_TABLE_NAME,
+                            'Key': serialize({'WindowKey': window['WindowKey']}),
+                            'ConditionExpression': 'WindowEnd = :end',
+                            'ExpressionAttributeValues': serialize({':end': window['WindowEnd']})
+                        }
+                    })
+                except dynamodb.meta.client.exceptions.TransactionCanceledException:
+                    # Replaced by a new window, which closed it
+                    continue
+            publish_digest(window)
+            table.delete_item(Key={'WindowKey': window['WindowKey']})
+            published += 1
+        if 'LastEvaluatedKey' not in response:
+            return published
+        scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,111 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+REGION = os.environ.get('REGION', 'eu-west-1')
+AWS_CLIENT_CONNECT_TIMEOUT = float(os.environ.get('AWS_CLIENT_CONNECT_TIMEOUT', '2'))
+AWS_CLIENT_READ_TIMEOUT = float(os.environ.get('AWS_CLIENT_READ_TIMEOUT', '10'))
+# Retries after the first attempt
+AWS_CLIENT_MAX_RETRIES = int(os.environ.get('AWS_CLIENT_MAX_RETRIES', '3'))
+# Enough connections for the image, branch and shard thread pools to share a client
+AWS_CLIENT_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_CLIENT_MAX_POOL_CONNECTIONS', '50'))
+
+config_options = {
+    'connect_timeout': AWS_CLIENT_CONNECT_TIMEOUT,
+    'read_timeout': AWS_CLIENT_READ_TIMEOUT,
+    'max_pool_connections': AWS_CLIENT_MAX_POOL_CONNECTIONS,
+    'retries': {'max_attempts': AWS_CLIENT_MAX_RETRIES, 'mode': 'adaptive'}
+}
+try:
+    CLIENT_CONFIG = Config(tcp_keepalive=True, **config_options)
+except TypeError:
+    # tcp_keepalive needs botocore 1.27.84 or later - older runtimes keep the default
+    CLIENT_CONFIG = Config(**config_options)
+
+# Per-service changes to CLIENT_CONFIG
+SERVICE_CONFIG = {
+    # DetectAnomalies is retried by the pipeline and the Step Functions workflow, and
+    # throttles must reach the shared rate limiter rather than be absorbed by botocore
+    'lookoutvision': Config(retries={'max_attempts': 0, 'mode': 'standard'})
+}
+
+clients = {}
+lock = threading.Lock()
+
+
+def create(kind, service_name):
+    """
+    Default factory - creates a boto3 client or resource with the tuned configuration.
+    """
+    config = CLIENT_CONFIG
+    if service_name in SERVICE_CONFIG:
+        config = config.merge(SERVICE_CONFIG[service_name])
+    factory = boto3.client if kind == 'client' else boto3.resource
+    return factory(service_name, region_name=REGION, config=config)
+
+factory = create
+
+
+def get(kind, service_name):
+    """
+    Returns the cached client or resource for the service, creating it on first use.
+    Creation is serialized because the default boto3 session is not thread safe.
+    """
+    key = (kind, service_name)
+    if key not in clients:
+        with lock:
+            if key not in clients:
+                clients[key] = factory(kind, service_name)
+    return clients[key]
+
+
+def set_factory(new_factory=None):
+    """
+    Replaces the function used to create clients and resources, e.g. to point them at
+    local endpoints or stubs - it is called with the kind ('client' or 'resource') and
+    the service name. None restores the default factory.
+    """
+    global factory
+    with lock:
+        factory = new_factory or create
+        clients.clear()
+
+
+class LazyClient(object):
+    """
+    Stands in for a boto3 client or resource at module level, so that importing a
+    handler does not create clients for paths it does not take.
+    """
+
+    def __init__(self, kind, service_name):
+        self.kind = kind
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(get(self.kind, self.service_name), name)
+
+
+def client(service_name):
+    return LazyClient('client', service_name)
+
+
+def resource(service_name):
+    return LazyClient('resource', service_name)
@@ -0,0 +1,117 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import rateLimiter
+from startDetectAnomalies import detect_anomalies
+from imageDetails import build_image_details
+from putItemInDynamoDb import is_result_stored, put_item
+from publishMessage import publish_alert
+from s3Events import get_s3_objects
+
+MAX_CONCURRENT_IMAGES = int(os.environ.get('MAX_CONCURRENT_IMAGES', '10'))
+
+# Per-stage retry policies - these mirror the Retry blocks of DetectAnomaliesStateMachine
+DETECT_ANOMALIES_RETRY = {'IntervalSeconds': 1, 'MaxAttempts': 5, 'BackoffRate': 2}
+PUT_RESULT_RETRY = {'IntervalSeconds': 1, 'MaxAttempts': 2, 'BackoffRate': 2}
+PUBLISH_MESSAGE_RETRY = {'IntervalSeconds': 1, 'MaxAttempts': 2, 'BackoffRate': 2}
+
+print('Loading function')
+
+
+def call_with_retry(stage, retry, function, *args):
+    """
+    Calls a pipeline stage, retrying failures the same way a Step Functions
+    Retry block would: MaxAttempts retries after the first attempt, waiting
+    IntervalSeconds multiplied by BackoffRate after each failure.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(*args)
+        except Exception as e:
+            if attempt >= retry['MaxAttempts']:
+                print('{} failed after {} attempts'.format(stage, attempt + 1))
+                raise e
+            delay = retry['IntervalSeconds'] * (retry['BackoffRate'] ** attempt)
+            print('{} failed - {} - retrying in {} seconds'.format(stage, e, delay))
+            time.sleep(delay)
+            attempt += 1
+
+
+def run_pipeline(bucket, key, result_writer=None):
+    """
+    Runs anomaly detection, result persistence and alerting for one image
+    in-process, reusing the module level clients of each stage. Images whose
+    result is already stored, by an earlier attempt of a retried event or
+    message, are skipped and None is returned.
+    """
+    detect_response = call_with_retry('DetectAnomalies', DETECT_ANOMALIES_RETRY, detect_anomalies, bucket, key, is_result_stored)
+    if detect_response is None:
+        return None
+    return persist_and_alert(detect_response, result_writer)
+
+
+def persist_and_alert(detect_response, result_writer=None):
+    """
+    Writes the result row of a scored image and publishes its alert.
+    Returns the image details that were persisted.
+    :param result_writer: optional ResultWriter - the row is then only
+    buffered and is written when the caller flushes the writer
+    """
+    item = build_image_details(detect_response)
+
+    # The row is written once the alert is out, so that a stored row means the
+    # image is fully processed and retries can skip it
+    call_with_retry('PublishMessageToSNS', PUBLISH_MESSAGE_RETRY, publish_alert, item)
+    if result_writer:
+        result_writer.add(item)
+    else:
+        call_with_retry('PutResultInDynamoDb', PUT_RESULT_RETRY, put_item, item)
+    return item
+
+
+def lambda_handler(event, context):
+    rateLimiter.set_deadline(context)
+    objects = get_s3_objects(event)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENT_IMAGES, len(objects)))) as executor:
+        futures = [(key, executor.submit(run_pipeline, bucket, key)) for bucket, key in objects]
+
+    failures = []
+    results = []
+    skipped = 0
+    for key, future in futures:
+        try:
+            result = future.result()
+            if result is None:
+                skipped += 1
+            else:
+                results.append(result)
+        except Exception as e:
+            print(e)
+            failures.append(key)
+
+    print('Processed {} images - {} already stored - {} failed'.format(len(results), skipped, len(failures)))
+    if failures:
+        # Fail the invocation so that Lambda retries the event - the retry skips the images stored now
+        raise RuntimeError('Pipeline failed for: ' + ', '.join(failures))
+
+    return json.dumps({'ImageDetails': results}, default=str)
@@ -0,0 +1,110 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import awsClients
+import io
+import json
+import os
+import time
+
+# Pillow and NumPy are only needed when frame deduplication is enabled
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+# DynamoDB table holding the last scored frame of every camera - empty disables deduplication
+FRAME_DEDUP_TABLE_NAME = os.environ.get('FRAME_DEDUP_TABLE_NAME', '')
+# Frames whose hash differs from the last scored frame by at most this many bits reuse its verdict
+FRAME_DEDUP_MAX_DISTANCE = int(os.environ.get('FRAME_DEDUP_MAX_DISTANCE', '4'))
+# A camera's frame is scored again after its last verdict has been reused this many times
+FRAME_DEDUP_RESCORE_INTERVAL = int(os.environ.get('FRAME_DEDUP_RESCORE_INTERVAL', '30'))
+
+# dHash compares neighbouring pixels of a HASH_SIZE x HASH_SIZE grayscale thumbnail
+HASH_SIZE = 8
+
+dynamodb = awsClients.resource('dynamodb') if FRAME_DEDUP_TABLE_NAME else None
+
+# Fail the function rather than silently scoring every frame
+if FRAME_DEDUP_TABLE_NAME and Image is None:
+    raise ImportError('FRAME_DEDUP_TABLE_NAME is set but Pillow/NumPy could not be imported - '
+                      'package the function with the Lambda runtime wheels (make setup)')
+
+
+def is_enabled():
+    return dynamodb is not None
+
+
+def compute_frame_hash(image_body):
+    """
+    Computes a 64 bit difference hash (dHash) of an image.
+    :return: the hash as a 16 character hex string
+    """
+    image = Image.open(io.BytesIO(image_body))
+    # Decoding JPEGs at a reduced scale keeps hashing cheap for large frames
+    image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    image = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+
+    pixels = numpy.asarray(image, dtype=numpy.int16)
+    differences = pixels[:, 1:] > pixels[:, :-1]
+    return numpy.packbits(differences.flatten()).tobytes().hex()
+
+
+def hamming_distance(first_hash, second_hash):
+    return bin(int(first_hash, 16) ^ int(second_hash, 16)).count('1')
+
+
+def get_reusable_result(camera_id, frame_hash):
+    """
+    Returns the verdict of the last scored frame of the camera if the frame
+    is a near duplicate of it and the verdict has not yet been reused
+    FRAME_DEDUP_RESCORE_INTERVAL times.
+    :return: (DetectAnomalyResult, ImageId of the scored frame) or (None, None)
+    """
+    table = dynamodb.Table(FRAME_DEDUP_TABLE_NAME)
+    scored_frame = table.get_item(Key={'CameraId': camera_id}).get('Item')
+    if not scored_frame or hamming_distance(scored_frame['FrameHash'], frame_hash) > FRAME_DEDUP_MAX_DISTANCE:
+        return None, None
+
+    try:
+        # Claim one reuse - fails if the frame was rescored or the interval is used up meanwhile
+        table.update_item(
+            Key={'CameraId': camera_id},
+            UpdateExpression='ADD ReusedCount :one',
+            ConditionExpression='FrameHash = :frame_hash AND ReusedCount < :rescore_interval',
+            ExpressionAttributeValues={
+                ':one': 1,
+                ':frame_hash': scored_frame['FrameHash'],
+                ':rescore_interval': FRAME_DEDUP_RESCORE_INTERVAL
+            }
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return None, None
+
+    return json.loads(scored_frame['DetectAnomalyResult']), scored_frame['ImageId']
+
+
+def record_scored_frame(camera_id, frame_hash, result, image_id):
+    dynamodb.Table(FRAME_DEDUP_TABLE_NAME).put_item(Item={
+        'CameraId': camera_id,
+        'FrameHash': frame_hash,
+        'DetectAnomalyResult': json.dumps(result),
+        'ImageId': image_id,
+        'ReusedCount': 0,
+        'ScoredAt': int(time.time())
+    })
@@ -0,0 +1,78 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import datetime
+from decimal import Decimal
+
+
+CAPTURE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def format_capture_time(capture_time=None, fallback=None):
+    """
+    Normalizes an ISO 8601 capture time, or a datetime, to a UTC timestamp
+    with microseconds. A missing capture time defaults to fallback, or the
+    current time. An invalid one raises ValueError unless there is a fallback.
+    """
+    if not capture_time:
+        capture_time = fallback or datetime.datetime.utcnow()
+    if not isinstance(capture_time, datetime.datetime):
+        try:
+            capture_time = datetime.datetime.fromisoformat(capture_time.replace('Z', '+00:00'))
+        except ValueError:
+            if fallback is None:
+                raise
+            print('Invalid capture time: ' + capture_time + ' - using ' + str(fallback))
+            return format_capture_time(fallback)
+    if capture_time.tzinfo:
+        capture_time = capture_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return capture_time.strftime(CAPTURE_TIME_FORMAT)
+
+
+def get_result_sort_key(capture_time, image_id):
+    """
+    Returns the DateTime sort key of the result row of an image.
+    """
+    return format_capture_time(capture_time) + '#' + image_id
+
+
+def build_image_details(detect_response):
+    """
+    Builds the image details that are persisted to DynamoDB and used for
+    alerting from an enriched DetectAnomalies response.
+    The sort key is derived from the capture time and the image id, so that
+    retried writes of the same image always target the same row.
+    """
+    # The capture time is validated before inference - should an invalid one
+    # get here, the scored image is still stored rather than failing the write
+    capture_time = format_capture_time(detect_response.get('CaptureTime'), datetime.datetime.utcnow())
+
+    image_details = {}
+    image_details['CameraId'] = detect_response['CameraId']
+    image_details['DateTime'] = get_result_sort_key(capture_time, detect_response['ImageId'])
+    image_details['CaptureTime'] = capture_time
+    image_details['AssemblyLineId'] = detect_response['AssemblyLineId']
+    image_details['ImageUrl'] = detect_response['ImageUrl']
+    image_details['ImageId'] = detect_response['ImageId']
+    image_details['IsAnomalous'] = detect_response['DetectAnomalyResult']['IsAnomalous']
+    # Go through str so that float confidences convert to an exact Decimal
+    image_details['Confidence'] = Decimal(str(detect_response['DetectAnomalyResult']['Confidence']))
+    if 'ModelVersion' in detect_response:
+        image_details['ModelVersion'] = detect_response['ModelVersion']
+    if image_details['IsAnomalous']:
+        # Only anomalous rows carry the key of the sparse anomaly index
+        image_details['AnomalousAssemblyLineId'] = image_details['AssemblyLineId']
+    return image_details
@@ -0,0 +1,75 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import os
+import time
+
+# Pillow is only needed when preprocessing is enabled
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Target size as WIDTHxHEIGHT, e.g. 1024x768 - preprocessing is disabled when empty
+PREPROCESS_IMAGE_SIZE = os.environ.get('PREPROCESS_IMAGE_SIZE', '')
+PREPROCESS_JPEG_QUALITY = int(os.environ.get('PREPROCESS_JPEG_QUALITY', '90'))
+
+TARGET_SIZE = tuple(int(dimension) for dimension in PREPROCESS_IMAGE_SIZE.lower().split('x')) if PREPROCESS_IMAGE_SIZE else None
+
+# Fail the function rather than silently sending images unchanged
+if TARGET_SIZE and Image is None:
+    raise ImportError('PREPROCESS_IMAGE_SIZE is set but Pillow could not be imported - '
+                      'package the function with the Lambda runtime wheels (make setup)')
+
+
+def is_enabled():
+    return TARGET_SIZE is not None
+
+
+def preprocess_image(image_body, content_type):
+    """
+    Decodes an image, resizes it to the configured target size and
+    re-encodes it as JPEG at the configured quality.
+    :return: (image_body, content_type, stats) - the original image is
+    returned if re-encoding would not make it smaller.
+    """
+    start = time.perf_counter()
+
+    image = Image.open(io.BytesIO(image_body))
+    # JPEGs can be decoded straight at a reduced scale, which avoids holding
+    # the full resolution bitmap in memory
+    image.draft('RGB', TARGET_SIZE)
+    image = image.convert('RGB')
+    if image.size != TARGET_SIZE:
+        image = image.resize(TARGET_SIZE, Image.BILINEAR)
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=PREPROCESS_JPEG_QUALITY)
+    processed_body = output.getvalue()
+
+    stats = {
+        'OriginalBytes': len(image_body),
+        'ProcessedBytes': len(processed_body),
+        'DurationMs': round((time.perf_counter() - start) * 1000, 2)
+    }
+    if len(processed_body) >= len(image_body):
+        stats['ProcessedBytes'] = len(image_body)
+        stats['BytesSaved'] = 0
+        return image_body, content_type, stats
+
+    stats['BytesSaved'] = len(image_body) - len(processed_body)
+    return processed_body, 'image/jpeg', stats
@@ -0,0 +1,165 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import datetime
+import json
+import os
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import awsClients
+import rateLimiter
+
+from imageDetails import format_capture_time
+from putItemInDynamoDb import is_result_stored
+from s3Events import get_s3_objects
+from startDetectAnomalies import detect_anomalies_in_image
+from detectAnomaliesPipeline import call_with_retry, persist_and_alert, DETECT_ANOMALIES_RETRY
+from resultWriter import ResultWriter
+
+MAX_CONCURRENT_FRAMES = int(os.environ.get('MAX_CONCURRENT_FRAMES', '10'))
+MANIFEST_FILE_NAME = 'manifest.json'
+
+CONTENT_TYPES = {
+    '.jpeg': 'image/jpeg',
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png'
+}
+
+s3 = awsClients.client('s3')
+
+print('Loading function')
+
+
+def get_content_type(member_name):
+    return CONTENT_TYPES.get(os.path.splitext(member_name)[1].lower())
+
+
+def get_frame_metadata(archive_metadata, manifest, member):
+    """
+    Returns the cameraid, assemblylineid, imageid and capturetime of a frame.
+    Values listed for the frame in the archive manifest take precedence over
+    the metadata of the archive object and the member itself.
+    :raises ValueError: when neither lists the cameraid and assemblylineid of the frame
+    """
+    member_name = os.path.basename(member.name)
+    member_time = datetime.datetime.fromtimestamp(member.mtime, datetime.timezone.utc)
+    frame_metadata = {'imageid': member_name}
+    for name in ('cameraid', 'assemblylineid'):
+        if name in archive_metadata:
+            frame_metadata[name] = archive_metadata[name]
+    frame_metadata.update(manifest.get(member_name, {}))
+    missing = [name for name in ('cameraid', 'assemblylineid') if not frame_metadata.get(name)]
+    if missing:
+        raise ValueError('No ' + ' or '.join(missing) + ' for archive member ' + member.name)
+    frame_metadata['capturetime'] = format_capture_time(frame_metadata.get('capturetime'), member_time)
+    return frame_metadata
+
+
+def score_frame(image_body, content_type, metadata, image_url, result_writer):
+    # Lambda retries a failed archive as a whole - its completed frames are skipped
+    if is_result_stored(metadata['cameraid'], metadata['capturetime'], metadata['imageid']):
+        print('Skipping frame stored by an earlier attempt: ' + metadata['imageid'])
+        return None
+    detect_response = call_with_retry('DetectAnomalies', DETECT_ANOMALIES_RETRY, detect_anomalies_in_image,
+                                      image_body, content_type, metadata, image_url)
+    return persist_and_alert(detect_response, result_writer)
+
+
+def process_archive(bucket, key):
+    """
+    Streams a tar archive of frames from S3 and scores its members
+    concurrently, without extracting the archive to disk. An optional
+    manifest.json member placed before the frames lists the ids of each
+    frame: {"frames": [{"name": ..., "cameraid": ..., "assemblylineid": ..., "imageid": ..., "capturetime": ...}]}
+    """
+    response = s3.get_object(Bucket=bucket, Key=key)
+    archive_metadata = response['Metadata']
+    manifest = {}
+    result_writer = ResultWriter()
+
+    # Bounds the frames held in memory while they wait to be scored
+    in_flight = threading.BoundedSemaphore(MAX_CONCURRENT_FRAMES)
+    futures = []
+
+    def release(future):
+        in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FRAMES) as executor:
+        # Stream mode reads the members in order from the S3 body
+        with tarfile.open(fileobj=response['Body'], mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                member_name = os.path.basename(member.name)
+
+                if member_name == MANIFEST_FILE_NAME:
+                    frames = json.loads(archive.extractfile(member).read())['frames']
+                    manifest = {frame.pop('name'): frame for frame in frames}
+                    continue
+
+                content_type = get_content_type(member_name)
+                if not content_type:
+                    print('Skipping unsupported archive member: ' + member.name)
+                    continue
+
+                metadata = get_frame_metadata(archive_metadata, manifest, member)
+                in_flight.acquire()
+                image_body = archive.extractfile(member).read()
+                future = executor.submit(score_frame, image_body, content_type, metadata,
+                                         's3://' + bucket + '/' + key + '#' + member.name, result_writer)
+                future.add_done_callback(release)
+                futures.append((member.name, future))
+
+    results = []
+    failures = []
+    skipped = 0
+    for member_name, future in futures:
+        try:
+            result = future.result()
+            if result is None:
+                skipped += 1
+            else:
+                results.append(result)
+        except Exception as e:
+            print(e)
+            failures.append(member_name)
+
+    # Rows of the frames that completed are written even when others failed,
+    # so that a retry of the archive skips them
+    unwritten_items = result_writer.flush()
+    failures.extend(item['ImageId'] for item in unwritten_items)
+    results = [item for item in results if item not in unwritten_items]
+
+    print('Scored {} frames of s3://{}/{} - {} already stored - {} failed'.format(
+        len(results), bucket, key, skipped, len(failures)))
+    if failures:
+        raise RuntimeError('Pipeline failed for frames of ' + key + ': ' + ', '.join(failures))
+    return results
+
+
+def lambda_handler(event, context):
+    rateLimiter.set_deadline(context)
+    results = []
+    for bucket, key in get_s3_objects(event):
+        try:
+            results.extend(process_archive(bucket, key))
+        except Exception as e:
+            print(e)
+            raise e
+
+    return json.dumps({'ImageDetails': results}, default=str)
@@ -0,0 +1,68 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import rateLimiter
+from detectAnomaliesPipeline import run_pipeline
+from resultWriter import ResultWriter, get_item_key
+from s3Events import get_s3_objects
+
+MAX_CONCURRENT_IMAGES = int(os.environ.get('MAX_CONCURRENT_IMAGES', '10'))
+
+print('Loading function')
+
+
+def lambda_handler(event, context):
+    rateLimiter.set_deadline(context)
+    failed_message_ids = set()
+    # Results of the whole batch are written together once all images are scored
+    result_writer = ResultWriter()
+    message_ids_by_key = {}
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_IMAGES) as executor:
+        futures = {}
+        for record in event['Records']:
+            try:
+                # S3 test events carry no records
+                for bucket, key in get_s3_objects(json.loads(record['body'])):
+                    futures[executor.submit(run_pipeline, bucket, key, result_writer)] = record['messageId']
+            except Exception as e:
+                print(e)
+                failed_message_ids.add(record['messageId'])
+
+        for future in as_completed(futures):
+            try:
+                item = future.result()
+                # None when the image was stored before the message was redelivered
+                if item is not None:
+                    message_ids_by_key[get_item_key(item)] = futures[future]
+            except Exception as e:
+                print(e)
+                failed_message_ids.add(futures[future])
+
+    for item in result_writer.flush():
+        failed_message_ids.add(message_ids_by_key[get_item_key(item)])
+
+    print('Processed {} images from {} messages, {} messages failed'.format(
+        len(futures), len(event['Records']), len(failed_message_ids)))
+
+    # Only the failed messages become visible again on the queue
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
@@ -15,12 +15,15 @@
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import os
-import boto3
+import awsClients
 import json
 import logging
 from decimal import Decimal
 
-client = boto3.client('sns')
+import alertAggregator
+from metrics import stage_timer, log_payload
+
+client = awsClients.client('sns')
 TARGET_ARN = os.environ['TARGET_ARN']
 REGION = os.environ['REGION']
 CONFIDENCE_THRESHOLD =  Decimal(os.environ['CONFIDENCE_THRESHOLD'])
@@ -28,27 +31,32 @@ CONFIDENCE_THRESHOLD =  Decimal(os.environ['CONFIDENCE_THRESHOLD'])
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def lambda_handler(event, context):
+def publish_alert(image_details):
     """
-    Publishes a message to a topic. 
-    :return: The ID of the message.
+    Publishes an alert to the topic if the image is anomalous or the
+    inference result has low confidence.
+    :return: The ID of the message, or an empty string if no alert was sent.
     """
 
-    try:
-        payload = event['Input']['Payload']
-        image_details = payload['ImageDetails']
-        print(image_details)
-        MESSAGE_ANOMALOUS_LOW_CONFIDENCE = 'Defect detected with LOW confidence for image with id: ' + image_details['ImageId'] + '\nImage URL: ' + image_details['ImageUrl'] + '\nDateTime:' + str(image_details['DateTime']) + '\nConfidence: ' + str(image_details['Confidence'])
-        MESSAGE_ANOMALOUS = 'Defect detected for image with id: ' + image_details['ImageId'] + '\nImage URL: ' + image_details['ImageUrl'] + '\nDateTime:' + str(image_details['DateTime']) + '\nConfidence: ' + str(image_details['Confidence'])
-        MESSAGE_NORMAL_LOW_CONFIDENCE = 'Low Confidence for non-anomalous image - \nImageId:' + image_details['ImageId'] + '\nImage URL: ' + image_details['ImageUrl'] + '\nDateTime:' + str(image_details['DateTime']) + '\nConfidence: ' + str(image_details['Confidence'])
-        SUBJECT = 'Defect Detection Alert - ' + 'AssemblyLine: ' + image_details['AssemblyLineId'] + ' Camera: ' + image_details['CameraId']
-        message = {"Body": "Defect detected for image " + image_details['ImageUrl']}
-        confidence = Decimal(image_details['Confidence'])
-        message_id = ''
-        
-        if(image_details['IsAnomalous']):
-            print('Image is an anomaly - sending alert message')
-            if(confidence < CONFIDENCE_THRESHOLD):
+    MESSAGE_ANOMALOUS_LOW_CONFIDENCE = 'Defect detected with LOW confidence for image with id: ' + image_details['ImageId'] + '\nImage URL: ' + image_details['ImageUrl'] + '\nDateTime:' + image_details['CaptureTime'] + '\nConfidence: ' + str(image_details['Confidence'])
+    MESSAGE_ANOMALOUS = 'Defect detected for image with id: ' + image_details['ImageId'] + '\nImage URL: ' + image_details['ImageUrl'] + '\nDateTime:' + image_details['CaptureTime'] + '\nConfidence: ' + str(image_details['Confidence'])
+    MESSAGE_NORMAL_LOW_CONFIDENCE = 'Low Confidence for non-anomalous image - \nImageId:' + image_details['ImageId'] + '\nImage URL: ' + image_details['ImageUrl'] + '\nDateTime:' + image_details['CaptureTime'] + '\nConfidence: ' + str(image_details['Confidence'])
+    SUBJECT = 'Defect Detection Alert - ' + 'AssemblyLine: ' + image_details['AssemblyLineId'] + ' Camera: ' + image_details['CameraId']
+    message = {"Body": "Defect detected for image " + image_details['ImageUrl']}
+    confidence = Decimal(image_details['Confidence'])
+    message_id = ''
+    dimensions = {'CameraId': image_details['CameraId'], 'AssemblyLineId': image_details['AssemblyLineId']}
+
+    if alertAggregator.is_enabled() and (image_details['IsAnomalous'] or confidence < CONFIDENCE_THRESHOLD):
+        # Only the first alert of a window is sent right away - the others are sent as a digest
+        if not alertAggregator.record_alert(image_details, confidence < CONFIDENCE_THRESHOLD):
+            print('Alert rolled into the digest of the open window')
+            return message_id
+
+    if(image_details['IsAnomalous']):
+        print('Image is an anomaly - sending alert message')
+        if(confidence < CONFIDENCE_THRESHOLD):
+            with stage_timer('SnsPublish', dimensions):
                 response = client.publish(
                     TargetArn=TARGET_ARN,
                     Message=json.dumps({'default': json.dumps(message),
@@ -57,7 +65,8 @@ def lambda_handler(event, context):
                     Subject='LOW Confidence - ' + SUBJECT,
                     MessageStructure='json'
                 )
-            else:
+        else:
+            with stage_timer('SnsPublish', dimensions):
                 response = client.publish(
                     TargetArn=TARGET_ARN,
                     Message=json.dumps({'default': json.dumps(message),
@@ -66,14 +75,15 @@ def lambda_handler(event, context):
                     Subject=SUBJECT,
                     MessageStructure='json'
                 )
-            message_id = response['MessageId']
-            logger.info(
-                "Published defect detected message to topic %s.", TARGET_ARN)
-        else:
-            
-            if(confidence < CONFIDENCE_THRESHOLD):
+        message_id = response['MessageId']
+        logger.info(
+            "Published defect detected message to topic %s.", TARGET_ARN)
+    else:
 
-                message = {"Body": "Defect detected for image " + image_details['ImageUrl']}
+        if(confidence < CONFIDENCE_THRESHOLD):
+
+            message = {"Body": "Defect detected for image " + image_details['ImageUrl']}
+            with stage_timer('SnsPublish', dimensions):
                 response = client.publish(
                     TargetArn=TARGET_ARN,
                     Message=json.dumps({'default': json.dumps(message),
@@ -82,10 +92,22 @@ def lambda_handler(event, context):
                     Subject='Low Confidence Alert for Non-anomalous image - ' + 'AssemblyLine: ' + image_details['AssemblyLineId'] + ' Camera: ' + image_details['CameraId'],
                     MessageStructure='json'
                 )
-                message_id = response['MessageId']
-                logger.info("Published defect detected message to topic %s.", TARGET_ARN)
+            message_id = response['MessageId']
+            logger.info("Published defect detected message to topic %s.", TARGET_ARN)
+
+    return message_id
+
+def lambda_handler(event, context):
+    """
+    Publishes a message to a topic. 
+    :return: The ID of the message.
+    """
 
-        return message_id
+    try:
+        payload = event['Input']['Payload']
+        image_details = payload['ImageDetails']
+        log_payload('ImageDetails', image_details)
+        return publish_alert(image_details)
     except Exception as e:
         logger.exception("Couldn't publish message to topic %s.", TARGET_ARN)
         print(e)
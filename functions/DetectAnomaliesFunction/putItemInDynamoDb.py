@@ -14,36 +14,62 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
+import awsClients
 import json
 import os
 import urllib.request
-import datetime
 from decimal import Decimal
 
-REGION = os.environ.get('REGION', 'eu-west-1')
+from imageDetails import build_image_details, get_result_sort_key
+from resultSharding import get_sharded_camera_id, shard_item
+from metrics import stage_timer
+
 DYNAMODB_TABLE_NAME = os.environ['DYNAMODB_TABLE_NAME']
 
 # Initiate clients
-dynamodb = boto3.resource('dynamodb', region_name=REGION)
+dynamodb = awsClients.resource('dynamodb')
+
+def put_item(item):
+    table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+    # write the record to the database - the key is derived from the image, so
+    # a retried write of an image that was already stored is a no-op
+    try:
+        with stage_timer('DynamoDbWrite', {'CameraId': item['CameraId'], 'AssemblyLineId': item['AssemblyLineId']}):
+            return table.put_item(
+                Item=shard_item(item),
+                ConditionExpression='attribute_not_exists(#dt)',
+                ExpressionAttributeNames={'#dt': 'DateTime'}
+            )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        print('Result already stored for image: ' + item['ImageId'])
+        return {'AlreadyStored': True}
+
+def is_result_stored(camera_id, capture_time, image_id):
+    """
+    Returns whether the result of an image was stored by an earlier attempt,
+    so that retried events skip the images they already scored and alerted on.
+    """
+    response = dynamodb.Table(DYNAMODB_TABLE_NAME).get_item(
+        Key={
+            'CameraId': get_sharded_camera_id(camera_id, image_id),
+            'DateTime': get_result_sort_key(capture_time, image_id)
+        },
+        ProjectionExpression='#dt',
+        ExpressionAttributeNames={'#dt': 'DateTime'}
+    )
+    return 'Item' in response
 
 def lambda_handler(event, context):
     payload = event['Input']['Payload']
-    timestamp = datetime.datetime.now().isoformat()
-
-    table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-    item = {}
-    item['CameraId'] = payload['CameraId']
-    item['DateTime'] = timestamp
-    item['AssemblyLineId'] = payload['AssemblyLineId']
-    item['ImageUrl'] = payload['ImageUrl']
-    item['ImageId'] = payload['ImageId']
-    item['IsAnomalous'] = payload['DetectAnomalyResult']['IsAnomalous']
-    item['Confidence'] = Decimal(payload['DetectAnomalyResult']['Confidence'])
+    if 'ImageDetails' in payload:
+        # Built by the DetectAnomalies step - the confidence arrives as a JSON float
+        item = dict(payload['ImageDetails'])
+        item['Confidence'] = Decimal(str(item['Confidence']))
+    else:
+        item = build_image_details(payload)
 
     try:
-        # write the record to the database
-        response = table.put_item(Item=item)
+        response = put_item(item)
         response['ImageDetails'] = item
         return response
 
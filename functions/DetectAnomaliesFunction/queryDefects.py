@@ -0,0 +1,189 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import base64
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Attr, Key
+
+import resultSharding
+from imageDetails import format_capture_time
+
+DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', '')
+ASSEMBLY_LINE_INDEX_NAME = os.environ.get('ASSEMBLY_LINE_INDEX_NAME', 'AssemblyLineIndex')
+# Sparse index of anomalous rows - empty if the index was not deployed
+ANOMALY_INDEX_NAME = os.environ.get('ANOMALY_INDEX_NAME', '')
+MAX_CONCURRENT_QUERIES = int(os.environ.get('MAX_CONCURRENT_QUERIES', '10'))
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+FIELDS = ['CameraId', 'DateTime', 'CaptureTime', 'AssemblyLineId', 'ImageId', 'ImageUrl', 'IsAnomalous', 'Confidence', 'ModelVersion']
+# Needed to merge and paginate the results
+REQUIRED_FIELDS = ['CameraId', 'DateTime']
+
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES)
+
+print('Loading function')
+
+
+def get_query_options(fields, anomalous_only, model_version=None):
+    """
+    Returns the ProjectionExpression and the filter of a query. Results of a
+    model version are selected with model_version - otherwise the rows
+    written by a backfill, which duplicate the live results of their images,
+    are left out. IsAnomalous is filtered on when the sparse index cannot be used.
+    """
+    names = {}
+    for index, field in enumerate(fields):
+        names['#f' + str(index)] = field
+    options = {
+        'ProjectionExpression': ', '.join(names.keys()),
+        'ExpressionAttributeNames': names
+    }
+    if model_version:
+        condition = Attr('ModelVersion').eq(model_version)
+    else:
+        condition = Attr('Backfill').not_exists()
+    if anomalous_only:
+        condition = condition & Attr('IsAnomalous').eq(True)
+    options['FilterExpression'] = condition
+    return options
+
+
+def query_assembly_line(assembly_line_id, start_time, end_time, limit, fields, anomalous_only, model_version=None):
+    """
+    Queries the results of an assembly line, newest first, from the assembly
+    line index - or from the sparse anomaly index for anomalous results only.
+    """
+    if anomalous_only and ANOMALY_INDEX_NAME:
+        index_name = ANOMALY_INDEX_NAME
+        partition_key = 'AnomalousAssemblyLineId'
+        query_options = get_query_options(fields, False, model_version)
+    else:
+        index_name = ASSEMBLY_LINE_INDEX_NAME
+        partition_key = 'AssemblyLineId'
+        query_options = get_query_options(fields, anomalous_only, model_version)
+
+    def key_condition(value):
+        condition = Key(partition_key).eq(value)
+        if start_time and end_time:
+            return condition & Key('DateTime').between(start_time, end_time)
+        if start_time:
+            return condition & Key('DateTime').gte(start_time)
+        if end_time:
+            return condition & Key('DateTime').lt(end_time)
+        return condition
+
+    query_options['IndexName'] = index_name
+    return resultSharding.query_shard(assembly_line_id, key_condition, True, limit, end_time, query_options)
+
+
+def query_cameras(camera_ids, start_time, end_time, limit, fields, anomalous_only, model_version=None):
+    """
+    Queries the results of several cameras in parallel - each across all of
+    its shards - and merges them newest first.
+    """
+    query_options = get_query_options(fields, anomalous_only, model_version)
+    futures = [executor.submit(resultSharding.query_camera_results, camera_id, start_time, end_time, True, limit, query_options)
+               for camera_id in camera_ids]
+    merged = heapq.merge(*[future.result() for future in futures], key=lambda item: item['DateTime'], reverse=True)
+    items = []
+    for item in merged:
+        items.append(item)
+        if len(items) == limit:
+            break
+    return items
+
+
+def encode_next_token(date_time):
+    return base64.urlsafe_b64encode(date_time.encode('utf-8')).decode('utf-8')
+
+
+def decode_next_token(next_token):
+    return base64.urlsafe_b64decode(next_token.encode('utf-8')).decode('utf-8')
+
+
+def to_json(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+
+def build_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'isBase64Encoded': False,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(body, default=to_json)
+    }
+
+
+def query_defects(params):
+    """
+    Returns a page of results, newest first, for an assembly line or a comma
+    separated list of cameras.
+    Query string parameters: assemblylineid or cameraid, from and to (ISO 8601
+    capture times), anomalous (true|false), modelversion, fields (comma
+    separated), limit and nexttoken (from the previous page).
+    """
+    assembly_line_id = params.get('assemblylineid')
+    camera_ids = [camera_id for camera_id in params.get('cameraid', '').split(',') if camera_id]
+    if not assembly_line_id and not camera_ids:
+        raise ValueError('assemblylineid or cameraid is required')
+
+    start_time = format_capture_time(params['from']) if params.get('from') else None
+    end_time = format_capture_time(params['to']) if params.get('to') else None
+    if params.get('nexttoken'):
+        # Pages are contiguous ranges of DateTime - continue below the last row returned
+        end_time = decode_next_token(params['nexttoken'])
+
+    limit = min(MAX_LIMIT, max(1, int(params.get('limit', DEFAULT_LIMIT))))
+    anomalous_only = params.get('anomalous', 'false').lower() == 'true'
+    model_version = params.get('modelversion')
+
+    fields = [field for field in params.get('fields', '').split(',') if field]
+    unknown_fields = [field for field in fields if field not in FIELDS]
+    if unknown_fields:
+        raise ValueError('Unknown fields: ' + ', '.join(unknown_fields))
+    fields = REQUIRED_FIELDS + [field for field in (fields or FIELDS) if field not in REQUIRED_FIELDS]
+
+    if camera_ids:
+        items = query_cameras(camera_ids, start_time, end_time, limit, fields, anomalous_only, model_version)
+    else:
+        items = query_assembly_line(assembly_line_id, start_time, end_time, limit, fields, anomalous_only, model_version)
+
+    body = {'Items': items, 'Count': len(items)}
+    if len(items) == limit:
+        body['NextToken'] = encode_next_token(items[-1]['DateTime'])
+    return body
+
+
+def lambda_handler(event, context):
+    try:
+        return build_response(200, query_defects(event.get('queryStringParameters') or {}))
+    except ValueError as e:
+        print(e)
+        return build_response(400, {'Message': str(e)})
+    except Exception as e:
+        print(e)
+        raise e
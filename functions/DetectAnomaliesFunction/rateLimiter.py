@@ -0,0 +1,225 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import awsClients
+import os
+import random
+import threading
+import time
+from decimal import Decimal
+
+# DynamoDB table shared by every function instance - empty disables rate limiting
+RATE_LIMITER_TABLE_NAME = os.environ.get('RATE_LIMITER_TABLE_NAME', '')
+RATE_LIMITER_ID = os.environ.get('RATE_LIMITER_ID', 'lookoutvision')
+# Account-wide requests per second - the rate starts at the initial value and is adjusted (AIMD) between min and max
+RATE_LIMIT_INITIAL_TPS = float(os.environ.get('RATE_LIMIT_INITIAL_TPS', '10'))
+RATE_LIMIT_MIN_TPS = float(os.environ.get('RATE_LIMIT_MIN_TPS', '1'))
+RATE_LIMIT_MAX_TPS = float(os.environ.get('RATE_LIMIT_MAX_TPS', '50'))
+RATE_INCREASE_STEP_TPS = float(os.environ.get('RATE_INCREASE_STEP_TPS', '1'))
+RATE_DECREASE_FACTOR = float(os.environ.get('RATE_DECREASE_FACTOR', '0.5'))
+# The rate is increased at most once per interval across all instances, and not within an interval of a decrease
+RATE_ADJUST_INTERVAL_SECONDS = int(os.environ.get('RATE_ADJUST_INTERVAL_SECONDS', '5'))
+# Most tokens taken from the shared bucket at once, so that most requests are served locally. Tokens left
+# when their second ends are lost, so leases are also capped by the requests of the previous second
+RATE_LIMIT_LEASE_SIZE = int(os.environ.get('RATE_LIMIT_LEASE_SIZE', '10'))
+# Time of an invocation kept for the inference and what follows it - waits end before it
+RATE_LIMIT_TIME_RESERVE_SECONDS = float(os.environ.get('RATE_LIMIT_TIME_RESERVE_SECONDS', '2'))
+# Longest wait outside of Lambda, where there is no remaining time to go by
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '3'))
+
+dynamodb = awsClients.resource('dynamodb') if RATE_LIMITER_TABLE_NAME else None
+
+# Guards the state only - it is never held across a DynamoDB call
+lock = threading.Lock()
+state = {
+    'Tokens': 0,
+    'LeaseSecond': 0,
+    'Requests': 0,
+    'RequestSecond': 0,
+    'PreviousRequests': 0,
+    'Rate': RATE_LIMIT_INITIAL_TPS,
+    'RateRefreshedAt': 0,
+    'LastIncreaseAttempt': 0,
+    'Deadline': None
+}
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def is_enabled():
+    return dynamodb is not None
+
+
+def set_deadline(context):
+    """
+    Bounds the waits of the current invocation by its remaining time.
+    """
+    with lock:
+        if context is None:
+            state['Deadline'] = None
+        else:
+            state['Deadline'] = time.time() + context.get_remaining_time_in_millis() / 1000 - RATE_LIMIT_TIME_RESERVE_SECONDS
+
+
+def get_rate():
+    """
+    Returns the shared rate, refreshed from DynamoDB at most once per adjust interval.
+    """
+    now = time.time()
+    with lock:
+        if now - state['RateRefreshedAt'] < RATE_ADJUST_INTERVAL_SECONDS:
+            return state['Rate']
+        # Claimed before the read, so that concurrent callers keep using the current rate meanwhile
+        state['RateRefreshedAt'] = now
+    item = dynamodb.Table(RATE_LIMITER_TABLE_NAME).get_item(Key={'LimiterId': RATE_LIMITER_ID + '#rate'}).get('Item')
+    with lock:
+        state['Rate'] = float(item['Rate']) if item else RATE_LIMIT_INITIAL_TPS
+        return state['Rate']
+
+
+def count_request(second):
+    """
+    Counts a request of this instance and returns how many it sent in the previous second.
+    """
+    with lock:
+        if state['RequestSecond'] != second:
+            state['PreviousRequests'] = state['Requests'] if state['RequestSecond'] == second - 1 else 0
+            state['Requests'] = 0
+            state['RequestSecond'] = second
+        state['Requests'] += 1
+        return state['PreviousRequests']
+
+
+def lease_tokens(second, tokens, rate):
+    """
+    Atomically takes tokens from the shared bucket of the given second.
+    :return: True if the tokens were granted
+    """
+    try:
+        dynamodb.Table(RATE_LIMITER_TABLE_NAME).update_item(
+            Key={'LimiterId': RATE_LIMITER_ID + '#' + str(second)},
+            UpdateExpression='ADD Granted :tokens SET ExpiresAt = :expires_at',
+            ConditionExpression='attribute_not_exists(Granted) OR Granted <= :max_granted',
+            ExpressionAttributeValues={
+                ':tokens': tokens,
+                ':max_granted': int(rate) - tokens,
+                ':expires_at': second + 300
+            }
+        )
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def acquire():
+    """
+    Blocks until a request may be sent.
+    :return: the number of seconds spent waiting for a token
+    """
+    start = time.time()
+    previous_requests = count_request(int(start))
+    deadline = state['Deadline'] or start + RATE_LIMIT_MAX_WAIT_SECONDS
+    while True:
+        now = time.time()
+        second = int(now)
+        with lock:
+            if state['LeaseSecond'] == second and state['Tokens'] > 0:
+                state['Tokens'] -= 1
+                return now - start
+
+        rate = get_rate()
+        lease_size = max(1, min(RATE_LIMIT_LEASE_SIZE, previous_requests, int(rate)))
+        # Fall back to a single token when the bucket cannot fill a whole lease
+        for tokens in sorted({lease_size, 1}, reverse=True):
+            if lease_tokens(second, tokens, rate):
+                with lock:
+                    if state['LeaseSecond'] != second:
+                        state['LeaseSecond'] = second
+                        state['Tokens'] = 0
+                    state['Tokens'] += tokens - 1
+                return time.time() - start
+
+        # Give up rather than wake up with too little time left to score the image
+        if second + 1 >= deadline:
+            raise RateLimitExceeded('No token available after {:.2f} seconds'.format(now - start))
+        # Wait for the next second's bucket, with jitter to spread the callers
+        time.sleep(second + 1 - now + random.uniform(0, 0.05))
+
+
+def on_throttled():
+    """
+    Multiplicative decrease - applied once per observed rate, however many
+    callers are throttled at the same time.
+    """
+    with lock:
+        state['Tokens'] = 0
+        old_rate = state['Rate']
+    new_rate = max(RATE_LIMIT_MIN_TPS, old_rate * RATE_DECREASE_FACTOR)
+    try:
+        dynamodb.Table(RATE_LIMITER_TABLE_NAME).update_item(
+            Key={'LimiterId': RATE_LIMITER_ID + '#rate'},
+            UpdateExpression='SET Rate = :new_rate, DecreasedAt = :now',
+            ConditionExpression='attribute_not_exists(Rate) OR Rate = :old_rate',
+            ExpressionAttributeValues={
+                ':new_rate': Decimal(str(new_rate)),
+                ':old_rate': Decimal(str(old_rate)),
+                ':now': int(time.time())
+            }
+        )
+        print('Throttled by Lookout for Vision - rate decreased from {} to {} TPS'.format(old_rate, new_rate))
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+    except Exception as e:
+        print('Failed to decrease the rate: ' + str(e))
+    with lock:
+        # Pick up the decrease, ours or another caller's, on the next acquire
+        state['RateRefreshedAt'] = 0
+
+
+def on_success():
+    """
+    Additive increase - at most once per adjust interval across all callers.
+    """
+    now = int(time.time())
+    with lock:
+        if now - state['LastIncreaseAttempt'] < RATE_ADJUST_INTERVAL_SECONDS or state['Rate'] >= RATE_LIMIT_MAX_TPS:
+            return
+        state['LastIncreaseAttempt'] = now
+    cutoff = now - RATE_ADJUST_INTERVAL_SECONDS
+    try:
+        response = dynamodb.Table(RATE_LIMITER_TABLE_NAME).update_item(
+            Key={'LimiterId': RATE_LIMITER_ID + '#rate'},
+            UpdateExpression='SET Rate = if_not_exists(Rate, :initial_rate) + :step, IncreasedAt = :now',
+            ConditionExpression='(attribute_not_exists(Rate) OR Rate <= :max_rate) '
+                                'AND (attribute_not_exists(IncreasedAt) OR IncreasedAt < :cutoff) '
+                                'AND (attribute_not_exists(DecreasedAt) OR DecreasedAt < :cutoff)',
+            ExpressionAttributeValues={
+                ':initial_rate': Decimal(str(RATE_LIMIT_INITIAL_TPS)),
+                ':step': Decimal(str(RATE_INCREASE_STEP_TPS)),
+                ':max_rate': Decimal(str(RATE_LIMIT_MAX_TPS - RATE_INCREASE_STEP_TPS)),
+                ':now': now,
+                ':cutoff': cutoff
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+        with lock:
+            state['Rate'] = float(response['Attributes']['Rate'])
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+    except Exception as e:
+        print('Failed to increase the rate: ' + str(e))
@@ -0,0 +1,108 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import awsClients
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of results kept in memory by a warm function instance - 0 disables the tier
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '0'))
+# DynamoDB table for the persistent tier - empty disables the tier
+RESULT_CACHE_TABLE_NAME = os.environ.get('RESULT_CACHE_TABLE_NAME', '')
+RESULT_CACHE_TTL_SECONDS = int(float(os.environ.get('RESULT_CACHE_TTL_HOURS', '24')) * 3600)
+
+dynamodb = awsClients.resource('dynamodb') if RESULT_CACHE_TABLE_NAME else None
+
+local_cache = OrderedDict()
+lock = threading.Lock()
+stats = {'LocalHits': 0, 'PersistentHits': 0, 'Misses': 0}
+
+
+def is_enabled():
+    return RESULT_CACHE_SIZE > 0 or bool(RESULT_CACHE_TABLE_NAME)
+
+
+def cache_key(image_body, project_name, model_version):
+    """
+    Results are only reusable for the same image bytes scored by the same model.
+    """
+    return hashlib.sha256(image_body).hexdigest() + '#' + project_name + '#' + model_version
+
+
+def put_local(key, result):
+    if RESULT_CACHE_SIZE <= 0:
+        return
+    with lock:
+        local_cache[key] = result
+        local_cache.move_to_end(key)
+        while len(local_cache) > RESULT_CACHE_SIZE:
+            local_cache.popitem(last=False)
+
+
+def get_result(key):
+    """
+    Looks up a DetectAnomalyResult, first in memory and then in DynamoDB.
+    :return: the cached result and the tier it came from ('Local' or
+    'Persistent'), or (None, None) on a miss.
+    """
+    with lock:
+        result = local_cache.get(key)
+        if result is not None:
+            local_cache.move_to_end(key)
+            stats['LocalHits'] += 1
+            return result, 'Local'
+
+    if dynamodb:
+        try:
+            item = dynamodb.Table(RESULT_CACHE_TABLE_NAME).get_item(Key={'CacheKey': key}).get('Item')
+            # Expired items can linger until DynamoDB TTL deletes them
+            if item and item['ExpiresAt'] > int(time.time()):
+                result = json.loads(item['DetectAnomalyResult'])
+                put_local(key, result)
+                with lock:
+                    stats['PersistentHits'] += 1
+                return result, 'Persistent'
+        except Exception as e:
+            print('Result cache lookup failed: ' + str(e))
+
+    with lock:
+        stats['Misses'] += 1
+    return None, None
+
+
+def put_result(key, result):
+    put_local(key, result)
+
+    if dynamodb:
+        try:
+            dynamodb.Table(RESULT_CACHE_TABLE_NAME).put_item(Item={
+                'CacheKey': key,
+                'DetectAnomalyResult': json.dumps(result),
+                'ExpiresAt': int(time.time()) + RESULT_CACHE_TTL_SECONDS
+            })
+        except Exception as e:
+            print('Result cache write failed: ' + str(e))
+
+
+def get_stats():
+    with lock:
+        current_stats = dict(stats)
+        current_stats['LocalSize'] = len(local_cache)
+    return current_stats
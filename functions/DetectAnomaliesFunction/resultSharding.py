@@ -0,0 +1,131 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import awsClients
+import hashlib
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Key
+
+DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', '')
+# JSON object of camera id to number of write shards, e.g. {"CAM123456": 4}
+# Cameras that are not listed are stored unsharded under their own id. Rows stay
+# under the key they were written with, so a count can grow but not shrink.
+CAMERA_SHARD_COUNTS = json.loads(os.environ.get('CAMERA_SHARD_COUNTS') or '{}')
+
+SHARD_SEPARATOR = '#'
+
+dynamodb = awsClients.resource('dynamodb')
+
+
+def get_shard_count(camera_id):
+    return max(1, int(CAMERA_SHARD_COUNTS.get(camera_id, 1)))
+
+
+def get_shard_ids(camera_id):
+    """
+    Returns the partition keys under which the results of a camera are stored.
+    The shards of any smaller count are among those of the current count, and
+    the unsharded key holds the rows written before the camera was sharded.
+    """
+    shard_count = get_shard_count(camera_id)
+    if shard_count == 1:
+        return [camera_id]
+    return [camera_id] + [camera_id + SHARD_SEPARATOR + str(shard) for shard in range(shard_count)]
+
+
+def get_sharded_camera_id(camera_id, image_id):
+    """
+    Returns the partition key for the result of an image. The shard is derived
+    from the image id, so that retried writes target the same row.
+    """
+    shard_count = get_shard_count(camera_id)
+    if shard_count == 1:
+        return camera_id
+    shard = int(hashlib.md5(image_id.encode('utf-8')).hexdigest()[:8], 16) % shard_count
+    return camera_id + SHARD_SEPARATOR + str(shard)
+
+
+def get_camera_id(partition_key):
+    """
+    Strips the shard suffix from a partition key.
+    """
+    camera_id, separator, shard = partition_key.rpartition(SHARD_SEPARATOR)
+    if separator and shard.isdigit():
+        return camera_id
+    return partition_key
+
+
+def shard_item(item):
+    """
+    Returns a copy of a result row keyed by its shard of the camera.
+    """
+    sharded_item = dict(item)
+    sharded_item['CameraId'] = get_sharded_camera_id(item['CameraId'], item['ImageId'])
+    return sharded_item
+
+
+def query_shard(partition_key, key_condition, newest_first, limit, end_time=None, query_options=None):
+    table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+    query = dict(query_options or {})
+    query['KeyConditionExpression'] = key_condition(partition_key)
+    query['ScanIndexForward'] = not newest_first
+    items = []
+    while True:
+        if limit:
+            query['Limit'] = limit - len(items)
+        response = table.query(**query)
+        for item in response['Items']:
+            # BETWEEN is inclusive - the end of the range is not
+            if end_time and item['DateTime'] >= end_time:
+                continue
+            item['CameraId'] = get_camera_id(item['CameraId'])
+            items.append(item)
+        if 'LastEvaluatedKey' not in response or (limit and len(items) >= limit):
+            return items
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_camera_results(camera_id, start_time=None, end_time=None, newest_first=True, limit=None, query_options=None):
+    """
+    Queries the results of a camera across all of its shards in parallel and
+    merges them by DateTime.
+    :param start_time: optional inclusive lower bound of DateTime (ISO 8601 capture time)
+    :param end_time: optional exclusive upper bound of DateTime
+    :param query_options: optional extra Query arguments, e.g. a ProjectionExpression
+    :return: list of result rows with the shard suffix stripped from CameraId
+    """
+    def key_condition(partition_key):
+        condition = Key('CameraId').eq(partition_key)
+        if start_time and end_time:
+            return condition & Key('DateTime').between(start_time, end_time)
+        if start_time:
+            return condition & Key('DateTime').gte(start_time)
+        if end_time:
+            return condition & Key('DateTime').lt(end_time)
+        return condition
+
+    shard_ids = get_shard_ids(camera_id)
+    with ThreadPoolExecutor(max_workers=len(shard_ids)) as executor:
+        shards = list(executor.map(
+            lambda shard_id: query_shard(shard_id, key_condition, newest_first, limit, end_time, query_options), shard_ids))
+
+    merged = heapq.merge(*shards, key=lambda item: item['DateTime'], reverse=newest_first)
+    items = list(merged)
+    return items[:limit] if limit else items
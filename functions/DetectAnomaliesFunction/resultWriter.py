@@ -0,0 +1,111 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import threading
+import time
+
+import awsClients
+from resultSharding import get_camera_id, shard_item
+from metrics import stage_timer
+
+DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', '')
+# Items buffered before they are flushed without waiting for flush()
+RESULT_WRITER_BUFFER_SIZE = int(os.environ.get('RESULT_WRITER_BUFFER_SIZE', '100'))
+# Retries for items returned as UnprocessedItems
+RESULT_WRITER_MAX_ATTEMPTS = int(os.environ.get('RESULT_WRITER_MAX_ATTEMPTS', '6'))
+RESULT_WRITER_RETRY_BASE_DELAY_SECONDS = float(os.environ.get('RESULT_WRITER_RETRY_BASE_DELAY_SECONDS', '0.05'))
+
+# BatchWriteItem service limit
+MAX_BATCH_ITEMS = 25
+
+# Initiate clients
+dynamodb = awsClients.resource('dynamodb')
+
+
+def get_item_key(item):
+    return (get_camera_id(item['CameraId']), item['DateTime'])
+
+
+class ResultWriter:
+    """
+    Buffers result rows and writes them to the results table with
+    BatchWriteItem. Rows are keyed by camera, capture time and image id, so
+    writing the same result again overwrites the row instead of duplicating it.
+    """
+
+    def __init__(self, table_name=DYNAMODB_TABLE_NAME, buffer_size=RESULT_WRITER_BUFFER_SIZE):
+        self.table_name = table_name
+        self.buffer_size = max(MAX_BATCH_ITEMS, buffer_size)
+        self.buffer = {}
+        self.failed_items = []
+        self.written_count = 0
+        self.lock = threading.Lock()
+
+    def add(self, item):
+        with self.lock:
+            # BatchWriteItem rejects requests with the same key twice
+            self.buffer[get_item_key(item)] = item
+            if len(self.buffer) < self.buffer_size:
+                return
+            items = list(self.buffer.values())
+            self.buffer = {}
+        self.write_items(items)
+
+    def flush(self):
+        """
+        Writes the buffered items and returns every item that could not be
+        written since the writer was created.
+        """
+        with self.lock:
+            items = list(self.buffer.values())
+            self.buffer = {}
+        self.write_items(items)
+        with self.lock:
+            return list(self.failed_items)
+
+    def write_items(self, items):
+        for start in range(0, len(items), MAX_BATCH_ITEMS):
+            failed = self.write_batch(items[start:start + MAX_BATCH_ITEMS])
+            with self.lock:
+                self.written_count += min(MAX_BATCH_ITEMS, len(items) - start) - len(failed)
+                self.failed_items.extend(failed)
+
+    def write_batch(self, items):
+        """
+        Writes up to 25 items, retrying unprocessed items with exponential
+        backoff. Returns the items that were still not written.
+        """
+        items_by_key = {get_item_key(item): item for item in items}
+        requests = [{'PutRequest': {'Item': shard_item(item)}} for item in items]
+        attempt = 0
+        while requests:
+            try:
+                with stage_timer('DynamoDbBatchWrite'):
+                    response = dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            except Exception as e:
+                print('BatchWriteItem failed - ' + str(e))
+            attempt += 1
+            if not requests or attempt >= RESULT_WRITER_MAX_ATTEMPTS:
+                break
+            delay = RESULT_WRITER_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+            print('{} items unprocessed - retrying in {} seconds'.format(len(requests), delay))
+            time.sleep(delay)
+
+        if requests:
+            print('Failed to write {} items after {} attempts'.format(len(requests), attempt))
+        return [items_by_key[get_item_key(request['PutRequest']['Item'])] for request in requests]
@@ -0,0 +1,40 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import urllib.parse
+
+
+def get_s3_objects(s3_event, with_version=False):
+    """
+    Returns the distinct (bucket, key) pairs referenced by an S3 event
+    notification, with the URL-encoded object keys decoded.
+    :param with_version: also return the version of each object - its version id,
+    or else the sequencer of its event, which differs for every write of a key
+    """
+    objects = []
+    seen = set()
+    for record in s3_event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        s3_object = record['s3']['object']
+        key = urllib.parse.unquote_plus(s3_object['key'])
+        if (bucket, key) in seen:
+            continue
+        seen.add((bucket, key))
+        if with_version:
+            objects.append((bucket, key, s3_object.get('versionId') or s3_object.get('sequencer') or s3_object.get('eTag', '')))
+        else:
+            objects.append((bucket, key))
+    return objects
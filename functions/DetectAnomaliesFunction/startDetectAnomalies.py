@@ -14,63 +14,165 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import json
-import urllib.parse
-import boto3
-import base64
+import awsClients
 import os
-import logging
+
+from imageDetails import build_image_details, format_capture_time
+import imagePreprocessing
+import resultCache
+import frameDeduplication
+import rateLimiter
+from metrics import put_metrics, stage_timer, log_payload
 
 # Environment Variables
 LFV_PROJECT_NAME = os.environ['LFV_PROJECT_NAME']
 LFV_MODEL_VERSION = os.environ['LFV_MODEL_VERSION']
-REGION = os.environ.get('REGION', 'eu-west-1')
 # Initiate clients
-lookoutvision = boto3.client('lookoutvision')
-s3 = boto3.client('s3')
+lookoutvision = awsClients.client('lookoutvision')
+s3 = awsClients.client('s3')
 
 print('Loading function')
 
 
 def lambda_handler(event, context):
+    rateLimiter.set_deadline(context)
     bucket = event['Input']['Bucket']
     key = event['Input']['Key']
     try:
         response = detect_anomalies(bucket, key)
+        # Built here so that the persistence and alerting steps can run in parallel
+        response['ImageDetails'] = build_image_details(response)
         return response
     except Exception as e:
         print(e)
         raise e
 
 
-def detect_anomalies(bucket, key):
+def detect_anomalies(bucket, key, is_stored=None):
+    """
+    Downloads an image from S3 and classifies it.
+    :param is_stored: optional function of the camera id, capture time and image id -
+    when it returns True the image is not scored again and None is returned
+    """
 
     try:
-        response = s3.get_object(Bucket=bucket, Key=key)
+        with stage_timer('S3GetObject') as dimensions:
+            response = s3.get_object(Bucket=bucket, Key=key)
+
+            content_type = response['ContentType']
+            image = response['Body']
+            image_body = image.read()
+            dimensions['CameraId'] = response['Metadata'].get('cameraid', '')
+            dimensions['AssemblyLineId'] = response['Metadata'].get('assemblylineid', '')
+
+        # Images uploaded without a valid capture time are dated by their upload -
+        # checked before the paid inference call, which a bad value would otherwise repeat on retry
+        metadata = dict(response['Metadata'])
+        metadata['capturetime'] = format_capture_time(metadata.get('capturetime'), response['LastModified'])
+        if is_stored and is_stored(metadata['cameraid'], metadata['capturetime'], metadata['imageid']):
+            print('Result already stored for image: ' + metadata['imageid'])
+            return None
+
+        return detect_anomalies_in_image(image_body, content_type, metadata, 's3://'+bucket+'/'+key)
+
+    except Exception as e:
+
+        print(e)
+        raise e
+
+
+def detect_anomalies_in_image(image_body, content_type, metadata, image_url):
+    """
+    Classifies an image that is already in memory and enriches the response
+    with the image metadata.
+    :param metadata: dict with the cameraid, assemblylineid, imageid and optional capturetime of the image
+    """
 
+    try:
         project_name = LFV_PROJECT_NAME
         model_version = LFV_MODEL_VERSION
-        content_type = response['ContentType']
-        image = response['Body']
-        image_body = image.read()
-
-        camera_id = response['Metadata']['cameraid']
-        assembly_line_id = response['Metadata']['assemblylineid']
-        image_id = response['Metadata']['imageid']
 
-        lookout_response = lookoutvision.detect_anomalies(
-            ProjectName=project_name,
-            ModelVersion=model_version,
-            Body=image_body,
-            ContentType=content_type
-        )
+        camera_id = metadata['cameraid']
+        assembly_line_id = metadata['assemblylineid']
+        image_id = metadata['imageid']
+
+        lookout_response = None
+
+        result_cache_key = None
+        if resultCache.is_enabled():
+            result_cache_key = resultCache.cache_key(image_body, project_name, model_version)
+            cached_result, cache_tier = resultCache.get_result(result_cache_key)
+            put_metrics({
+                'ResultCacheHits': 1 if cached_result else 0,
+                'ResultCacheMisses': 0 if cached_result else 1
+            })
+            if cached_result:
+                # Identical image bytes were already scored by this model version
+                lookout_response = {'DetectAnomalyResult': cached_result, 'ResultCacheTier': cache_tier}
+
+        frame_hash = None
+        if lookout_response is None and frameDeduplication.is_enabled():
+            try:
+                frame_hash = frameDeduplication.compute_frame_hash(image_body)
+                reused_result, scored_image_id = frameDeduplication.get_reusable_result(camera_id, frame_hash)
+                if reused_result:
+                    # Near duplicate of the last frame scored for this camera
+                    lookout_response = {'DetectAnomalyResult': reused_result, 'ReusedResultFromImageId': scored_image_id}
+            except Exception as e:
+                print('Frame deduplication failed - scoring the frame: ' + str(e))
+            put_metrics({'DeduplicatedFrames': 0 if lookout_response is None else 1}, {'CameraId': camera_id})
+
+        preprocessing_stats = None
+        if lookout_response is None:
+            if imagePreprocessing.is_enabled():
+                try:
+                    image_body, content_type, preprocessing_stats = imagePreprocessing.preprocess_image(image_body, content_type)
+                except Exception as e:
+                    # Let the model decide what to do with images that cannot be decoded
+                    print('Preprocessing failed - sending the original image: ' + str(e))
+
+            if rateLimiter.is_enabled():
+                throttle_wait = rateLimiter.acquire()
+                put_metrics({'ThrottleWaitTime': round(throttle_wait * 1000, 2)}, unit='Milliseconds')
+
+            try:
+                with stage_timer('Inference', {'CameraId': camera_id, 'AssemblyLineId': assembly_line_id}):
+                    lookout_response = lookoutvision.detect_anomalies(
+                        ProjectName=project_name,
+                        ModelVersion=model_version,
+                        Body=image_body,
+                        ContentType=content_type
+                    )
+            except lookoutvision.exceptions.ThrottlingException as e:
+                put_metrics({'LookoutVisionThrottles': 1})
+                if rateLimiter.is_enabled():
+                    rateLimiter.on_throttled()
+                raise e
+
+            if rateLimiter.is_enabled():
+                rateLimiter.on_success()
+
+            if result_cache_key:
+                resultCache.put_result(result_cache_key, lookout_response['DetectAnomalyResult'])
+            if frame_hash:
+                try:
+                    frameDeduplication.record_scored_frame(camera_id, frame_hash, lookout_response['DetectAnomalyResult'], image_id)
+                except Exception as e:
+                    print('Failed to record scored frame: ' + str(e))
 
         lookout_response['CameraId'] = camera_id
         lookout_response['AssemblyLineId'] = assembly_line_id
         lookout_response['ImageId'] = image_id
-        lookout_response['ImageUrl'] = 's3://'+bucket+'/'+key
-
-        print(json.dumps(lookout_response))
+        lookout_response['ImageUrl'] = image_url
+        lookout_response['ModelVersion'] = model_version
+        if metadata.get('capturetime'):
+            lookout_response['CaptureTime'] = metadata['capturetime']
+        if preprocessing_stats:
+            lookout_response['Preprocessing'] = preprocessing_stats
+
+        log_payload('DetectAnomalies response', lookout_response)
+        if result_cache_key:
+            log_payload('Result cache stats', resultCache.get_stats())
 
         return lookout_response
 
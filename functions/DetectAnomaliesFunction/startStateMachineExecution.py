@@ -15,25 +15,67 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import boto3
+import awsClients
+import hashlib
 import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-client = boto3.client('stepfunctions')
+from metrics import stage_timer
+from s3Events import get_s3_objects
+
+client = awsClients.client('stepfunctions')
 STATE_MACHINE_ARN = os.environ['STATE_MACHINE_ARN']
+MAX_CONCURRENT_EXECUTIONS = int(os.environ.get('MAX_CONCURRENT_EXECUTIONS', '10'))
 
-def lambda_handler(event, context):
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
+def get_execution_name(bucket, key, version):
+    """
+    Derives the execution name from the uploaded object, so that a retried
+    event does not start a second execution for the same upload.
+    """
+    digest = hashlib.sha256('/'.join([bucket, key, version]).encode('utf-8')).hexdigest()[:32]
+    # Names are limited to 80 letters, digits, '-' and '_'
+    return re.sub(r'[^A-Za-z0-9_-]', '_', key)[-47:] + '-' + digest
 
+def start_execution(bucket, key, version):
     input = {
         "Bucket": bucket,
         "Key": key
     }
+    name = get_execution_name(bucket, key, version)
+
+    try:
+        with stage_timer('StartExecution'):
+            response = client.start_execution(
+                stateMachineArn=STATE_MACHINE_ARN,
+                name=name,
+                input = json.dumps(input)
+            )
+    except client.exceptions.ExecutionAlreadyExists:
+        print('Execution already started for ' + key)
+        response = {'executionArn': STATE_MACHINE_ARN.replace(':stateMachine:', ':execution:') + ':' + name}
+    return response
+
+def lambda_handler(event, context):
+    objects = get_s3_objects(event, with_version=True)
+    results = []
+    failures = []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENT_EXECUTIONS, len(objects)))) as executor:
+        futures = [(bucket, key, executor.submit(start_execution, bucket, key, version)) for bucket, key, version in objects]
+        for bucket, key, future in futures:
+            try:
+                response = future.result()
+                results.append({'Bucket': bucket, 'Key': key, 'ExecutionArn': response['executionArn']})
+            except Exception as e:
+                print(e)
+                failures.append({'Bucket': bucket, 'Key': key, 'Error': str(e)})
 
-    response = client.start_execution(
-        stateMachineArn=STATE_MACHINE_ARN,
-        input = json.dumps(input)
-    )
+    print('Started {} executions, {} failed'.format(len(results), len(failures)))
+    if failures:
+        # Fail the invocation so that Lambda retries the event rather than dropping frames -
+        # the executions started now are not started again
+        raise RuntimeError('Failed to start executions for: ' + json.dumps(failures))
 
-    return json.dumps(response, default=str)
+    return json.dumps({'Executions': results}, default=str)
@@ -0,0 +1,237 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+
+# Summary table for the per-minute aggregates - empty disables them
+AGGREGATES_TABLE_NAME = os.environ.get('AGGREGATES_TABLE_NAME', '')
+AGGREGATES_TTL_SECONDS = int(float(os.environ.get('AGGREGATES_TTL_DAYS', '30')) * 86400)
+# Attempts of a transaction that is cancelled by concurrent updates of the same windows
+AGGREGATES_MAX_ATTEMPTS = int(os.environ.get('AGGREGATES_MAX_ATTEMPTS', '4'))
+RETRY_BASE_DELAY_SECONDS = 0.1
+
+# Items of one TransactWriteItems request - the marker of a chunk and its windows
+MAX_TRANSACTION_ITEMS = 100
+# Markers of applied chunks are kept beyond the 24 hours records stay in the stream
+MARKER_DIMENSION = 'APPLIED'
+MARKER_TTL_SECONDS = 2 * 86400
+# Windows whose stored minimum and maximum are known to cover the last batch
+MAX_KNOWN_WINDOWS = 10000
+
+dynamodb = boto3.resource('dynamodb') if AGGREGATES_TABLE_NAME else None
+serializer = TypeSerializer()
+known_extremes = {}
+
+
+def is_enabled():
+    return bool(AGGREGATES_TABLE_NAME)
+
+
+def get_windows(item):
+    """
+    Returns the (dimension, window) keys a transformed result record is counted in.
+    """
+    window = '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}'.format(
+        item['Year'], item['Month'], item['Day'], item['Hour'], item['Minute'])
+    return [('CAMERA#' + item['CameraId'], window), ('LINE#' + item['AssemblyLineId'], window)]
+
+
+def fold_records(transformed_items):
+    """
+    Folds transformed result records into tumbling one minute windows per
+    camera and per assembly line.
+    :return: dict of (dimension, window) to count, anomalies and confidence sum, min and max
+    """
+    aggregates = {}
+    for item in transformed_items:
+        confidence = Decimal(str(item['Confidence']))
+        for dimension, window in get_windows(item):
+            aggregate = aggregates.get((dimension, window))
+            if aggregate is None:
+                aggregate = aggregates[(dimension, window)] = {
+                    'Count': 0, 'Anomalies': 0, 'ConfidenceSum': Decimal(0),
+                    'ConfidenceMin': confidence, 'ConfidenceMax': confidence
+                }
+            aggregate['Count'] += 1
+            aggregate['Anomalies'] += 1 if item['IsAnomalous'] else 0
+            aggregate['ConfidenceSum'] += confidence
+            aggregate['ConfidenceMin'] = min(aggregate['ConfidenceMin'], confidence)
+            aggregate['ConfidenceMax'] = max(aggregate['ConfidenceMax'], confidence)
+    return aggregates
+
+
+def set_if(table, key, attribute, operator, value):
+    """
+    Lowers or raises a stored minimum or maximum. A failed condition means
+    that the stored value already covers this one.
+    """
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET #a = :v',
+            ConditionExpression='#a ' + operator + ' :v',
+            ExpressionAttributeNames={'#a': attribute},
+            ExpressionAttributeValues={':v': value}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def serialize(item):
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def chunk_items(items):
+    """
+    Splits (sequence_number, transformed_item) pairs, in stream order, into
+    chunks whose windows fit in one transaction next to the chunk marker.
+    """
+    chunk = []
+    windows = set()
+    for sequence_number, item in items:
+        item_windows = windows.union(get_windows(item))
+        if chunk and len(item_windows) > MAX_TRANSACTION_ITEMS - 1:
+            yield chunk
+            chunk = []
+            item_windows = set(get_windows(item))
+        chunk.append((sequence_number, item))
+        windows = item_windows
+    if chunk:
+        yield chunk
+
+
+def get_transaction(chunk):
+    """
+    Returns the transaction that adds the aggregates of a chunk to the stored
+    windows and records the chunk in a marker keyed by its first sequence number.
+    """
+    now = int(time.time())
+    marker = {
+        'Dimension': MARKER_DIMENSION,
+        'Window': chunk[0][0],
+        'LastSequenceNumber': chunk[-1][0],
+        'ExpiresAt': now + MARKER_TTL_SECONDS
+    }
+    transaction = [{
+        'Put': {
+            'TableName': AGGREGATES_TABLE_NAME,
+            'Item': serialize(marker),
+            'ConditionExpression': 'attribute_not_exists(#window)',
+            'ExpressionAttributeNames': {'#window': 'Window'}
+        }
+    }]
+    aggregates = fold_records(item for _, item in chunk)
+    for (dimension, window), aggregate in aggregates.items():
+        transaction.append({
+            'Update': {
+                'TableName': AGGREGATES_TABLE_NAME,
+                'Key': serialize({'Dimension': dimension, 'Window': window}),
+                'UpdateExpression': 'ADD #count :count, Anomalies :anomalies, ConfidenceSum :sum '
+                                    'SET ConfidenceMin = if_not_exists(ConfidenceMin, :min), '
+                                    'ConfidenceMax = if_not_exists(ConfidenceMax, :max), ExpiresAt = :expires',
+                'ExpressionAttributeNames': {'#count': 'Count'},
+                'ExpressionAttributeValues': serialize({
+                    ':count': aggregate['Count'],
+                    ':anomalies': aggregate['Anomalies'],
+                    ':sum': aggregate['ConfidenceSum'],
+                    ':min': aggregate['ConfidenceMin'],
+                    ':max': aggregate['ConfidenceMax'],
+                    ':expires': now + AGGREGATES_TTL_SECONDS
+                })
+            }
+        })
+    return transaction, aggregates
+
+
+def apply_chunk(chunk):
+    """
+    Adds the aggregates of a chunk of records to the stored windows in one
+    transaction. Lambda retries a batch from its first failed record, so a
+    chunk that was applied but reported as failed, e.g. after a timeout, comes
+    back with the same first record - its marker then holds the last record
+    already counted, and only the records after it are applied.
+    :return: the aggregates that were applied
+    """
+    client = dynamodb.meta.client
+    attempt = 0
+    while True:
+        transaction, aggregates = get_transaction(chunk)
+        try:
+            client.transact_write_items(TransactItems=transaction)
+            return aggregates
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if not reasons or reasons[0].get('Code') != 'ConditionalCheckFailed':
+                attempt += 1
+                if attempt >= AGGREGATES_MAX_ATTEMPTS:
+                    raise e
+                time.sleep(RETRY_BASE_DELAY_SECONDS * (2 ** (attempt - 1)))
+                continue
+
+        marker = dynamodb.Table(AGGREGATES_TABLE_NAME).get_item(
+            Key={'Dimension': MARKER_DIMENSION, 'Window': chunk[0][0]}, ConsistentRead=True)['Item']
+        applied = int(marker['LastSequenceNumber'])
+        chunk = [(sequence_number, item) for sequence_number, item in chunk if int(sequence_number) > applied]
+        print('Records up to {} were already aggregated'.format(applied))
+        if not chunk:
+            return {}
+
+
+def update_extremes(aggregates):
+    """
+    Lowers or raises the stored minimum and maximum of the windows of a chunk.
+    The transaction only sets them on new windows, and the conditional updates
+    are skipped for windows known to already cover the chunk.
+    """
+    table = dynamodb.Table(AGGREGATES_TABLE_NAME)
+    if len(known_extremes) > MAX_KNOWN_WINDOWS:
+        known_extremes.clear()
+    for (dimension, window), aggregate in aggregates.items():
+        key = {'Dimension': dimension, 'Window': window}
+        known = known_extremes.get((dimension, window))
+        try:
+            if known is None or known[0] > aggregate['ConfidenceMin']:
+                set_if(table, key, 'ConfidenceMin', '>', aggregate['ConfidenceMin'])
+            if known is None or known[1] < aggregate['ConfidenceMax']:
+                set_if(table, key, 'ConfidenceMax', '<', aggregate['ConfidenceMax'])
+        except Exception as e:
+            print('Failed to update the confidence range of {} {} - {}'.format(dimension, window, e))
+            continue
+        known_extremes[(dimension, window)] = (
+            min(known[0], aggregate['ConfidenceMin']) if known else aggregate['ConfidenceMin'],
+            max(known[1], aggregate['ConfidenceMax']) if known else aggregate['ConfidenceMax'])
+
+
+def apply_aggregates(items):
+    """
+    Applies the aggregates of a batch to the summary table, chunk by chunk in
+    stream order, and stops at the first chunk that cannot be applied.
+    :param items: list of (sequence_number, transformed_item) pairs in stream order
+    :return: the sequence number of the first record that was not aggregated, or None
+    """
+    for chunk in chunk_items(items):
+        try:
+            aggregates = apply_chunk(chunk)
+        except Exception as e:
+            print('Failed to update the aggregates from record {} - {}'.format(chunk[0][0], e))
+            return chunk[0][0]
+        update_extremes(aggregates)
+    return None
@@ -14,49 +14,153 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import os, json, base64, boto3, datetime
+import os, json, base64, boto3, datetime, time
+
+import aggregates
+from metrics import stage_timer
 
 firehose = boto3.client('firehose')
 
+# PutRecordBatch service limits
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+# Retries for records reported in FailedPutCount
+MAX_PUT_ATTEMPTS = int(os.environ.get('FIREHOSE_MAX_PUT_ATTEMPTS', '4'))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get('FIREHOSE_RETRY_BASE_DELAY_SECONDS', '0.1'))
+# Json or Parquet - the format the delivery stream writes to S3
+RESULTS_OUTPUT_FORMAT = os.environ.get('RESULTS_OUTPUT_FORMAT', 'Json')
+
 print('Loading function')
 
-def put_record_in_firehose(stream_record):
-    new_image_item = stream_record['NewImage']
+def get_camera_id(partition_key):
+    """
+    Strips the write shard suffix (CameraId#<n>) from a partition key.
+    """
+    camera_id, separator, shard = partition_key.rpartition('#')
+    if separator and shard.isdigit():
+        return camera_id
+    return partition_key
+
+def is_backfill(record):
+    """
+    Rows written by scripts/backfillImages.py re-score images that were already
+    delivered, so they are not delivered or counted again.
+    """
+    return record['dynamodb']['NewImage'].get('Backfill', {}).get('BOOL', False)
+
+def transform_item(record):
+    new_image_item = record['dynamodb']['NewImage']
     transformed_item = {}
     # Transform the record a bit
     try:
-        date_time_str = new_image_item['DateTime']['S']
-        print(date_time_str)
+        # The sort key is <capture time>#<image id>
+        date_time_str = new_image_item['DateTime']['S'].split('#')[0]
         date_time_obj = datetime.datetime.strptime(date_time_str, '%Y-%m-%dT%H:%M:%S.%f')
 
         transformed_item['AssemblyLineId'] = new_image_item['AssemblyLineId']['S']
-        transformed_item['CameraId'] = new_image_item['CameraId']['S']
+        transformed_item['CameraId'] = get_camera_id(new_image_item['CameraId']['S'])
         transformed_item['ImageId'] = new_image_item['ImageId']['S']
         transformed_item['ImageUrl'] = new_image_item['ImageUrl']['S']
-        transformed_item['DateTime'] = new_image_item['DateTime']['S']
+        transformed_item['DateTime'] = date_time_str
         transformed_item['IsAnomalous'] = new_image_item['IsAnomalous']['BOOL']
+        # Parquet output types it as a double - Json output keeps the string existing readers expect
         transformed_item['Confidence'] = new_image_item['Confidence']['N']
+        if RESULTS_OUTPUT_FORMAT == 'Parquet':
+            transformed_item['Confidence'] = float(transformed_item['Confidence'])
         transformed_item['Year'] = date_time_obj.year
         transformed_item['Month'] = date_time_obj.month
         transformed_item['Day'] = date_time_obj.day
         transformed_item['Hour'] = date_time_obj.hour
         transformed_item['Minute'] = date_time_obj.minute
-        transformed_item['Region'] = stream_record['awsRegion']
+        transformed_item['Region'] = record['awsRegion']
     except Exception as e:
         print(e)
-    
+
+    return transformed_item
+
+def encode_record(transformed_item):
     j_to_firehose = json.dumps(transformed_item)
-    response = firehose.put_record(
-    DeliveryStreamName=os.environ['DeliveryStreamName'],
-    Record= {
-                'Data': j_to_firehose + '\n'
-            }
-        )
-    print(response)
+    return (j_to_firehose + '\n').encode('utf-8')
+
+def chunk_records(records):
+    """
+    Splits (sequence_number, data) pairs into batches that fit within the
+    PutRecordBatch record count and payload size limits.
+    """
+    batch = []
+    batch_bytes = 0
+    for record in records:
+        record_bytes = len(record[1])
+        if batch and (len(batch) == MAX_BATCH_RECORDS or batch_bytes + record_bytes > MAX_BATCH_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(record)
+        batch_bytes += record_bytes
+    if batch:
+        yield batch
+
+def put_records_in_firehose(records):
+    """
+    Delivers records to Kinesis Firehose with put_record_batch. Records that
+    come back as failed are retried with exponential backoff.
+    :param records: list of (sequence_number, data) pairs
+    :return: sequence numbers of the records that could not be delivered
+    """
+    failed_sequence_numbers = []
+    for batch in chunk_records(records):
+        pending = batch
+        for attempt in range(MAX_PUT_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(RETRY_BASE_DELAY_SECONDS * (2 ** (attempt - 1)))
+            try:
+                with stage_timer('FirehosePut'):
+                    response = firehose.put_record_batch(
+                        DeliveryStreamName=os.environ['DeliveryStreamName'],
+                        Records=[{'Data': data} for _, data in pending]
+                    )
+            except Exception as e:
+                print(e)
+                continue
+
+            if response['FailedPutCount'] == 0:
+                pending = []
+                break
+            pending = [record for record, result in zip(pending, response['RequestResponses']) if 'ErrorCode' in result]
+            print('{} of {} records failed on attempt {}'.format(len(pending), len(batch), attempt + 1))
+
+        failed_sequence_numbers.extend(sequence_number for sequence_number, _ in pending)
+    return failed_sequence_numbers
+
+def get_aggregated_items(items, failed_sequence_numbers):
+    """
+    Returns the transformed items that can be folded into the aggregates.
+    Lambda retries the batch from the lowest reported failure onwards, so only
+    records below it are counted - the rest are counted when they are retried.
+    :param items: list of (sequence_number, transformed_item) pairs
+    """
+    lowest_failure = min((int(sequence_number) for sequence_number in failed_sequence_numbers), default=None)
+    return [(sequence_number, item) for sequence_number, item in items
+            if 'Minute' in item and (lowest_failure is None or int(sequence_number) < lowest_failure)]
 
 def lambda_handler(event, context):
+    items = []
     for record in event['Records']:
-        if (record['eventName']) == 'INSERT':
-            put_record_in_firehose(record['dynamodb'])
-    return 'Successfully processed {} records.'.format(len(event['Records']))
+        if (record['eventName']) == 'INSERT' and not is_backfill(record):
+            items.append((record['dynamodb']['SequenceNumber'], transform_item(record)))
+
+    records = [(sequence_number, encode_record(item)) for sequence_number, item in items]
+    failed_sequence_numbers = put_records_in_firehose(records)
+    print('Successfully processed {} records, {} failed.'.format(
+        len(event['Records']) - len(failed_sequence_numbers), len(failed_sequence_numbers)))
+
+    if aggregates.is_enabled():
+        failed_aggregate = aggregates.apply_aggregates(get_aggregated_items(items, failed_sequence_numbers))
+        if failed_aggregate is not None:
+            # Retried with the records after it, none of which were aggregated
+            failed_sequence_numbers.append(failed_aggregate)
 
+    # Lambda retries the batch from the lowest reported failure, without replaying the records before it
+    return {
+        'batchItemFailures': [{'itemIdentifier': sequence_number} for sequence_number in failed_sequence_numbers]
+    }
@@ -0,0 +1,81 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'LookoutVisionServerlessApp')
+# Fraction of payloads written to the logs by log_payload - 0 disables payload logging
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', '0'))
+
+
+def put_metrics(metrics, dimensions=None, unit='Count', aggregate=False):
+    """
+    Emits metrics in CloudWatch Embedded Metric Format. The log line is
+    turned into metrics by CloudWatch Logs, so no API call is made.
+    :param metrics: dict of metric name to value
+    :param dimensions: optional dict of dimension name to value
+    :param aggregate: also emit the metrics without dimensions
+    """
+    dimensions = dimensions or {}
+    dimension_sets = [list(dimensions.keys())]
+    if aggregate and dimensions:
+        dimension_sets.append([])
+    log_entry = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': dimension_sets,
+                'Metrics': [{'Name': name, 'Unit': unit} for name in metrics]
+            }]
+        }
+    }
+    log_entry.update(dimensions)
+    log_entry.update(metrics)
+    print(json.dumps(log_entry))
+
+
+@contextmanager
+def stage_timer(stage, dimensions=None):
+    """
+    Times the enclosed block and emits it as the <stage>Latency metric, per
+    dimension value and across all of them. Dimensions that are only known
+    inside the block can be added to the yielded dict.
+
+        with stage_timer('S3GetObject') as dimensions:
+            response = s3.get_object(Bucket=bucket, Key=key)
+            dimensions['CameraId'] = response['Metadata']['cameraid']
+    """
+    stage_dimensions = dict(dimensions or {})
+    start = time.time()
+    try:
+        yield stage_dimensions
+    finally:
+        put_metrics({stage + 'Latency': round((time.time() - start) * 1000, 2)},
+                    stage_dimensions, unit='Milliseconds', aggregate=True)
+
+
+def log_payload(label, payload):
+    """
+    Writes a payload to the logs for a sample of the calls only.
+    """
+    if PAYLOAD_LOG_SAMPLE_RATE > 0 and random.random() < PAYLOAD_LOG_SAMPLE_RATE:
+        print(label + ': ' + json.dumps(payload, default=lambda value: str(value) if isinstance(value, Decimal) else repr(value)))
@@ -23,6 +23,10 @@ const AWS = require('aws-sdk')
 AWS.config.update({ region: process.env.AWS_REGION || 'eu-west-1' })
 const s3 = new AWS.S3()
 
+const ALLOWED_CONTENT_TYPES = ['image/jpeg', 'image/png', 'application/x-tar']
+// Capture times are parsed by the Python functions with datetime.fromisoformat
+const CAPTURE_TIME_PATTERN = /^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d{3}|\.\d{6})?)?(Z|[+-]\d{2}:\d{2})?)?$/
+
 // Main Lambda entry point
 exports.handler = async (event) => {
   const result = await getUploadURL(event)
@@ -35,6 +39,7 @@ const getUploadURL = async function(event) {
   let cameraid = "cameraid";
   let assemblylineid = 'assemblylineid';
   let imageid = 'imageid';
+  let contenttype = 'image/jpeg';
   const imageFileName = `IMG${randomId}.jpeg`
   
   // if (event.headers && event.headers["cameraid"]) {
@@ -67,10 +72,37 @@ const getUploadURL = async function(event) {
     imageid = event.queryStringParameters.imageid;
   }
 
+  // Optional ISO 8601 time at which the camera captured the image
+  let capturetime = null;
+  if (event.queryStringParameters && event.queryStringParameters.capturetime) {
+    console.log("Received capturetime: " + event.queryStringParameters.capturetime);
+    capturetime = event.queryStringParameters.capturetime;
+    if (!CAPTURE_TIME_PATTERN.test(capturetime) || isNaN(Date.parse(capturetime))) {
+      return {
+        "statusCode": 400,
+        "isBase64Encoded": false,
+        "headers": {
+          "Access-Control-Allow-Origin": "*"
+        },
+        "body": JSON.stringify({
+          "message": "capturetime must be an ISO 8601 date and time, e.g. 2021-06-01T10:00:00.000Z"
+        })
+      }
+    }
+  }
+
+  // Multi-frame tar archives are uploaded with their own content type
+  if (event.queryStringParameters && event.queryStringParameters.contenttype) {
+    console.log("Received contenttype: " + event.queryStringParameters.contenttype);
+    if (ALLOWED_CONTENT_TYPES.includes(event.queryStringParameters.contenttype)) {
+      contenttype = event.queryStringParameters.contenttype;
+    }
+  }
+
   const s3Params = {
     Bucket: process.env.UploadBucket,
     Key:  imageid, //imageFileName,
-    ContentType: 'image/jpeg', // U,pdate to match whichever content type you need to upload
+    ContentType: contenttype, // U,pdate to match whichever content type you need to upload
     //ACL: 'public-read'     // Enable this setting to make the object publicly readable - only works if the bucket can support public objects
     Metadata: {
       cameraid: cameraid,
@@ -80,6 +112,10 @@ const getUploadURL = async function(event) {
   
   }
 
+  if (capturetime) {
+    s3Params.Metadata.capturetime = capturetime
+  }
+
   console.log('getUploadURL: ', s3Params)
   return new Promise((resolve, reject) => {
     // Get signed URL
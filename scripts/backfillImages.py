@@ -0,0 +1,388 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#!/usr/bin/python
+
+import argparse
+import collections
+import json
+import os
+import queue
+import random
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'functions', 'DetectAnomaliesFunction'),
+    os.path.join(ROOT, 'functions', 'InstrumentationLayer', 'python')
+]
+
+# Re-scores the images of the source bucket with a new model version and writes the results to the
+# results table. Backfilled rows are tagged with the model version and Backfill, and keyed apart from
+# the rows of the live pipeline - no alerts are sent and DynamoDbToFirehose does not deliver them.
+# Runs with the AWS credentials of the environment, which need s3:ListBucket and s3:GetObject on the
+# bucket, lookoutvision:DetectAnomalies and dynamodb:BatchWriteItem on the table.
+# Execute as - script.py BUCKET PROJECT_NAME MODEL_VERSION TABLE_NAME [--prefix PREFIX] [--workers N] [--max-tps TPS] [--checkpoint FILE]
+# For Example:
+# python backfillImages.py lookoutvision-source-images circuitboard 2 lookoutvision-defects-results --workers 32 --max-tps 20 --checkpoint backfill-v2.json
+# Only some cameras -> python backfillImages.py lookoutvision-source-images circuitboard 2 lookoutvision-defects-results --prefix CAM1 --prefix CAM2 --checkpoint backfill-v2.json
+# Retry the images that failed -> python backfillImages.py lookoutvision-source-images circuitboard 2 lookoutvision-defects-results --keys-file backfill-v2.json.failed
+
+# Each prefix is listed as ranges split at these characters, which are listed in parallel
+SHARD_CHARACTERS = string.digits + string.ascii_uppercase + string.ascii_lowercase
+IMAGE_SUFFIXES = ['.jpeg', '.jpg', '.png']
+RETRY_BASE_DELAY_SECONDS = 0.5
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Lookout For Vision - Serverless App - Backfill')
+    parser.add_argument('bucket', help='Source images bucket')
+    parser.add_argument('project_name', help='Lookout for Vision project')
+    parser.add_argument('model_version', help='Model version to score the images with')
+    parser.add_argument('table_name', help='Results table')
+    parser.add_argument('--prefix', action='append', help='Key prefix to backfill, may be repeated (default: the whole bucket)')
+    parser.add_argument('--keys-file', help='File with one key per line to backfill instead of listing the bucket')
+    parser.add_argument('--suffix', action='append', help='Image key suffix, may be repeated (default: .jpeg, .jpg and .png)')
+    parser.add_argument('--workers', type=int, default=16, help='Images scored concurrently (default: 16)')
+    parser.add_argument('--list-workers', type=int, default=8, help='Key ranges listed concurrently (default: 8)')
+    parser.add_argument('--max-tps', type=float, default=10, help='Maximum DetectAnomalies requests per second, 0 for no limit (default: 10)')
+    parser.add_argument('--max-attempts', type=int, default=6, help='Attempts to score an image before it is recorded as failed (default: 6)')
+    parser.add_argument('--checkpoint', help='File recording progress so that an interrupted backfill resumes where it stopped')
+    parser.add_argument('--checkpoint-interval', type=float, default=10, help='Seconds between checkpoints and progress reports (default: 10)')
+    parser.add_argument('--region', default=os.environ.get('AWS_REGION', os.environ.get('AWS_DEFAULT_REGION', 'eu-west-1')), help='AWS region')
+    parser.add_argument('--log', default=os.devnull, help='File for the log output of the detection code (default: discarded)')
+    return parser.parse_args(args)
+
+
+def get_shards(prefixes):
+    """
+    Splits every prefix into key ranges (After, Until] at SHARD_CHARACTERS. The first
+    range has no lower bound and the last no upper bound, so every key is covered.
+    """
+    shards = []
+    for prefix in prefixes:
+        bounds = [None] + [prefix + character for character in SHARD_CHARACTERS] + [None]
+        for after, until in zip(bounds, bounds[1:]):
+            shards.append({'Id': '{}|{}'.format(prefix, after or ''), 'Prefix': prefix, 'After': after, 'Until': until})
+    return shards
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ShardProgress(object):
+    """
+    Tracks the keys of a range in listing order. The watermark is the last key
+    below which every key has been scored and written - a resumed backfill lists
+    the range again after it.
+    """
+
+    def __init__(self, watermark=None):
+        self.watermark = watermark
+        self.pending = collections.deque()
+        self.completed = set()
+        self.listed = False
+
+    def add(self, key):
+        self.pending.append(key)
+
+    def complete(self, key):
+        self.completed.add(key)
+        while self.pending and self.pending[0] in self.completed:
+            self.watermark = self.pending.popleft()
+            self.completed.discard(self.watermark)
+
+    def is_done(self):
+        return self.listed and not self.pending
+
+
+class Checkpoint(object):
+
+    def __init__(self, path, bucket, model_version):
+        self.path = path
+        self.state = {'Bucket': bucket, 'ModelVersion': model_version, 'Shards': {}}
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            if (state['Bucket'], state['ModelVersion']) != (bucket, model_version):
+                raise Exception('Checkpoint {} belongs to the backfill of {} with model version {}'.format(
+                    path, state['Bucket'], state['ModelVersion']))
+            self.state = state
+
+    def get_shard(self, shard_id):
+        return self.state['Shards'].get(shard_id, {})
+
+    def save(self, progress):
+        if not self.path:
+            return
+        for shard_id, shard_progress in progress.items():
+            self.state['Shards'][shard_id] = {'Watermark': shard_progress.watermark, 'Done': shard_progress.is_done()}
+        # Replaced atomically, so that an interruption never leaves a partial checkpoint
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file, indent=2, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def build_backfill_item(detect_response, model_version):
+    """
+    The row of a re-scored image. The model version is appended to the sort key, so that
+    the row does not overwrite the live result and a resumed backfill overwrites its own row.
+    """
+    from imageDetails import build_image_details
+
+    item = build_image_details(detect_response)
+    item['DateTime'] = item['DateTime'] + '#' + model_version
+    item['ModelVersion'] = model_version
+    item['Backfill'] = True
+    return item
+
+
+def main():
+    print('########### Lookout For Vision - Serverless App - Backfill ############\n')
+    console = sys.stdout
+
+    try:
+        args = parse_args(sys.argv[1:])
+        workers = max(1, args.workers)
+        suffixes = tuple(args.suffix or IMAGE_SUFFIXES)
+
+        # The detection code reads its configuration from the environment when it is imported
+        os.environ.update({
+            'LFV_PROJECT_NAME': args.project_name,
+            'LFV_MODEL_VERSION': args.model_version,
+            'DYNAMODB_TABLE_NAME': args.table_name,
+            'REGION': args.region,
+            'AWS_DEFAULT_REGION': args.region,
+            # Frames are scored out of order, which deduplication against the last frame of a camera assumes they are not
+            'FRAME_DEDUP_TABLE_NAME': ''
+        })
+        os.environ.setdefault('AWS_CLIENT_MAX_POOL_CONNECTIONS', str(workers + args.list_workers))
+
+        # The detection code logs every image to stdout - progress is reported on the console instead
+        log_file = open(args.log, 'a')
+        sys.stdout = log_file
+        import awsClients
+        from resultWriter import ResultWriter
+        from startDetectAnomalies import detect_anomalies
+
+        print('Bucket: ' + args.bucket, file=console)
+        print('Project: {} - model version {}'.format(args.project_name, args.model_version), file=console)
+        print('Results table: ' + args.table_name, file=console)
+        print('Workers: {} - at most {} images/s'.format(workers, args.max_tps or 'unlimited'), file=console)
+
+        checkpoint = Checkpoint(args.checkpoint, args.bucket, args.model_version)
+        if args.keys_file:
+            with open(args.keys_file) as keys_file:
+                keys = sorted(set(line.strip() for line in keys_file if line.strip()))
+            shards = [{'Id': 'keys-file', 'Keys': keys}]
+        else:
+            shards = get_shards(args.prefix or [''])
+        progress = {shard['Id']: ShardProgress(checkpoint.get_shard(shard['Id']).get('Watermark')) for shard in shards}
+        shards = [shard for shard in shards if not checkpoint.get_shard(shard['Id']).get('Done')]
+        if args.checkpoint and os.path.exists(args.checkpoint):
+            print('Resuming from {} - {} key ranges left'.format(args.checkpoint, len(shards)), file=console)
+        print('\nStarting backfill....', file=console)
+
+        s3 = awsClients.get('client', 's3')
+        writer = ResultWriter(args.table_name, buffer_size=sys.maxsize)
+        rate_limiter = TokenBucket(args.max_tps)
+        work = queue.Queue(maxsize=workers * 4)
+        lock = threading.Lock()
+        # Set when listing fails or is interrupted, so that the other ranges stop being listed
+        stopping = threading.Event()
+        # Keys scored since the last checkpoint - they are done once the writer has been flushed
+        scored = []
+        failed_keys = []
+        stats = {'listed': 0, 'scored': 0, 'anomalous': 0, 'failed': 0, 'write_failures': 0}
+
+        def list_shard(shard):
+            shard_progress = progress[shard['Id']]
+            if 'Keys' in shard:
+                pages = [[key for key in shard['Keys'] if shard_progress.watermark is None or key > shard_progress.watermark]]
+            else:
+                pages = list_keys(shard, shard_progress.watermark)
+            for keys in pages:
+                for key in keys:
+                    if stopping.is_set():
+                        return
+                    with lock:
+                        shard_progress.add(key)
+                        stats['listed'] += 1
+                    if key.endswith(suffixes):
+                        work.put((shard['Id'], key))
+                    else:
+                        with lock:
+                            scored.append((shard['Id'], key))
+            with lock:
+                shard_progress.listed = True
+
+        def list_keys(shard, watermark):
+            """
+            Yields the keys of a range page by page, stopping after its upper bound.
+            """
+            params = {'Bucket': args.bucket, 'Prefix': shard['Prefix']}
+            start_after = max(watermark or '', shard['After'] or '')
+            if start_after:
+                params['StartAfter'] = start_after
+            for page in s3.get_paginator('list_objects_v2').paginate(**params):
+                keys = [item['Key'] for item in page.get('Contents', [])]
+                if shard['Until'] is not None and keys and keys[-1] > shard['Until']:
+                    yield [key for key in keys if key <= shard['Until']]
+                    return
+                yield keys
+
+        def score_key(key):
+            """
+            Scores an image, retrying failures such as throttles with exponential backoff
+            and full jitter. Retries are rate limited too.
+            """
+            attempt = 0
+            while True:
+                rate_limiter.acquire()
+                try:
+                    return detect_anomalies(args.bucket, key)
+                except Exception:
+                    attempt += 1
+                    if attempt >= args.max_attempts:
+                        raise
+                    time.sleep(random.uniform(0, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+        def score_keys():
+            while True:
+                entry = work.get()
+                if entry is None:
+                    return
+                shard_id, key = entry
+                try:
+                    detect_response = score_key(key)
+                    item = build_backfill_item(detect_response, args.model_version)
+                    writer.add(item)
+                    with lock:
+                        stats['scored'] += 1
+                        stats['anomalous'] += item['IsAnomalous']
+                except Exception as e:
+                    print('Failed to score {} - {}'.format(key, e))
+                    with lock:
+                        stats['failed'] += 1
+                        failed_keys.append(key)
+                with lock:
+                    scored.append((shard_id, key))
+
+        def save_checkpoint():
+            with lock:
+                batch = list(scored)
+                del scored[:]
+            # Every key of the batch was added to the writer before it was recorded as scored
+            failed_items = writer.flush()
+            with lock:
+                for item in failed_items[stats['write_failures']:]:
+                    failed_keys.append(item['ImageUrl'].split('/', 3)[3])
+                    stats['failed'] += 1
+                stats['write_failures'] = len(failed_items)
+                for shard_id, key in batch:
+                    progress[shard_id].complete(key)
+                if args.checkpoint and failed_keys:
+                    with open(args.checkpoint + '.failed', 'a') as failed_file:
+                        failed_file.write(''.join(key + '\n' for key in failed_keys))
+                    del failed_keys[:]
+                checkpoint.save(progress)
+
+        run_start = time.time()
+        last = {'scored': 0, 'elapsed': 0}
+
+        def report():
+            elapsed = time.time() - run_start
+            rate = (stats['scored'] - last['scored']) / (elapsed - last['elapsed']) if elapsed > last['elapsed'] else 0
+            print('{:.0f}s - {} listed - {} scored ({} anomalous) - {} failed - {:.1f} images/s now - {:.1f} images/s sustained'.format(
+                elapsed, stats['listed'], stats['scored'], stats['anomalous'], stats['failed'], rate,
+                stats['scored'] / elapsed if elapsed else 0), file=console)
+            last.update(scored=stats['scored'], elapsed=elapsed)
+
+        def checkpoint_until(is_finished):
+            while not is_finished():
+                time.sleep(min(1, args.checkpoint_interval))
+                if time.time() - run_start - last['elapsed'] >= args.checkpoint_interval:
+                    save_checkpoint()
+                    report()
+
+        # Daemon threads, so that an error or Ctrl+C never leaves the process waiting on them
+        scorers = [threading.Thread(target=score_keys, daemon=True) for _ in range(workers)]
+        for scorer in scorers:
+            scorer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, args.list_workers)) as list_executor:
+                listing = [list_executor.submit(list_shard, shard) for shard in shards]
+                try:
+                    checkpoint_until(lambda: all(future.done() for future in listing))
+                    for future in listing:
+                        future.result()
+                except BaseException:
+                    stopping.set()
+                    raise
+        finally:
+            for _ in scorers:
+                work.put(None)
+        checkpoint_until(lambda: not any(scorer.is_alive() for scorer in scorers))
+        save_checkpoint()
+        report()
+        elapsed = time.time() - run_start
+
+        print('\nBackfill completed', file=console)
+        print('{} images scored with model version {}, {} anomalous'.format(stats['scored'], args.model_version, stats['anomalous']), file=console)
+        if args.checkpoint:
+            print('{} images failed'.format(stats['failed']) + (' - listed in ' + args.checkpoint + '.failed' if stats['failed'] else ''), file=console)
+        else:
+            print('{} images failed'.format(stats['failed']) + ''.join('\n' + key for key in failed_keys), file=console)
+        print('Elapsed: {:.2f}s - {:.2f} images/s sustained'.format(elapsed, stats['scored'] / elapsed if elapsed else 0), file=console)
+        sys.stdout = console
+        log_file.close()
+
+    except KeyboardInterrupt:
+        sys.stdout = console
+        print('\nBackfill interrupted - images scored since the last checkpoint are scored again when resuming')
+        sys.exit(130)
+    except Exception as e:
+        sys.stdout = console
+        print(e)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#!/usr/bin/python
+
+import argparse
+import datetime
+import heapq
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from uploadImages import DEFAULT_IMAGE_EXTENSION, IMAGE_EXTENSIONS, create_session, get_content_type, get_signed_url, \
+    list_images, percentile, upload_file
+
+# Simulates many cameras uploading frames from a corpus at once, each on its own schedule.
+# Execute as - script.py CORPUS_DIRECTORY API_ENDPOINT AUTH_TOKEN [--profile FILE] [--cameras N] [--assembly-lines N] [--fps F] [--duration S] [--concurrency N]
+# For Example:
+# 20 cameras on 4 lines at 2 FPS for 5 minutes -> python loadGenerator.py ../resources/circuitboard/extra_images https://XYZ.amazonaws.com/Prod/getsignedurl allow --cameras 20 --assembly-lines 4 --fps 2 --duration 300
+# Ramp up over a minute, with a 5 second burst at 10 FPS every 30 seconds -> python loadGenerator.py ../resources/circuitboard/extra_images https://XYZ.amazonaws.com/Prod/getsignedurl allow --cameras 20 --fps 2 --ramp 0:0.1,60:1 --burst 30:5:10
+# Replay the corpus at the pace it was captured (file modification times) -> python loadGenerator.py ../resources/circuitboard/extra_images https://XYZ.amazonaws.com/Prod/getsignedurl allow --replay --speed 2
+# Per-camera settings -> python loadGenerator.py ../resources/circuitboard/extra_images https://XYZ.amazonaws.com/Prod/getsignedurl allow --profile plant.json
+#
+# Profile example - every camera entry is repeated 'copies' times, with the copy number appended to its id:
+# {"duration": 300, "cameras": [
+#     {"cameraid": "CAM", "assemblylineid": "ASM1", "copies": 8, "fps": 2, "ramp": [[0, 0.1], [60, 1]]},
+#     {"cameraid": "INSPECT", "assemblylineid": "ASM2", "fps": 0.5, "burst": {"interval": 30, "duration": 5, "fps": 10, "offset": 10}},
+#     {"cameraid": "REPLAY", "assemblylineid": "ASM3", "replay": true, "speed": 2}]}
+
+# Upper bounds of the latency histogram buckets in milliseconds
+HISTOGRAM_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# Resolution of the upload schedules
+RATE_STEP_SECONDS = 0.01
+# Requests starting later than this after their scheduled time are counted as late
+LATE_THRESHOLD_SECONDS = 0.1
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Lookout For Vision - Serverless App - Load Generator')
+    parser.add_argument('corpus', help='Directory containing the frames to upload')
+    parser.add_argument('api_endpoint', help='API endpoint URL for getting signed URLs')
+    parser.add_argument('auth_token', help='Authorization token')
+    parser.add_argument('--profile', help='JSON file with the settings of every camera - overrides the camera options below')
+    parser.add_argument('--cameras', type=int, default=1, help='Number of cameras to simulate (default: 1)')
+    parser.add_argument('--assembly-lines', type=int, default=1, help='Number of assembly lines the cameras are spread over (default: 1)')
+    parser.add_argument('--fps', type=float, default=1, help='Frames per second per camera (default: 1)')
+    parser.add_argument('--ramp', help='Rate multiplier schedule as SECONDS:MULTIPLIER pairs, linearly interpolated, e.g. 0:0.1,60:1,240:1,300:0')
+    parser.add_argument('--burst', help='Bursts as INTERVAL:DURATION:FPS - every INTERVAL seconds, upload at FPS for DURATION seconds')
+    parser.add_argument('--replay', action='store_true', help='Upload the corpus at the pace of its file modification times instead of --fps')
+    parser.add_argument('--speed', type=float, default=1, help='Replay speed multiplier (default: 1)')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to generate load for (default: 60)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum concurrent requests (default: 16)')
+    parser.add_argument('--extension', choices=IMAGE_EXTENSIONS, default=DEFAULT_IMAGE_EXTENSION,
+                        help='ImageFileExtension of the stack - only frames with this extension are uploaded (default: jpeg)')
+    parser.add_argument('--save', help='File to write the summary to as JSON')
+    return parser.parse_args(args)
+
+
+def parse_ramp(ramp):
+    return [[float(value) for value in point.split(':')] for point in ramp.split(',')] if ramp else None
+
+
+def parse_burst(burst):
+    if not burst:
+        return None
+    interval, duration, fps = [float(value) for value in burst.split(':')]
+    return {'interval': interval, 'duration': duration, 'fps': fps}
+
+
+def load_cameras(args):
+    """
+    Returns the settings of every simulated camera, from the profile or the command line.
+    """
+    if args.profile:
+        with open(args.profile) as profile_file:
+            profile = json.load(profile_file)
+        args.duration = profile.get('duration', args.duration)
+        cameras = []
+        for camera in profile['cameras']:
+            copies = camera.get('copies', 1)
+            for copy in range(copies):
+                settings = dict(camera)
+                if copies > 1:
+                    settings['cameraid'] = camera['cameraid'] + str(copy + 1)
+                cameras.append(settings)
+        return cameras
+
+    return [{
+        'cameraid': 'CAM{}'.format(camera + 1),
+        'assemblylineid': 'ASM{}'.format(camera % max(1, args.assembly_lines) + 1),
+        'fps': args.fps,
+        'ramp': parse_ramp(args.ramp),
+        'burst': parse_burst(args.burst),
+        'replay': args.replay,
+        'speed': args.speed
+    } for camera in range(args.cameras)]
+
+
+def get_ramp_multiplier(ramp, elapsed):
+    if not ramp:
+        return 1
+    if elapsed <= ramp[0][0]:
+        return ramp[0][1]
+    for (start, start_value), (end, end_value) in zip(ramp, ramp[1:]):
+        if elapsed <= end:
+            return start_value + (end_value - start_value) * (elapsed - start) / (end - start)
+    return ramp[-1][1]
+
+
+def get_rate(camera, elapsed):
+    """
+    Frames per second a camera uploads at the given number of seconds into the run.
+    """
+    burst = camera.get('burst')
+    if burst and (elapsed - burst.get('offset', 0)) % burst['interval'] < burst['duration'] and elapsed >= burst.get('offset', 0):
+        return burst['fps']
+    return camera.get('fps', 1) * get_ramp_multiplier(camera.get('ramp'), elapsed)
+
+
+class CameraSchedule(object):
+    """
+    Yields the times at which a camera uploads its frames. The times are measured from the
+    start of the run rather than from the end of the previous upload, so that the
+    target rate holds when latency fluctuates - late requests are sent as soon as possible.
+    """
+
+    def __init__(self, camera, frames, offset, duration):
+        self.camera = camera
+        self.duration = duration
+        self.frames = frames
+        self.index = offset % len(frames)
+        self.sequence = 0
+        self.elapsed = 0
+        self.credit = 0
+        self.gaps = None
+        if camera.get('replay'):
+            # Gaps between the modification times of consecutive frames, the last one wrapping around
+            self.frames = sorted(frames, key=lambda frame: frame.stat().st_mtime)
+            times = [frame.stat().st_mtime for frame in self.frames]
+            gaps = [max(0, later - earlier) / camera.get('speed', 1) for earlier, later in zip(times, times[1:] + times[:1])]
+            gaps[-1] = min(gaps[:-1] or [0])
+            # A corpus written all at once has no pace to replay - fall back to the frame rate
+            if sum(gaps) > 0:
+                self.gaps = gaps
+            else:
+                print('No capture pace in the corpus for {} - uploading at {} FPS'.format(camera['cameraid'], camera.get('fps', 1)))
+
+    def next_frame(self):
+        """
+        Returns the seconds into the run at which the next frame is due, and the frame.
+        """
+        if self.gaps:
+            due = self.elapsed
+            self.elapsed += self.gaps[self.index]
+        else:
+            # Integrates the rate, so that ramps and bursts shorter than a frame interval are followed
+            while self.credit < 1:
+                if self.elapsed >= self.duration:
+                    return float('inf'), None
+                self.credit += get_rate(self.camera, self.elapsed) * RATE_STEP_SECONDS
+                self.elapsed += RATE_STEP_SECONDS
+            self.credit -= 1
+            due = self.elapsed
+        frame = self.frames[self.index]
+        self.index = (self.index + 1) % len(self.frames)
+        self.sequence += 1
+        return due, frame
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.values = []
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.values.append(seconds * 1000)
+
+    def summary(self):
+        counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        for value in self.values:
+            counts[next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if value <= bound), len(HISTOGRAM_BUCKETS_MS))] += 1
+        return {
+            'Count': len(self.values),
+            'P50Ms': round(percentile(self.values, 50), 1),
+            'P90Ms': round(percentile(self.values, 90), 1),
+            'P99Ms': round(percentile(self.values, 99), 1),
+            'MaxMs': round(max(self.values), 1) if self.values else 0,
+            'Buckets': {('<=' + str(bound)) if i < len(HISTOGRAM_BUCKETS_MS) else '>' + str(HISTOGRAM_BUCKETS_MS[-1]): count
+                        for i, (bound, count) in enumerate(zip(HISTOGRAM_BUCKETS_MS + [None], counts))}
+        }
+
+
+def print_histogram(name, summary):
+    print('\n{} - {} requests - p50 {}ms - p90 {}ms - p99 {}ms - max {}ms'.format(
+        name, summary['Count'], summary['P50Ms'], summary['P90Ms'], summary['P99Ms'], summary['MaxMs']))
+    largest = max(summary['Buckets'].values()) or 1
+    for bucket, count in summary['Buckets'].items():
+        print('  {:>8}ms {:>7} {}'.format(bucket, count, '#' * int(round(40.0 * count / largest))))
+
+
+def main():
+    print('########### Lookout For Vision - Serverless App - Load Generator ############\n')
+
+    try:
+        args = parse_args(sys.argv[1:])
+        concurrency = max(1, args.concurrency)
+        frames = list(list_images(args.corpus, args.extension))
+        if not frames:
+            raise Exception('No frames found in ' + args.corpus)
+        cameras = load_cameras(args)
+
+        print('Frame corpus: {} ({} frames)'.format(args.corpus, len(frames)))
+        print('API Endpoint: ' + args.api_endpoint)
+        print('Cameras: {} on {} assembly lines'.format(len(cameras), len(set(camera['assemblylineid'] for camera in cameras))))
+        print('Duration: {} seconds'.format(args.duration))
+        print('Concurrency: ' + str(concurrency))
+        print('\nStarting load generation....')
+
+        session = create_session(concurrency)
+        histograms = {'SignedUrl': Histogram(), 'Put': Histogram(), 'Lag': Histogram()}
+        lock = threading.Lock()
+        stats = {'success': 0, 'failure': 0, 'late': 0, 'bytes': 0}
+        per_camera = {camera['cameraid']: 0 for camera in cameras}
+        # Bounds the requests queued behind busy workers - when it is exhausted, lag builds up
+        in_flight = threading.BoundedSemaphore(concurrency * 2)
+
+        def upload_frame(camera, frame, sequence, due_time):
+            try:
+                start = time.time()
+                lag = start - due_time
+                histograms['Lag'].add(max(0, lag))
+                image_id = '{}-{:08d}-{}'.format(camera['cameraid'], sequence, frame.name)
+                capture_time = datetime.datetime.fromtimestamp(due_time, datetime.timezone.utc).isoformat()
+                upload_url = get_signed_url(session, args.api_endpoint, args.auth_token, camera['cameraid'],
+                                            camera['assemblylineid'], image_id, get_content_type(frame.path), capture_time)
+                url_received = time.time()
+                histograms['SignedUrl'].add(url_received - start)
+                upload_file(session, upload_url, frame.path)
+                histograms['Put'].add(time.time() - url_received)
+                with lock:
+                    stats['success'] += 1
+                    stats['bytes'] += frame.stat().st_size
+                    stats['late'] += lag > LATE_THRESHOLD_SECONDS
+                    per_camera[camera['cameraid']] += 1
+            except Exception as e:
+                with lock:
+                    stats['failure'] += 1
+                print('Upload failed - ' + str(e))
+            finally:
+                in_flight.release()
+
+        # Every camera starts at a different frame of the corpus
+        schedules = [CameraSchedule(camera, frames, i * len(frames) // len(cameras), args.duration) for i, camera in enumerate(cameras)]
+        queue = []
+        for i, schedule in enumerate(schedules):
+            due, frame = schedule.next_frame()
+            heapq.heappush(queue, (due, i, frame))
+
+        run_start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while queue and queue[0][0] < args.duration:
+                due, i, frame = heapq.heappop(queue)
+                delay = run_start + due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                in_flight.acquire()
+                schedule = schedules[i]
+                executor.submit(upload_frame, schedule.camera, frame, schedule.sequence, run_start + due)
+                next_due, next_frame = schedule.next_frame()
+                heapq.heappush(queue, (next_due, i, next_frame))
+        elapsed = time.time() - run_start
+
+        summary = {
+            'Cameras': len(cameras),
+            'Seconds': round(elapsed, 2),
+            'Uploaded': stats['success'],
+            'Failed': stats['failure'],
+            'Late': stats['late'],
+            'FramesPerSecond': round(stats['success'] / elapsed, 2) if elapsed else 0,
+            'MegabytesPerSecond': round(stats['bytes'] / (1024.0 * 1024.0) / elapsed, 2) if elapsed else 0,
+            'CameraFramesPerSecond': {camera_id: round(count / elapsed, 2) for camera_id, count in per_camera.items()},
+            'Latency': {name: histogram.summary() for name, histogram in histograms.items()}
+        }
+
+        print('\nLoad generation completed')
+        print('{} frames uploaded, {} failed, {} started more than {}ms late'.format(
+            summary['Uploaded'], summary['Failed'], summary['Late'], int(LATE_THRESHOLD_SECONDS * 1000)))
+        print('Elapsed: {:.2f}s - {:.2f} frames/s - {:.2f} MB/s'.format(elapsed, summary['FramesPerSecond'], summary['MegabytesPerSecond']))
+        for name in ['SignedUrl', 'Put', 'Lag']:
+            print_histogram(name, summary['Latency'][name])
+
+        if args.save:
+            with open(args.save, 'w') as save_file:
+                json.dump(summary, save_file, indent=2)
+
+    except Exception as e:
+        print(e)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
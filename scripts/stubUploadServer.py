@@ -0,0 +1,103 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#!/usr/bin/python
+
+import argparse
+import json
+import random
+import sys
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Local stand-in for the signed URL API and S3, to exercise the uploader and the load generator
+# without a deployed stack. Uploads are read and discarded.
+# Execute as - script.py [--port N] [--url-latency-ms MS] [--put-latency-ms MS] [--jitter-ms MS] [--failure-rate RATE]
+# For Example:
+# python stubUploadServer.py --port 8080 --put-latency-ms 40 --jitter-ms 20
+# python loadGenerator.py ../resources/circuitboard/extra_images http://127.0.0.1:8080/getsignedurl allow --cameras 10 --fps 5
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Lookout For Vision - Serverless App - Stub Upload Server')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    parser.add_argument('--url-latency-ms', type=float, default=0, help='Delay before answering signed URL requests (default: 0)')
+    parser.add_argument('--put-latency-ms', type=float, default=0, help='Delay before answering uploads (default: 0)')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random delay of up to this many ms added to every response (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0, help='Share of requests answered with a 503 (default: 0)')
+    return parser.parse_args(args)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep connections open like API Gateway and S3 do
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def delay(self, latency_ms):
+        time.sleep((latency_ms + random.uniform(0, self.server.args.jitter_ms)) / 1000.0)
+        return random.random() >= self.server.args.failure_rate
+
+    def do_GET(self):
+        """
+        Answers like the S3UploaderFunction - the authorizer of the stack denies the 'deny' token.
+        """
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if self.headers.get('authorizationToken') == 'deny':
+            return self.respond(403, b'{"Message":"User is not authorized to access this resource"}')
+        if not self.delay(self.server.args.url_latency_ms):
+            return self.respond(503, b'{"message":"Service Unavailable"}')
+        image_id = params.get('imageid', ['image'])[0]
+        upload_url = 'http://{}:{}/upload/{}'.format(self.server.server_address[0], self.server.server_address[1], urllib.parse.quote(image_id))
+        self.respond(200, json.dumps({'uploadURL': upload_url, 'Key': image_id}).encode('utf-8'))
+
+    def do_PUT(self):
+        remaining = int(self.headers.get('Content-Length', '0'))
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 65536)))
+        if not self.delay(self.server.args.put_latency_ms):
+            return self.respond(503, b'<Error><Code>SlowDown</Code></Error>', 'application/xml')
+        self.respond(200, content_type='application/xml')
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    server = ThreadingServer(('127.0.0.1', args.port), StubHandler)
+    server.args = args
+    print('Stub upload server listening on http://127.0.0.1:{}/getsignedurl'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,19 +16,37 @@
  
 #!/usr/bin/python
 
+import argparse
+import collections
+import datetime
+import io
+import json
 import os
+import shutil
+import signal
+import tarfile
 import sys
-import datetime
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 sys.path.extend(["packages","scripts/packages"])
 import requests
+from requests.adapters import HTTPAdapter
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
 
-# Execute as - script.py SourceDirectoryPath CameraID AssemblyLineID API_ENDPOINT AUTH_TOKEN TIME_BETWEEN_REQUESTS
+# Execute as - script.py SourceDirectoryPath CameraID AssemblyLineID API_ENDPOINT AUTH_TOKEN TIME_BETWEEN_REQUESTS [--concurrency N] [--checkpoint FILE] [--watch]
 # For Example:
 # Allow Upload -> python uploadImages-args.py ../resources/circuitboard/extra_images CAM123456 ASM123456 https://XYZ.amazonaws.com/Prod/getsignedurl allow 0
 # Deny Upload -> python uploadImages-args.py ../resources/circuitboard/extra_images CAM123456 ASM123456 https://XYZ.amazonaws.com/Prod/getsignedurl deny 0
 # Different Camera ID -> python uploadImages-args.py ../resources/circuitboard/extra_images CAM223456 ASM123456 https://XYZ.amazonaws.com/Prod/getsignedurl allow 0
 # Different AssemblyLineId -> python uploadImages-args.py ../resources/circuitboard/extra_images CAM123456 ASM223456 https://XYZ.amazonaws.com/Prod/getsignedurl allow 0
+# Concurrent, resumable upload -> python uploadImages-args.py ../resources/circuitboard/extra_images CAM123456 ASM123456 https://XYZ.amazonaws.com/Prod/getsignedurl allow 0 --concurrency 16 --checkpoint upload.checkpoint
+# Bursts of 20 frames per upload -> python uploadImages-args.py ../resources/circuitboard/extra_images CAM123456 ASM123456 https://XYZ.amazonaws.com/Prod/getsignedurl allow 0 --archive-frames 20
+# Watch for new frames and move them away once uploaded -> python uploadImages-args.py /var/camera/frames CAM123456 ASM123456 https://XYZ.amazonaws.com/Prod/getsignedurl allow 0 --watch --concurrency 8 --move-uploaded /var/camera/uploaded
 
 # Example Inputs:
 # DIRECTORY = '../resources/circuitboard/extra_images'
@@ -38,75 +56,598 @@ import requests
 # AUTH_TOKEN = 'allow|deny'
 # TIME_BETWEEN_REQUESTS = 3 (seconds)
 
+IMAGE_CONTENT_TYPES = {'.jpeg': 'image/jpeg', '.jpg': 'image/jpeg', '.png': 'image/png'}
+# The stack only scores uploads whose key ends with its ImageFileExtension parameter
+IMAGE_EXTENSIONS = ['jpeg', 'jpg', 'png']
+DEFAULT_IMAGE_EXTENSION = 'jpeg'
+ARCHIVE_CONTENT_TYPE = 'application/x-tar'
+# Index of uploaded images kept in the watched directory when --checkpoint is not given
+DEFAULT_WATCH_INDEX = '.uploadImages.index'
+# With filesystem events, the directory is still scanned now and then for events that were missed
+RESCAN_INTERVAL_SECONDS = 30
+# A watched image that failed to upload is retried after this delay, doubled after every failure
+RETRY_DELAY_SECONDS = 0.5
+MAX_RETRY_DELAY_SECONDS = 30
+# Entries appended to an index keyed by name, size and modification time before it is compacted
+INDEX_COMPACT_ENTRIES = 10000
 
-def main():
-    args = sys.argv[1:]
-    print('########### Lookout For Vision - Serverless App - Image Uploader ############\n')
 
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Lookout For Vision - Serverless App - Image Uploader')
+    parser.add_argument('directory', help='Directory containing the images to upload')
+    parser.add_argument('camera_id', help='Camera/device ID')
+    parser.add_argument('assembly_line_id', help='Assembly line ID')
+    parser.add_argument('api_endpoint', help='API endpoint URL for getting signed URLs')
+    parser.add_argument('auth_token', help='Authorization token')
+    parser.add_argument('time_between_requests', type=float, help='Seconds to wait between uploads (per worker)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of concurrent uploads (default: 1)')
+    parser.add_argument('--checkpoint', help='File recording uploaded images so that an interrupted run can resume')
+    parser.add_argument('--extension', choices=IMAGE_EXTENSIONS, default=DEFAULT_IMAGE_EXTENSION,
+                        help='ImageFileExtension of the stack - only images with this extension are uploaded (default: jpeg)')
+    parser.add_argument('--archive-frames', type=int, default=1,
+                        help='Pack this many frames into each uploaded tar archive (default: 1 - upload images individually)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and upload new images as soon as they are fully written to the directory')
+    parser.add_argument('--settle-time', type=float, default=0.05,
+                        help='Seconds an image must stay unchanged to count as fully written, unless its writer '
+                             'closed or renamed it (default: 0.05)')
+    parser.add_argument('--poll-interval', type=float, default=0.1,
+                        help='Seconds between directory scans when watchdog is not installed (default: 0.1)')
+    parser.add_argument('--max-pending', type=int, default=1000,
+                        help='Images tracked in memory while uploads fall behind - the rest wait on disk (default: 1000)')
+    after_upload = parser.add_mutually_exclusive_group()
+    after_upload.add_argument('--delete-uploaded', action='store_true', help='Delete images once uploaded')
+    after_upload.add_argument('--move-uploaded', metavar='DIRECTORY', help='Move images to this directory once uploaded')
+    return parser.parse_args(args)
+
+
+def create_session(concurrency):
+    """
+    Returns a session whose connection pool can keep a connection open for
+    every signed URL request and upload in flight.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency * 2)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def is_image(path, extension=DEFAULT_IMAGE_EXTENSION):
+    # Case sensitive like the suffix filter of the bucket notification
+    return path.endswith('.' + extension)
+
+
+def get_content_type(path):
+    return IMAGE_CONTENT_TYPES[os.path.splitext(path)[1].lower()]
+
+
+def list_images(directory, extension=DEFAULT_IMAGE_EXTENSION):
+    for file in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if file.is_file() and is_image(file.name, extension):
+            yield file
+
+
+def load_checkpoint(checkpoint_path):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as checkpoint_file:
+        return set(line.rstrip('\n') for line in checkpoint_file if line.strip())
+
+
+def batch_images(files, batch_size):
+    batch = []
+    for file in files:
+        batch.append(file)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_archive(files, camera_id, assembly_line_id):
+    """
+    Packs a burst of frames into an in-memory tar archive. The manifest is
+    written first so that the detection side knows the ids of each frame
+    before it streams the frames.
+    """
+    manifest = {'frames': [{
+        'name': file.name,
+        'cameraid': camera_id,
+        'assemblylineid': assembly_line_id,
+        'imageid': file.name,
+        'capturetime': get_capture_time(file)
+    } for file in files]}
+    manifest_body = json.dumps(manifest).encode('utf-8')
+
+    archive_body = io.BytesIO()
+    with tarfile.open(fileobj=archive_body, mode='w') as archive:
+        manifest_info = tarfile.TarInfo('manifest.json')
+        manifest_info.size = len(manifest_body)
+        manifest_info.mtime = time.time()
+        archive.addfile(manifest_info, io.BytesIO(manifest_body))
+        for file in files:
+            archive.add(file.path, arcname=file.name)
+    archive_body.seek(0)
+    return archive_body
+
+
+def get_archive_name(files):
+    return os.path.splitext(files[0].name)[0] + '-' + str(len(files)) + 'frames.tar'
+
+
+def get_capture_time(file):
+    """
+    Uses the modification time of the image file as its capture time.
+    """
+    return datetime.datetime.fromtimestamp(file.stat().st_mtime, datetime.timezone.utc).isoformat()
+
+
+def get_signed_url(session, api_endpoint, auth_token, camera_id, assembly_line_id, image_id, content_type=None, capture_time=None):
+    headers = {}
+    headers['authorizationToken'] = auth_token
+    params = {}
+    params['cameraid'] = camera_id
+    params['assemblylineid'] = assembly_line_id
+    params['imageid'] = image_id
+    if content_type:
+        params['contenttype'] = content_type
+    if capture_time:
+        params['capturetime'] = capture_time
+
+    response = session.get(api_endpoint, headers=headers, params=params)
+    if response.status_code != 200:
+        raise Exception('Failed to get signed URL for ' + image_id + ' - ' + str(response.status_code) + ' ' + response.text)
+    return response.json()['uploadURL']
+
+
+def upload_file(session, upload_url, file_path):
+    """
+    Streams the file to S3 instead of reading it into memory.
+    """
+    with open(file_path, 'rb') as file_to_upload:
+        upload_response = session.put(upload_url, data=file_to_upload, headers={
+            'Content-Type': get_content_type(file_path),
+            'Content-Length': str(os.fstat(file_to_upload.fileno()).st_size)
+        })
+    if upload_response.status_code != 200:
+        raise Exception('Image upload failed for ' + file_path + ' - ' + str(upload_response.status_code))
+
+
+def upload_archive(session, upload_url, archive_name, archive_body):
+    upload_response = session.put(upload_url, data=archive_body, headers={
+        'Content-Type': ARCHIVE_CONTENT_TYPE,
+        'Content-Length': str(len(archive_body.getbuffer()))
+    })
+    if upload_response.status_code != 200:
+        raise Exception('Archive upload failed for ' + archive_name + ' - ' + str(upload_response.status_code))
+
+
+def handle_uploaded(file, delete_uploaded, move_uploaded):
+    if delete_uploaded:
+        os.remove(file.path)
+    elif move_uploaded:
+        # Linking and unlinking rather than renaming, as watchdog holds back all
+        # events for half a second after a file is renamed out of the directory
+        try:
+            os.link(file.path, os.path.join(move_uploaded, file.name))
+            os.remove(file.path)
+        except OSError:
+            shutil.move(file.path, os.path.join(move_uploaded, file.name))
+
+
+class UploadIndex(object):
+    """
+    The uploaded images, appended to the checkpoint file so that a restarted
+    upload skips them. When images are deleted or moved once uploaded,
+    cameras may reuse their names - entries are then keyed by name, size and
+    modification time, and only kept while the image is still in the
+    directory, so the file is compacted from time to time.
+    """
+
+    def __init__(self, path, directory, keyed_by_content):
+        self.path = path
+        self.directory = directory
+        self.keyed_by_content = keyed_by_content
+        self.keys = load_checkpoint(path)
+        self.appended = 0
+        self.lock = threading.Lock()
+        self.file = None
+        if path:
+            if keyed_by_content:
+                self.keys = set(key for key in self.keys if self.is_present(key))
+                self.compact()
+            self.file = open(path, 'a')
+
+    def get_key(self, name, stat):
+        if self.keyed_by_content:
+            return '\t'.join([name, str(stat.st_size), str(stat.st_mtime_ns)])
+        return name
+
+    def is_present(self, key):
+        name = key.partition('\t')[0]
+        try:
+            return self.get_key(name, os.stat(os.path.join(self.directory, name))) == key
+        except OSError:
+            return False
+
+    def contains(self, name, stat):
+        with self.lock:
+            return self.get_key(name, stat) in self.keys
+
+    def add(self, files):
+        keys = [self.get_key(file.name, file.stat()) for file in files]
+        with self.lock:
+            self.keys.update(keys)
+            if self.file:
+                self.file.write(''.join(key + '\n' for key in keys))
+                self.file.flush()
+                self.appended += len(keys)
+                if self.keyed_by_content and self.appended >= INDEX_COMPACT_ENTRIES:
+                    self.file.close()
+                    self.compact()
+                    self.file = open(self.path, 'a')
+
+    def remove(self, file):
+        """
+        Forgets an image that is no longer in the directory.
+        """
+        with self.lock:
+            self.keys.discard(self.get_key(file.name, file.stat()))
 
+    def compact(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as index_file:
+            index_file.write(''.join(key + '\n' for key in sorted(self.keys)))
+        os.replace(temporary_path, self.path)
+        self.appended = 0
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class ImageFile(object):
+    """
+    Stands in for the os.DirEntry of an image found by the directory watcher,
+    keeping the stat result that showed the image was fully written.
+    """
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat = stat
+
+    def stat(self):
+        return self._stat
+
+
+class DirectoryWatcher(object):
+    """
+    Tracks the images appearing in a directory until they are fully written.
+    An image is ready once its writer closed it or renamed it into the
+    directory, or once its size and modification time have not changed for
+    the settle time. Hidden files are left alone, as writers use them for
+    images that are renamed once complete. At most max_pending images are
+    tracked - when uploads fall behind, the others stay on disk and are
+    found by the next scan. Images that failed to upload are tracked again
+    and retried with backoff.
+    """
+
+    def __init__(self, directory, extension, settle_time, max_pending, index):
+        self.directory = directory
+        self.extension = extension
+        self.settle_time = settle_time
+        self.max_pending = max_pending
+        self.index = index
+        # path -> [(size, mtime) when last checked, time since which it is unchanged, writer finished, retry time]
+        self.pending = collections.OrderedDict()
+        # Names of the images being uploaded, and (size, mtime) of the images handled that are still in the directory
+        self.claimed = set()
+        self.handled = {}
+        self.failures = {}
+        self.overflowed = False
+        self.changed = threading.Event()
+        self.lock = threading.Lock()
+
+    def notify(self, path, complete=False):
+        name = os.path.basename(path)
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory) or name.startswith('.') \
+                or not is_image(name, self.extension):
+            return
+        with self.lock:
+            if name in self.claimed:
+                return
+            if path in self.pending:
+                self.pending[path][2] = self.pending[path][2] or complete
+            elif len(self.pending) >= self.max_pending:
+                self.overflowed = True
+                return
+            else:
+                self.pending[path] = [None, 0, complete, 0]
+        self.changed.set()
+
+    def scan(self):
+        with self.lock:
+            self.overflowed = False
+        for file in list_images(self.directory, self.extension):
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            # Unchanged images that were already handled are not tracked again
+            if self.handled.get(file.name) != (stat.st_size, stat.st_mtime_ns):
+                self.notify(file.path)
+
+    def needs_scan(self):
+        with self.lock:
+            return self.overflowed and len(self.pending) < self.max_pending // 2
+
+    def take_ready(self, limit):
+        """
+        Returns up to limit fully written images, in the order they appeared.
+        """
+        self.changed.clear()
+        with self.lock:
+            candidates = list(self.pending.items())
+        now = time.time()
+        ready = []
+        for path, entry in candidates:
+            if len(ready) == limit:
+                break
+            if entry[3] > now:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                with self.lock:
+                    self.pending.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if entry[0] is None:
+                entry[1] = stat.st_mtime
+            elif signature != entry[0]:
+                entry[1] = now
+            entry[0] = signature
+            if stat.st_size and (entry[2] or now - entry[1] >= self.settle_time):
+                name = os.path.basename(path)
+                with self.lock:
+                    self.pending.pop(path, None)
+                    if self.index.contains(name, stat):
+                        self.handled[name] = signature
+                        continue
+                    self.handled.pop(name, None)
+                    self.claimed.add(name)
+                ready.append(ImageFile(path, stat))
+        return ready
+
+    def uploaded(self, file, removed):
+        with self.lock:
+            self.claimed.discard(file.name)
+            self.failures.pop(file.name, None)
+            if not removed:
+                self.handled[file.name] = (file.stat().st_size, file.stat().st_mtime_ns)
+
+    def failed(self, file):
+        """
+        Tracks an image that failed to upload again, to be retried after a delay.
+        """
+        with self.lock:
+            self.claimed.discard(file.name)
+            failures = self.failures.get(file.name, 0) + 1
+            self.failures[file.name] = failures
+            delay = min(MAX_RETRY_DELAY_SECONDS, RETRY_DELAY_SECONDS * 2 ** (failures - 1))
+            self.pending[file.path] = [None, 0, True, time.time() + delay]
+        self.changed.set()
+        return delay
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.pending)
+
+
+if Observer:
+    class ImageEventHandler(FileSystemEventHandler):
+        """
+        Passes filesystem events for the watched directory to the watcher.
+        Closing a file after writing and renaming a file into the directory
+        both mean that the image is complete.
+        """
+
+        def __init__(self, watcher):
+            super(ImageEventHandler, self).__init__()
+            self.watcher = watcher
+
+        def on_created(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.dest_path, complete=True)
+
+        def on_closed(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path, complete=True)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_summary(stats, elapsed):
+    megabytes = stats['bytes'] / (1024.0 * 1024.0)
+    print('\nUpload process completed')
+    print(str(stats['success']) + ' files uploaded successfully')
+    print(str(stats['failure']) + ' files could not be uploaded')
+    if stats['skipped']:
+        print(str(stats['skipped']) + ' files skipped - already uploaded according to the checkpoint')
+    print('Elapsed: {:.2f}s - {:.2f} files/s - {:.2f} MB/s'.format(
+        elapsed, stats['success'] / elapsed if elapsed else 0, megabytes / elapsed if elapsed else 0))
+    print('Per-file latency: p50 {:.0f}ms - p99 {:.0f}ms'.format(
+        percentile(stats['latencies'], 50) * 1000, percentile(stats['latencies'], 99) * 1000))
+    if stats['frame_latencies']:
+        print('Frame to upload latency: p50 {:.0f}ms - p99 {:.0f}ms'.format(
+            percentile(stats['frame_latencies'], 50) * 1000, percentile(stats['frame_latencies'], 99) * 1000))
+
+
+def main():
+    print('########### Lookout For Vision - Serverless App - Image Uploader ############\n')
 
     try:
-        DIRECTORY = args[0]
-        CAMERA_ID = args[1]
-        ASSEMBLY_LINE_ID = args[2]
-        API_ENDPOINT = args[3]
-        AUTH_TOKEN = args[4]
-        TIME_BETWEEN_REQUESTS = int(args[5])
-        IMAGE_EXTENSION_TYPE = '.jpeg'
-        
-        print('Image Source Directory: ' + DIRECTORY)
-        print('Camera: ' + CAMERA_ID)
-        print('AssemblyLine: ' + ASSEMBLY_LINE_ID)
-        print('API Endpoint: ' + API_ENDPOINT)
-        print('Time Delay: ' + args[5]  + 'seconds')
+        args = parse_args(sys.argv[1:])
+        concurrency = max(1, args.concurrency)
+        archive_frames = max(1, args.archive_frames)
+        checkpoint = args.checkpoint
+        if args.watch and not checkpoint:
+            checkpoint = os.path.join(args.directory, DEFAULT_WATCH_INDEX)
+
+        print('Image Source Directory: ' + args.directory)
+        print('Camera: ' + args.camera_id)
+        print('AssemblyLine: ' + args.assembly_line_id)
+        print('API Endpoint: ' + args.api_endpoint)
+        print('Time Delay: ' + str(args.time_between_requests) + ' seconds')
+        print('Concurrency: ' + str(concurrency))
+        if archive_frames > 1:
+            print('Frames per archive: ' + str(archive_frames))
+        if args.watch:
+            print('Watching for new images using ' + ('filesystem events' if Observer else
+                                                      'a scan every ' + str(args.poll_interval) + ' seconds'))
+            print('Uploaded image index: ' + checkpoint)
+        if args.move_uploaded:
+            os.makedirs(args.move_uploaded, exist_ok=True)
         print('\nStarting with image upload process....')
-        
-        file_count_success = 0
-        file_count_failure = 0
-        
-        for file in os.scandir(DIRECTORY):
-            if file.is_file():
-                file_path = file.path
-                if (file_path.endswith(IMAGE_EXTENSION_TYPE)):
-
-                    print('\nUploading image file: ' + file_path)
-                    IMAGE_ID = file.name
-                    headers = {}
-                    headers['authorizationToken'] = AUTH_TOKEN
-                    params = {}
-                    params['cameraid'] = CAMERA_ID
-                    params['assemblylineid'] = ASSEMBLY_LINE_ID
-                    params['imageid'] = IMAGE_ID
-                    
-                    response = requests.request('GET', API_ENDPOINT, headers=headers, params=params)
-                    response_json = response.json()
-
-                    print('Response from API Gateway when fetching signed URL: ' + str(response.status_code))
-
-                    if response.status_code == 200:
-                        print('Signed URL received - proceeding with image upload...')
-                        upload_url = response_json['uploadURL']
-
-                        with open(file_path, 'rb') as file_to_upload:
-                            file_content = file_to_upload.read()
-                            upload_response = requests.request('PUT', upload_url, data=file_content, headers={'Content-Type': 'image/jpeg'})
-
-                            print('Image upload response: ' +
-                                str(upload_response.status_code))
-                            if upload_response.status_code == 200:
-                                print('Image uploaded successfully...')
-                                file_count_success+=1
-                            else:
-                                print('Image upload failed...')
-                                file_count_failure+=1
-                    else:
-                        print('\nUpload failed - error encountered - ' + response.text)
-
-                    time.sleep(TIME_BETWEEN_REQUESTS)
-        print('\nUpload process completed')
-        print(str(file_count_success) + ' files uploaded successfully')
-        print(str(file_count_failure)  + ' files could not be uploaded')
-        
+
+        # Once deleted or moved, the names of uploaded images may be reused
+        removes_uploaded = bool(args.delete_uploaded or args.move_uploaded)
+        index = UploadIndex(checkpoint, args.directory, removes_uploaded)
+        watcher = DirectoryWatcher(args.directory, args.extension, args.settle_time, max(1, args.max_pending), index) if args.watch else None
+        session = create_session(concurrency)
+        lock = threading.Lock()
+        stats = {'success': 0, 'failure': 0, 'skipped': 0, 'bytes': 0, 'latencies': [], 'frame_latencies': []}
+        # Bounds the files whose signed URL is being fetched or which are being uploaded
+        in_flight = threading.BoundedSemaphore(concurrency * 2)
+        run_start = time.time()
+
+        def process_files(files, url_future, start):
+            try:
+                upload_url = url_future.result()
+                if archive_frames == 1:
+                    upload_file(session, upload_url, files[0].path)
+                else:
+                    upload_archive(session, upload_url, get_archive_name(files), build_archive(files, args.camera_id, args.assembly_line_id))
+                uploaded_at = time.time()
+                with lock:
+                    stats['success'] += len(files)
+                    stats['bytes'] += sum(file.stat().st_size for file in files)
+                    stats['latencies'].append(uploaded_at - start)
+                    if args.watch:
+                        # Images that were already waiting when the watch started would skew the latency
+                        stats['frame_latencies'].extend(uploaded_at - file.stat().st_mtime
+                                                        for file in files if file.stat().st_mtime >= run_start)
+                index.add(files)
+                for file in files:
+                    print('Image uploaded successfully: ' + file.path)
+                    try:
+                        handle_uploaded(file, args.delete_uploaded, args.move_uploaded)
+                        if removes_uploaded:
+                            index.remove(file)
+                    except Exception as e:
+                        print('\nCould not remove uploaded image ' + file.path + ' - ' + str(e))
+                    if watcher:
+                        watcher.uploaded(file, removes_uploaded and not os.path.exists(file.path))
+            except Exception as e:
+                with lock:
+                    stats['failure'] += len(files)
+                print('\nUpload failed - error encountered - ' + str(e))
+                if watcher:
+                    for file in files:
+                        print('Retrying ' + file.path + ' in {:.1f} seconds'.format(watcher.failed(file)))
+            finally:
+                time.sleep(args.time_between_requests)
+                in_flight.release()
+
+        def submit_files(files, url_executor, upload_executor):
+            # Blocks while the uploads are behind, which holds back the directory watch
+            in_flight.acquire()
+            start = time.time()
+            if archive_frames == 1:
+                url_future = url_executor.submit(get_signed_url, session, args.api_endpoint, args.auth_token,
+                                                 args.camera_id, args.assembly_line_id, files[0].name,
+                                                 get_content_type(files[0].name), get_capture_time(files[0]))
+            else:
+                url_future = url_executor.submit(get_signed_url, session, args.api_endpoint, args.auth_token,
+                                                 args.camera_id, args.assembly_line_id, get_archive_name(files),
+                                                 ARCHIVE_CONTENT_TYPE)
+            upload_executor.submit(process_files, files, url_future, start)
+
+        def pending_images():
+            for file in list_images(args.directory, args.extension):
+                if index.contains(file.name, file.stat()):
+                    stats['skipped'] += 1
+                    continue
+                yield file
+
+        def stop_watch(signum, frame):
+            raise KeyboardInterrupt()
+
+        def watch_directory(url_executor, upload_executor):
+            signal.signal(signal.SIGTERM, stop_watch)
+            observer = None
+            if Observer:
+                observer = Observer()
+                observer.schedule(ImageEventHandler(watcher), args.directory, recursive=False)
+                observer.start()
+            watcher.scan()
+            last_scan = time.time()
+            falling_behind = False
+            try:
+                while True:
+                    scan_interval = RESCAN_INTERVAL_SECONDS if observer else args.poll_interval
+                    if watcher.needs_scan() or time.time() - last_scan >= scan_interval:
+                        watcher.scan()
+                        last_scan = time.time()
+                    if watcher.overflowed != falling_behind:
+                        falling_behind = watcher.overflowed
+                        print('\nUploads are falling behind - more than ' + str(args.max_pending) + ' images are waiting'
+                              if falling_behind else '\nUploads caught up with the images written')
+                    files = watcher.take_ready(concurrency * archive_frames)
+                    for batch in batch_images(files, archive_frames):
+                        submit_files(batch, url_executor, upload_executor)
+                    if not files:
+                        timeout = scan_interval - (time.time() - last_scan)
+                        if watcher.has_pending():
+                            timeout = min(timeout, args.settle_time / 2)
+                        watcher.changed.wait(max(0, timeout))
+            except KeyboardInterrupt:
+                print('\nStopping the directory watch - waiting for the uploads in flight....')
+            finally:
+                if observer:
+                    observer.stop()
+                    observer.join()
+
+        # Signed URLs are fetched by their own pool, so that URLs for the next
+        # files are ready while the current uploads are still in flight
+        with ThreadPoolExecutor(max_workers=concurrency) as url_executor, \
+                ThreadPoolExecutor(max_workers=concurrency) as upload_executor:
+            if args.watch:
+                watch_directory(url_executor, upload_executor)
+            else:
+                for files in batch_images(pending_images(), archive_frames):
+                    submit_files(files, url_executor, upload_executor)
+
+        index.close()
+        print_summary(stats, time.time() - run_start)
+
     except Exception as e:
         print(e)
         sys.exit(2)
@@ -0,0 +1,95 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'benchmarks'),
+    os.path.join(ROOT, 'functions', 'DetectAnomaliesFunction'),
+    os.path.join(ROOT, 'functions', 'DynamoDbToFirehose'),
+    os.path.join(ROOT, 'functions', 'InstrumentationLayer', 'python')
+]
+
+from coldStartBenchmark import ENVIRONMENT  # noqa: E402
+from localServices import LocalDynamoDb, LocalServices  # noqa: E402
+
+# The handlers read their configuration at import - the features under test are enabled
+# with tables of their own, and their clients are pointed at the in-process stand-ins
+os.environ.update(ENVIRONMENT)
+os.environ.update({
+    'DeliveryStreamName': 'test',
+    'RATE_LIMITER_TABLE_NAME': 'test-rate-limiter',
+    'ALERT_WINDOW_TABLE_NAME': 'test-alert-windows',
+    'AGGREGATES_TABLE_NAME': 'test-aggregates'
+})
+
+import awsClients  # noqa: E402
+
+awsClients.set_factory(LocalServices().factory)
+
+TABLE_SCHEMAS = {
+    ENVIRONMENT['DYNAMODB_TABLE_NAME']: (('CameraId', 'DateTime'), {
+        'AssemblyLineIndex': ('AssemblyLineId', 'DateTime'),
+        'AnomalyIndex': ('AnomalousAssemblyLineId', 'DateTime')
+    }),
+    'test-rate-limiter': (('LimiterId',), None),
+    'test-alert-windows': (('WindowKey',), None),
+    'test-aggregates': (('Dimension', 'Window'), None)
+}
+
+
+class Clock(object):
+    """
+    Stands in for the time module of a handler - sleeping advances the clock.
+    """
+
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock(1000.0)
+
+
+@pytest.fixture
+def dynamodb():
+    """
+    An empty DynamoDB stand-in with the tables of the template.
+    """
+    return LocalDynamoDb(schemas=TABLE_SCHEMAS, streamed_tables=[ENVIRONMENT['DYNAMODB_TABLE_NAME']])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Records the delays of time.sleep instead of waiting.
+    """
+    delays = []
+    monkeypatch.setattr('time.sleep', delays.append)
+    return delays
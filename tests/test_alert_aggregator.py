@@ -0,0 +1,119 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+import pytest
+
+import alertAggregator
+from localServices import LocalSns
+
+WINDOW_SECONDS = alertAggregator.ALERT_WINDOW_SECONDS
+
+
+def alert(index, camera_id='CAM1', confidence=0.9):
+    return {
+        'CameraId': camera_id,
+        'AssemblyLineId': 'ASM1',
+        'ImageId': 'image{}.jpeg'.format(index),
+        'ImageUrl': 's3://bucket/image{}.jpeg'.format(index),
+        'IsAnomalous': True,
+        'Confidence': confidence
+    }
+
+
+@pytest.fixture
+def sns(monkeypatch):
+    sns = LocalSns()
+    monkeypatch.setattr(alertAggregator, 'sns', sns)
+    return sns
+
+
+@pytest.fixture
+def windows_table(monkeypatch, dynamodb, clock):
+    monkeypatch.setattr(alertAggregator, 'dynamodb', dynamodb)
+    monkeypatch.setattr(alertAggregator, 'time', clock)
+    return dynamodb.Table('test-alert-windows')
+
+
+def get_digests(sns):
+    return [json.loads(message['Message'])['email'] for message in sns.messages]
+
+
+def test_first_alert_of_a_window_is_sent_and_the_others_are_counted(windows_table):
+    assert alertAggregator.record_alert(alert(1), False)
+    assert not alertAggregator.record_alert(alert(2, confidence=0.5), True)
+    assert not alertAggregator.record_alert(alert(3, confidence=0.95), False)
+    assert alertAggregator.record_alert(alert(4, camera_id='CAM2'), False)
+
+    window = windows_table.items[('ASM1#CAM1',)]
+    assert (window['Count'], window['Anomalies'], window['LowConfidence']) == (2, 2, 1)
+    assert (float(window['ConfidenceMin']), float(window['ConfidenceMax'])) == (0.5, 0.95)
+    assert window['SampleImageUrls'] == ['s3://bucket/image2.jpeg', 's3://bucket/image3.jpeg']
+
+
+def test_retried_opening_alert_is_sent_again_without_being_counted(windows_table):
+    assert alertAggregator.record_alert(alert(1), False)
+    assert alertAggregator.record_alert(alert(1), False)
+    assert windows_table.items[('ASM1#CAM1',)]['Count'] == 0
+
+
+def test_digest_is_published_once_after_the_window_expires(windows_table, sns, clock):
+    for index in range(3):
+        alertAggregator.record_alert(alert(index), False)
+    assert alertAggregator.flush_expired_windows() == 0
+
+    clock.now += WINDOW_SECONDS + 1
+    assert alertAggregator.flush_expired_windows() == 1
+    assert alertAggregator.flush_expired_windows() == 0
+    assert get_digests(sns)[0].startswith('2 further alerts')
+    assert list(windows_table.items) == []
+
+
+def test_expired_window_replaced_by_a_new_alert_keeps_its_digest(windows_table, sns, clock):
+    for index in range(3):
+        alertAggregator.record_alert(alert(index), False)
+    clock.now += WINDOW_SECONDS + 1
+    assert alertAggregator.record_alert(alert(10), False)
+    assert windows_table.items[('ASM1#CAM1',)]['FirstImageUrl'] == 's3://bucket/image10.jpeg'
+
+    assert alertAggregator.flush_expired_windows() == 1
+    assert get_digests(sns)[0].startswith('2 further alerts')
+    assert list(windows_table.items) == [('ASM1#CAM1',)]
+
+
+def test_digest_is_kept_until_it_is_published(windows_table, sns, clock, monkeypatch):
+    for index in range(2):
+        alertAggregator.record_alert(alert(index), False)
+    clock.now += WINDOW_SECONDS + 1
+
+    publish = sns.publish
+    outages = [1]
+
+    def unavailable_once(**kwargs):
+        if outages:
+            outages.pop()
+            raise Exception('SNS unavailable')
+        return publish(**kwargs)
+
+    monkeypatch.setattr(sns, 'publish', unavailable_once)
+    with pytest.raises(Exception):
+        alertAggregator.flush_expired_windows()
+    # A new alert does not reopen the closed window
+    assert alertAggregator.record_alert(alert(10), False)
+
+    assert alertAggregator.flush_expired_windows() == 1
+    assert get_digests(sns)[0].startswith('1 further alerts')
@@ -0,0 +1,173 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+import pytest
+
+import aggregates
+import lambda_function
+
+
+class ScriptedFirehose(object):
+    """
+    Fails the records whose data contains a marker for as many attempts as it is listed.
+    """
+
+    def __init__(self, failures=None, errors=0):
+        self.failures = dict(failures or {})
+        self.errors = errors
+        self.batches = []
+        self.delivered = []
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        self.batches.append(len(Records))
+        if self.errors:
+            self.errors -= 1
+            raise Exception('Service unavailable')
+        responses = []
+        for record in Records:
+            marker = next((marker for marker in self.failures if marker in record['Data']), None)
+            if marker and self.failures[marker] > 0:
+                self.failures[marker] -= 1
+                responses.append({'ErrorCode': 'ServiceUnavailableException'})
+            else:
+                self.delivered.append(record['Data'])
+                responses.append({'RecordId': 'id'})
+        return {'FailedPutCount': sum(1 for response in responses if 'ErrorCode' in response), 'RequestResponses': responses}
+
+
+def stream_record(sequence_number, camera_id='CAM1', minute=0, is_anomalous=False, confidence='0.9'):
+    image_id = 'image{}.jpeg'.format(sequence_number)
+    return {
+        'eventName': 'INSERT',
+        'awsRegion': 'eu-west-1',
+        'dynamodb': {
+            'SequenceNumber': str(sequence_number),
+            'NewImage': {
+                'CameraId': {'S': camera_id},
+                'DateTime': {'S': '2021-06-01T10:{:02d}:00.000000#{}'.format(minute, image_id)},
+                'AssemblyLineId': {'S': 'ASM1'},
+                'ImageId': {'S': image_id},
+                'ImageUrl': {'S': 's3://bucket/' + image_id},
+                'IsAnomalous': {'BOOL': is_anomalous},
+                'Confidence': {'N': confidence}
+            }
+        }
+    }
+
+
+@pytest.fixture
+def firehose(monkeypatch):
+    firehose = ScriptedFirehose()
+    monkeypatch.setattr(lambda_function, 'firehose', firehose)
+    return firehose
+
+
+@pytest.fixture
+def aggregates_table(monkeypatch, dynamodb):
+    monkeypatch.setattr(aggregates, 'dynamodb', dynamodb)
+    aggregates.known_extremes.clear()
+    return dynamodb.Table('test-aggregates')
+
+
+def get_window(table, dimension, window='2021-06-01T10:00'):
+    return table.items.get((dimension, window))
+
+
+def test_chunk_records_respects_count_and_size_limits(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'MAX_BATCH_BYTES', 100)
+    records = [(str(i), b'x' * 30) for i in range(1200)]
+    batches = list(lambda_function.chunk_records(records))
+    assert all(sum(len(data) for _, data in batch) <= 100 for batch in batches)
+    assert [record for batch in batches for record in batch] == records
+
+    monkeypatch.setattr(lambda_function, 'MAX_BATCH_BYTES', 4 * 1024 * 1024)
+    assert [len(batch) for batch in lambda_function.chunk_records(records)] == [500, 500, 200]
+
+
+def test_failed_records_are_retried_alone(firehose, sleeps):
+    firehose.failures = {b'"image2.jpeg"': 2}
+    records = [(str(i), lambda_function.encode_record({'ImageId': 'image{}.jpeg'.format(i)})) for i in range(1, 4)]
+    assert lambda_function.put_records_in_firehose(records) == []
+    assert firehose.batches == [3, 1, 1]
+    assert len(firehose.delivered) == 3
+    assert sleeps == [0.1, 0.2]
+
+
+def test_records_failing_every_attempt_are_reported(firehose, sleeps):
+    firehose.failures = {b'"image2.jpeg"': 10}
+    firehose.errors = 1
+    records = [(str(i), lambda_function.encode_record({'ImageId': 'image{}.jpeg'.format(i)})) for i in range(1, 4)]
+    assert lambda_function.put_records_in_firehose(records) == ['2']
+    assert len(firehose.batches) == lambda_function.MAX_PUT_ATTEMPTS
+
+
+def test_handler_reports_undelivered_records_and_aggregates_those_before(firehose, aggregates_table, sleeps):
+    firehose.failures = {b'"image2.jpeg"': 10}
+    response = lambda_function.lambda_handler({'Records': [stream_record(i) for i in range(1, 4)]}, None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+    assert get_window(aggregates_table, 'CAMERA#CAM1')['Count'] == 1
+
+
+def test_output_keeps_confidence_as_string(firehose, aggregates_table):
+    lambda_function.lambda_handler({'Records': [stream_record(1, confidence='0.95')]}, None)
+    assert json.loads(firehose.delivered[0])['Confidence'] == '0.95'
+
+
+def test_retried_batch_is_aggregated_once(firehose, aggregates_table):
+    batch = [stream_record(1, is_anomalous=True, confidence='0.4'), stream_record(2), stream_record(3, 'CAM2', 1)]
+    assert lambda_function.lambda_handler({'Records': batch}, None) == {'batchItemFailures': []}
+    # Redelivered after a timeout, with a new record appended
+    assert lambda_function.lambda_handler({'Records': batch + [stream_record(4)]}, None) == {'batchItemFailures': []}
+
+    camera = get_window(aggregates_table, 'CAMERA#CAM1')
+    assert (camera['Count'], camera['Anomalies'], camera['ConfidenceSum']) == (3, 1, aggregates.Decimal('2.2'))
+    assert (camera['ConfidenceMin'], camera['ConfidenceMax']) == (aggregates.Decimal('0.4'), aggregates.Decimal('0.9'))
+    assert get_window(aggregates_table, 'LINE#ASM1')['Count'] == 3
+    assert get_window(aggregates_table, 'CAMERA#CAM2', '2021-06-01T10:01')['Count'] == 1
+
+
+def test_failed_aggregates_are_reported_for_retry(firehose, aggregates_table, monkeypatch, sleeps):
+    dynamodb = aggregates_table.dynamodb
+    transact_write_items = dynamodb.transact_write_items
+    conflicts = [aggregates.AGGREGATES_MAX_ATTEMPTS]
+
+    def conflicting_transact_write_items(TransactItems):
+        if conflicts[0]:
+            conflicts[0] -= 1
+            raise dynamodb.exceptions.TransactionCanceledException({
+                'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                'CancellationReasons': [{'Code': 'TransactionConflict'}]
+            }, 'TransactWriteItems')
+        return transact_write_items(TransactItems=TransactItems)
+
+    monkeypatch.setattr(dynamodb, 'transact_write_items', conflicting_transact_write_items)
+    batch = [stream_record(1), stream_record(2)]
+    assert lambda_function.lambda_handler({'Records': batch}, None) == {'batchItemFailures': [{'itemIdentifier': '1'}]}
+    assert len(sleeps) == aggregates.AGGREGATES_MAX_ATTEMPTS - 1
+    assert get_window(aggregates_table, 'CAMERA#CAM1') is None
+
+    assert lambda_function.lambda_handler({'Records': batch}, None) == {'batchItemFailures': []}
+    assert get_window(aggregates_table, 'CAMERA#CAM1')['Count'] == 2
+
+
+def test_chunks_fit_in_one_transaction(monkeypatch):
+    monkeypatch.setattr(aggregates, 'MAX_TRANSACTION_ITEMS', 5)
+    items = [(str(i), {'Year': 2021, 'Month': 6, 'Day': 1, 'Hour': 10, 'Minute': i, 'CameraId': 'CAM1', 'AssemblyLineId': 'ASM1'})
+             for i in range(5)]
+    assert [[sequence_number for sequence_number, _ in chunk] for chunk in aggregates.chunk_items(items)] == [
+        ['0', '1'], ['2', '3'], ['4']]
@@ -0,0 +1,122 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+from decimal import Decimal
+
+import pytest
+
+import queryDefects
+import resultSharding
+from coldStartBenchmark import ENVIRONMENT
+
+TABLE_NAME = ENVIRONMENT['DYNAMODB_TABLE_NAME']
+
+
+@pytest.fixture
+def results(dynamodb, monkeypatch):
+    """
+    Stores 30 results of two cameras on one assembly line, every third anomalous.
+    """
+    monkeypatch.setattr(resultSharding, 'dynamodb', dynamodb)
+    monkeypatch.setattr(resultSharding, 'CAMERA_SHARD_COUNTS', {'CAM2': 3})
+    table = dynamodb.Table(TABLE_NAME)
+    stored = []
+    for index in range(30):
+        camera_id = 'CAM1' if index % 2 else 'CAM2'
+        image_id = 'image{}.jpeg'.format(index)
+        item = {
+            'CameraId': camera_id,
+            'AssemblyLineId': 'ASM1',
+            'ImageId': image_id,
+            'DateTime': '2021-06-01T10:00:{:02d}.000000#{}'.format(index, image_id),
+            'IsAnomalous': index % 3 == 0,
+            'Confidence': Decimal('0.9')
+        }
+        table.put_item(Item=resultSharding.shard_item(item))
+        stored.append(item)
+    return stored
+
+
+def get_page(params):
+    response = queryDefects.lambda_handler({'queryStringParameters': params}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def get_all_pages(params):
+    params = dict(params)
+    pages = []
+    while True:
+        status_code, body = get_page(params)
+        assert status_code == 200
+        pages.append(body['Items'])
+        if 'NextToken' not in body:
+            return pages
+        params['nexttoken'] = body['NextToken']
+
+
+def date_times(items):
+    return [item['DateTime'] for item in items]
+
+
+def newest_first(items):
+    return sorted(date_times(items), reverse=True)
+
+
+def test_camera_pages_return_every_row_once(results):
+    pages = get_all_pages({'cameraid': 'CAM1,CAM2', 'limit': '7'})
+
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    assert [item for page in pages for item in date_times(page)] == newest_first(results)
+
+
+def test_sharded_camera_rows_are_merged_unsharded(results):
+    pages = get_all_pages({'cameraid': 'CAM2', 'limit': '4'})
+
+    items = [item for page in pages for item in page]
+    assert date_times(items) == newest_first([item for item in results if item['CameraId'] == 'CAM2'])
+    assert set(item['CameraId'] for item in items) == {'CAM2'}
+
+
+def test_assembly_line_pages_skip_filtered_rows(results):
+    # The filter drops most rows of each table page, so a page of results spans several queries
+    pages = get_all_pages({'assemblylineid': 'ASM1', 'anomalous': 'true', 'limit': '3'})
+
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    items = [item for page in pages for item in page]
+    assert date_times(items) == newest_first([item for item in results if item['IsAnomalous']])
+
+
+def test_the_end_of_the_range_is_exclusive(results):
+    status_code, body = get_page({'cameraid': 'CAM1', 'from': '2021-06-01T10:00:05Z', 'to': '2021-06-01T10:00:11Z'})
+
+    assert status_code == 200
+    assert [item['ImageId'] for item in body['Items']] == ['image9.jpeg', 'image7.jpeg', 'image5.jpeg']
+    assert 'NextToken' not in body
+
+
+def test_only_the_requested_fields_are_returned(results):
+    status_code, body = get_page({'cameraid': 'CAM1', 'fields': 'ImageId', 'limit': '1'})
+
+    assert status_code == 200
+    assert set(body['Items'][0]) == {'CameraId', 'DateTime', 'ImageId'}
+
+
+@pytest.mark.parametrize('params', [{}, {'cameraid': 'CAM1', 'fields': 'ImageId,Secret'}])
+def test_invalid_requests_are_rejected(results, params):
+    status_code, body = get_page(params)
+
+    assert status_code == 400
+    assert body['Message']
@@ -0,0 +1,119 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pytest
+
+import rateLimiter
+
+LIMITER_ID = rateLimiter.RATE_LIMITER_ID
+
+
+class Context(object):
+
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+@pytest.fixture
+def limiter_table(monkeypatch, dynamodb, clock):
+    monkeypatch.setattr(rateLimiter, 'time', clock)
+    monkeypatch.setattr(rateLimiter, 'dynamodb', dynamodb)
+    monkeypatch.setattr(rateLimiter, 'state', dict(rateLimiter.state))
+    monkeypatch.setattr(rateLimiter.random, 'uniform', lambda low, high: 0)
+    return dynamodb.Table('test-rate-limiter')
+
+
+def get_row(table, name):
+    return table.items.get((LIMITER_ID + '#' + name,), {})
+
+
+def test_requests_above_the_rate_wait_for_the_next_second(limiter_table, clock):
+    rate = int(rateLimiter.RATE_LIMIT_INITIAL_TPS)
+    waits = [rateLimiter.acquire() for _ in range(rate + 1)]
+    assert waits[:rate] == [0] * rate
+    assert waits[rate] == 1
+    assert get_row(limiter_table, '1000')['Granted'] == rate
+    assert get_row(limiter_table, '1001')['Granted'] == 1
+
+
+def test_tokens_are_leased_in_batches(limiter_table, clock):
+    # The previous second's requests size the lease of the next one
+    for _ in range(5):
+        rateLimiter.acquire()
+    clock.now = 1001.0
+    for _ in range(5):
+        rateLimiter.acquire()
+    assert get_row(limiter_table, '1001')['Granted'] == 5
+    assert rateLimiter.state['Tokens'] == 0
+    rateLimiter.acquire()
+    assert get_row(limiter_table, '1001')['Granted'] == 10
+
+
+def test_waits_end_before_the_invocation_times_out(limiter_table, clock):
+    for second in range(1000, 1010):
+        limiter_table.put_item(Item={'LimiterId': LIMITER_ID + '#' + str(second), 'Granted': 100})
+    rateLimiter.set_deadline(Context((rateLimiter.RATE_LIMIT_TIME_RESERVE_SECONDS + 0.5) * 1000))
+    with pytest.raises(rateLimiter.RateLimitExceeded):
+        rateLimiter.acquire()
+    assert clock.sleeps == []
+
+
+def test_waits_are_bounded_outside_of_lambda(limiter_table, clock):
+    for second in range(1000, 1010):
+        limiter_table.put_item(Item={'LimiterId': LIMITER_ID + '#' + str(second), 'Granted': 100})
+    rateLimiter.set_deadline(None)
+    with pytest.raises(rateLimiter.RateLimitExceeded):
+        rateLimiter.acquire()
+    assert 0 < sum(clock.sleeps) <= rateLimiter.RATE_LIMIT_MAX_WAIT_SECONDS
+
+
+def test_concurrent_throttles_decrease_the_rate_once(limiter_table):
+    rateLimiter.on_throttled()
+    rateLimiter.on_throttled()
+    expected_rate = rateLimiter.RATE_LIMIT_INITIAL_TPS * rateLimiter.RATE_DECREASE_FACTOR
+    assert float(get_row(limiter_table, 'rate')['Rate']) == expected_rate
+    assert rateLimiter.get_rate() == expected_rate
+
+
+def test_rate_does_not_decrease_below_the_minimum(limiter_table):
+    rateLimiter.state['Rate'] = rateLimiter.RATE_LIMIT_MIN_TPS
+    rateLimiter.on_throttled()
+    assert float(get_row(limiter_table, 'rate')['Rate']) == rateLimiter.RATE_LIMIT_MIN_TPS
+
+
+def test_rate_increases_once_per_interval_across_instances(limiter_table, clock):
+    initial_rate = rateLimiter.RATE_LIMIT_INITIAL_TPS
+    step = rateLimiter.RATE_INCREASE_STEP_TPS
+    rateLimiter.on_success()
+    # Another instance, which has not tried to increase the rate yet
+    rateLimiter.state['LastIncreaseAttempt'] = 0
+    rateLimiter.on_success()
+    assert float(get_row(limiter_table, 'rate')['Rate']) == initial_rate + step
+
+    clock.now += rateLimiter.RATE_ADJUST_INTERVAL_SECONDS + 1
+    rateLimiter.on_success()
+    assert float(get_row(limiter_table, 'rate')['Rate']) == initial_rate + 2 * step
+    assert rateLimiter.state['Rate'] == initial_rate + 2 * step
+
+
+def test_rate_does_not_increase_right_after_a_decrease(limiter_table, clock):
+    rateLimiter.on_throttled()
+    clock.now += 1
+    rateLimiter.on_success()
+    assert float(get_row(limiter_table, 'rate')['Rate']) == rateLimiter.RATE_LIMIT_INITIAL_TPS * rateLimiter.RATE_DECREASE_FACTOR
@@ -0,0 +1,112 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+ 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+ 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from decimal import Decimal
+
+import pytest
+
+import putItemInDynamoDb
+import resultWriter
+from coldStartBenchmark import ENVIRONMENT
+
+TABLE_NAME = ENVIRONMENT['DYNAMODB_TABLE_NAME']
+
+
+class UnreliableDynamoDb(object):
+    """
+    Wraps the DynamoDB stand-in, returning the items of the scripted calls as unprocessed.
+    """
+
+    def __init__(self, dynamodb, unprocessed):
+        self.dynamodb = dynamodb
+        self.unprocessed = list(unprocessed)
+        self.calls = []
+
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems[TABLE_NAME]
+        self.calls.append(len(requests))
+        if self.unprocessed:
+            count = self.unprocessed.pop(0)
+            if count is None:
+                raise Exception('Throughput exceeded')
+            self.dynamodb.batch_write_item(RequestItems={TABLE_NAME: requests[count:]})
+            return {'UnprocessedItems': {TABLE_NAME: requests[:count]} if count else {}}
+        return self.dynamodb.batch_write_item(RequestItems=RequestItems)
+
+
+def result(index, camera_id='CAM1'):
+    image_id = 'image{}.jpeg'.format(index)
+    return {
+        'CameraId': camera_id,
+        'AssemblyLineId': 'ASM1',
+        'ImageId': image_id,
+        'DateTime': '2021-06-01T10:00:{:02d}.000000#{}'.format(index, image_id),
+        'IsAnomalous': False,
+        'Confidence': Decimal('0.9')
+    }
+
+
+@pytest.fixture
+def results_table(monkeypatch, dynamodb):
+    monkeypatch.setattr(putItemInDynamoDb, 'dynamodb', dynamodb)
+    return dynamodb.Table(TABLE_NAME)
+
+
+def use_batches(monkeypatch, dynamodb, unprocessed):
+    unreliable = UnreliableDynamoDb(dynamodb, unprocessed)
+    monkeypatch.setattr(resultWriter, 'dynamodb', unreliable)
+    return unreliable
+
+
+def test_unprocessed_items_are_retried(monkeypatch, dynamodb, sleeps):
+    unreliable = use_batches(monkeypatch, dynamodb, [10, None, 3])
+    writer = resultWriter.ResultWriter(TABLE_NAME)
+    for index in range(30):
+        writer.add(result(index))
+    assert writer.flush() == []
+    assert writer.written_count == 30
+    assert unreliable.calls == [25, 10, 10, 3, 5]
+    assert len(dynamodb.Table(TABLE_NAME).items) == 30
+    assert sleeps == [resultWriter.RESULT_WRITER_RETRY_BASE_DELAY_SECONDS * 2 ** attempt for attempt in (1, 2, 3)]
+
+
+def test_items_never_written_are_returned(monkeypatch, dynamodb, sleeps):
+    use_batches(monkeypatch, dynamodb, [2] * resultWriter.RESULT_WRITER_MAX_ATTEMPTS)
+    writer = resultWriter.ResultWriter(TABLE_NAME)
+    for index in range(5):
+        writer.add(result(index))
+    failed = writer.flush()
+    assert [item['ImageId'] for item in failed] == ['image0.jpeg', 'image1.jpeg']
+    assert writer.written_count == 3
+    assert len(sleeps) == resultWriter.RESULT_WRITER_MAX_ATTEMPTS - 1
+
+
+def test_repeated_results_are_written_once(monkeypatch, dynamodb):
+    unreliable = use_batches(monkeypatch, dynamodb, [])
+    writer = resultWriter.ResultWriter(TABLE_NAME)
+    for index in [1, 2, 1]:
+        writer.add(result(index))
+    assert writer.flush() == []
+    assert unreliable.calls == [2]
+
+
+def test_put_item_skips_results_already_stored(results_table):
+    item = result(1)
+    assert 'AlreadyStored' not in putItemInDynamoDb.put_item(item)
+    assert putItemInDynamoDb.put_item(dict(item, Confidence=Decimal('0.1'))) == {'AlreadyStored': True}
+    assert results_table.items[('CAM1', item['DateTime'])]['Confidence'] == Decimal('0.9')
+    assert putItemInDynamoDb.is_result_stored('CAM1', '2021-06-01T10:00:01.000000', 'image1.jpeg')
+    assert not putItemInDynamoDb.is_result_stored('CAM1', '2021-06-01T10:00:02.000000', 'image2.jpeg')